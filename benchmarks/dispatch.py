@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''Measures the per call dispatch overhead of Connection methods.
+
+Compares the former __getattr__ based wrapping (which built a wrapper
+function on every call) with the statically defined methods. The zookeeper
+calls themselves are replaced by no-ops, so only the client side dispatch
+is measured; no zookeeper server is needed.
+
+    python benchmarks/dispatch.py [calls]
+'''
+
+from functools import wraps
+from zkpy.connection import Connection
+import sys
+import timeit
+import zookeeper
+
+
+class GetattrConnection(Connection):
+    '''Connection with the former __getattr__ based call wrapping.'''
+
+    __wrapped_functions = set(['exists', 'get', 'get_children', 'state'])
+
+    def __getattr__(self, call):
+        if call not in self.__wrapped_functions:
+            pass # formerly logged a warning
+        wrapped = getattr(zookeeper, call)
+        if not hasattr(wrapped, '__call__'):
+            raise AttributeError
+        @wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            return wrapped(self._handle, *args, **kwargs)
+        return wrapper
+
+# the wrapped calls are looked up on the class first, remove them
+for _call in ('exists', 'get', 'get_children', 'state'):
+    setattr(GetattrConnection, _call, property(
+            lambda self, _call=_call: self.__getattr__(_call)))
+
+
+def no_op(handle, *args):
+    return None
+
+
+def unconnected(cls):
+    '''Creates a connection object without connecting it.'''
+    conn = cls.__new__(cls)
+    conn._session_handle = 0
+    conn._reconnecting = False
+    conn._zk = zookeeper
+    conn._watchers = set()
+    return conn
+
+
+# the connection under test (timeit imports it from __main__)
+conn = None
+
+def measure(connection, call, count):
+    '''Returns the time per call in nanoseconds.'''
+    global conn
+    conn = connection
+    if call == 'state':
+        statement = 'conn.state()'
+    else:
+        statement = "conn.%s('/foo')" % call
+    timer = timeit.Timer(statement, setup='from __main__ import conn')
+    return min(timer.repeat(3, count)) / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    originals = {}
+    for call in ('exists', 'get', 'get_children', 'state'):
+        originals[call] = getattr(zookeeper, call)
+        setattr(zookeeper, call, no_op)
+
+    try:
+        print '%-14s %14s %14s %8s' % ('call', '__getattr__', 'method', 'speedup')
+        for call in ('exists', 'get', 'get_children', 'state'):
+            before = measure(unconnected(GetattrConnection), call, count)
+            after = measure(unconnected(Connection), call, count)
+            print '%-14s %11.0f ns %11.0f ns %7.1fx' % (call, before, after, before / after)
+    finally:
+        for call, original in originals.items():
+            setattr(zookeeper, call, original)
+
+if __name__ == '__main__':
+    main()
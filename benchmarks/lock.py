@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''Measures the zookeeper requests per lock acquisition at large queue depths.
+
+A number of lock objects queue up for one lock, then the lock is handed
+from one to the next until the queue is drained. The requests are counted
+by the in-process fake (zkpy.testing.FakeZooKeeper), thus no zookeeper
+server is needed. Reported per lock: requests and received bytes (child
+names and node data) to enqueue and to take over the lock.
+
+    python benchmarks/lock.py [depth ...]
+'''
+
+from zkpy.acl import Acls
+from zkpy.connection import Connection
+from zkpy.lock import Lock
+from zkpy.testing import FakeZooKeeper
+import logging
+import sys
+import time
+
+PATH = '/lock-benchmark'
+
+
+def measure(depth):
+    '''Returns (enqueue stats, handover stats, seconds) per lock.'''
+    zk = FakeZooKeeper()
+    conn = Connection('fake:2181', 5, backend=zk)
+    try:
+        conn.ensure_path_exists(PATH, '', [Acls.Unsafe])
+        locks = [Lock(conn, PATH) for _i in range(depth)]
+
+        zk.reset_stats()
+        for lock in locks:
+            lock.acquire()
+        enqueue = zk.stats()
+
+        zk.reset_stats()
+        started = time.time()
+        for lock in locks:
+            if not lock.acquire(blocking=True, timeout=10):
+                raise RuntimeError('Lock was not handed over')
+            lock.release()
+        elapsed = time.time() - started
+        handover = zk.stats()
+        return enqueue, handover, elapsed
+    finally:
+        conn.close()
+
+
+def main():
+    depths = [int(depth) for depth in sys.argv[1:]] or [10, 100, 1000, 5000]
+    logging.basicConfig(level=logging.ERROR)
+
+    print '%8s %14s %14s %14s %14s %10s' % (
+        'depth', 'enqueue req', 'enqueue bytes', 'handover req', 'handover bytes', 'ms/lock')
+    for depth in depths:
+        enqueue, handover, elapsed = measure(depth)
+        print '%8d %14.2f %14.1f %14.2f %14.1f %10.3f' % (
+            depth,
+            float(enqueue['total_requests']) / depth,
+            float(enqueue['bytes_received']) / depth,
+            float(handover['total_requests']) / depth,
+            float(handover['bytes_received']) / depth,
+            elapsed / depth * 1000)
+
+
+if __name__ == '__main__':
+    main()
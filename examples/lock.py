@@ -4,7 +4,7 @@
 from __future__ import with_statement
 from zkpy.acl import Acls
 from zkpy.connection import Connection
-from zkpy.lock import Lock
+from zkpy.lock import Lock, LockManager
 
 class LockObserver(object):
     '''Observer class to get lock event notifications'''
@@ -23,10 +23,9 @@ class LockObserver(object):
 
 ZOOKEEPER_SERVER='localhost:2181'
 def main():
-    # As a lock is per connection, we need to create a connection
-    # per lock.
+    # Every lock object has a lock node of its own, thus locks on the same
+    # connection exclude each other.
     conn1 = Connection(ZOOKEEPER_SERVER, 3)
-    conn2 = Connection(ZOOKEEPER_SERVER, 3)
 
     # ensure parent path for the lock exists
     lock_node = '/locktest'
@@ -38,7 +37,7 @@ def main():
 
     # create the locks
     lock1 = Lock(conn1, lock_node, lock_observer1)
-    lock2 = Lock(conn2, lock_node, lock_observer2)
+    lock2 = Lock(conn1, lock_node, lock_observer2)
 
     # try to acquire the lock
     lock1.acquire()
@@ -48,10 +47,18 @@ def main():
     lock1.release()
     lock2.release()
 
+    # many locks on one connection
+    manager = LockManager(conn1)
+    resources = ['%s/resource-%d' % (lock_node, i) for i in range(100)]
+    for resource in resources:
+        conn1.ensure_path_exists(resource, '', [Acls.Unsafe])
+        manager.acquire(resource, blocking=True, timeout=5)
+    print len(manager.owned()), 'locks held'
+    manager.release_all()
+
     # clean up
-    conn1.delete(lock_node)
+    conn1.delete_recursive(lock_node)
     conn1.close()
-    conn2.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+#! /bin/env python
+import threading
+import unittest
+import zookeeper
+from zkpy.acl import Acls
+from zkpy.aio import AsyncConnection, AsyncLock
+from zkpy.connection import Connection, EventType
+from zkpy.testing import FakeZooKeeper
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+ACL = [Acls.Unsafe]
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+        self.loop = asyncio.new_event_loop()
+        self.aconn = AsyncConnection(self.conn, self.loop)
+
+    def tearDown(self):
+        self.conn.close()
+        self.loop.close()
+
+    def wait(self, future, timeout=1.):
+        '''Runs the loop until the future is done.'''
+        return self.loop.run_until_complete(asyncio.wait_for(future, timeout, loop=self.loop))
+
+    def testFutures(self):
+        self.assertEqual(self.wait(self.aconn.create('/foo', 'bar', ACL)), '/foo')
+        data, stat = self.wait(self.aconn.get('/foo'))
+        self.assertEqual((data, stat['version']), ('bar', 0))
+        self.assertEqual(self.wait(self.aconn.set('/foo', 'baz'))['version'], 1)
+        self.assertEqual(self.wait(self.aconn.get_acl('/foo')), self.conn.get_acl('/foo'))
+        self.assertEqual(self.wait(self.aconn.exists('/missing')), None)
+        self.assertRaises(zookeeper.NoNodeException, self.wait, self.aconn.get('/missing'))
+
+    def testManyConcurrentOperations(self):
+        futures = [self.aconn.create('/item-%d' % i, '', ACL) for i in range(100)]
+        paths = self.wait(asyncio.gather(*futures, loop=self.loop))
+        self.assertEqual(paths, ['/item-%d' % i for i in range(100)])
+
+    def testWatcherRunsOnLoop(self):
+        event = asyncio.Future(loop=self.loop)
+        def watcher(handle, type, state, path):
+            event.set_result((type, path, threading.currentThread()))
+        self.assertEqual(self.wait(self.aconn.exists('/foo', watcher)), None)
+        self.conn.create('/foo', '', ACL)
+        self.assertEqual(self.wait(event),
+                         (EventType.NodeCreated, '/foo', threading.currentThread()))
+
+    def testLock(self):
+        self.conn.create('/lock', '', ACL)
+        first = AsyncLock(self.aconn, '/lock')
+        second = AsyncLock(self.aconn, '/lock')
+        self.assertEqual(self.wait(first.acquire()), True)
+        self.assertTrue(first.is_owner())
+
+        waiting = second.acquire()
+        self.assertRaises(asyncio.TimeoutError, self.wait, asyncio.shield(waiting, loop=self.loop), .2)
+        self.assertFalse(waiting.done())
+        self.assertFalse(second.is_owner())
+
+        self.wait(first.release())
+        self.assertEqual(self.wait(waiting), True)
+        self.assertTrue(second.is_owner())
+        self.wait(second.release())
+        self.assertEqual(self.conn.get_children('/lock'), [])
+
+    def testLockCancel(self):
+        self.conn.create('/lock', '', ACL)
+        first = AsyncLock(self.aconn, '/lock')
+        second = AsyncLock(self.aconn, '/lock')
+        self.wait(first.acquire())
+        waiting = second.acquire()
+        self.assertRaises(asyncio.TimeoutError, self.wait, waiting, .2)
+        self.assertTrue(waiting.cancelled())
+
+        # the cancelled waiter leaves the lock queue
+        self.wait(asyncio.sleep(.1, loop=self.loop))
+        self.assertEqual(len(self.conn.get_children('/lock')), 1)
+        self.wait(first.release())
+        self.assertEqual(self.conn.get_children('/lock'), [])
+
+    def testLockCancelWhileRequesting(self):
+        self.conn.create('/lock', '', ACL)
+        lock = AsyncLock(self.aconn, '/lock')
+        # the lock node is created after the cancellation
+        self.zk.latency = {'create': .1}
+        requesting = lock.acquire()
+        self.wait(asyncio.sleep(.01, loop=self.loop))
+        requesting.cancel()
+        self.wait(asyncio.sleep(.3, loop=self.loop))
+        self.zk.latency = 0.
+        self.assertEqual(self.conn.get_children('/lock'), [])
+        self.assertFalse(lock.is_owner())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#! /bin/env python
+import os
+import StringIO
+import unittest
+import zookeeper
+from zkpy.acl import Acls
+from zkpy.blob import write_blob, read_blob, open_blob, delete_blob, BlobChangedError
+from zkpy.connection import Connection
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+# runs against an in-process fake, unless a server is given
+ZOOKEEPER_HOST = os.environ.get('ZOOKEEPER_HOST')
+
+
+class TestBlob(unittest.TestCase):
+    def setUp(self):
+        if ZOOKEEPER_HOST:
+            self.conn = Connection(ZOOKEEPER_HOST, 5)
+        else:
+            self.conn = Connection('fake:2181', 5, backend=FakeZooKeeper())
+        if self.conn.exists('/blob'):
+            self.conn.delete_recursive('/blob')
+
+    def tearDown(self):
+        if self.conn.exists('/blob'):
+            self.conn.delete_recursive('/blob')
+        self.conn.close()
+
+    def testRoundTrip(self):
+        value = ''.join(chr(i % 256) for i in range(10000))
+        write_blob(self.conn, '/blob', value, ACL, chunk_size=1024, max_outstanding=4)
+        self.assertEqual(len(self.conn.get_children('/blob')), 10)
+        self.assertEqual(read_blob(self.conn, '/blob'), value)
+
+    def testStreaming(self):
+        write_blob(self.conn, '/blob', StringIO.StringIO('a' * 100), ACL, chunk_size=30)
+        reader = open_blob(self.conn, '/blob')
+        self.assertEqual(reader.size, 100)
+        self.assertEqual([len(chunk) for chunk in reader], [30, 30, 30, 10])
+
+        reader = open_blob(self.conn, '/blob')
+        self.assertEqual(reader.read(45), 'a' * 45)
+        self.assertEqual(reader.read(), 'a' * 55)
+        self.assertEqual(reader.read(), '')
+
+    def testReplace(self):
+        write_blob(self.conn, '/blob', 'first', ACL, chunk_size=2)
+        reader = open_blob(self.conn, '/blob', max_outstanding=1)
+        write_blob(self.conn, '/blob', 'second', ACL, chunk_size=2)
+        # the old chunks are gone
+        self.assertEqual(len(self.conn.get_children('/blob')), 3)
+        self.assertRaises(BlobChangedError, reader.read)
+        self.assertEqual(read_blob(self.conn, '/blob'), 'second')
+
+    def testVersion(self):
+        stat = write_blob(self.conn, '/blob', 'first', ACL)
+        self.assertRaises(zookeeper.BadVersionException,
+                          write_blob, self.conn, '/blob', 'second', ACL, version=stat['version'] + 1)
+        write_blob(self.conn, '/blob', 'second', ACL, version=stat['version'])
+        self.assertEqual(read_blob(self.conn, '/blob'), 'second')
+
+    def testBatchSize(self):
+        batches = []
+        pipeline = self.conn.pipeline
+        def recording_pipeline():
+            created = pipeline()
+            commit = created.commit
+            def recording_commit(*args):
+                batches.append(len(created))
+                return commit(*args)
+            created.commit = recording_commit
+            return created
+        self.conn.pipeline = recording_pipeline
+        write_blob(self.conn, '/blob', 'x' * 1000, ACL, chunk_size=100, batch_size=250)
+        del self.conn.pipeline
+        self.assertEqual(batches, [2, 2, 2, 2, 2])
+        self.assertEqual(read_blob(self.conn, '/blob'), 'x' * 1000)
+
+    def testConcurrentFirstWrite(self):
+        create = self.conn.create
+        def racing_create(path, *args):
+            # another writer creates the manifest node first
+            del self.conn.create
+            create(path, '', ACL)
+            return create(path, *args)
+        self.conn.create = racing_create
+        write_blob(self.conn, '/blob', 'value', ACL)
+        self.assertEqual(read_blob(self.conn, '/blob'), 'value')
+
+    def testDelete(self):
+        write_blob(self.conn, '/blob', 'value', ACL, chunk_size=2)
+        self.assertEqual(delete_blob(self.conn, '/blob'), 4)
+        self.assertEqual(self.conn.exists('/blob'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
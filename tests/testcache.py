@@ -0,0 +1,117 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+from zkpy.acl import Acls
+from zkpy.cache import TreeCache
+from zkpy.connection import Connection
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class Listener(object):
+    '''Collects the events of a TreeCache.'''
+
+    def __init__(self):
+        self.events = []
+        self.received = threading.Condition()
+
+    def _add(self, event):
+        self.received.acquire()
+        self.events.append(event)
+        self.received.notifyAll()
+        self.received.release()
+
+    def node_added(self, path, data, stat):
+        self._add(('added', path, data))
+
+    def node_updated(self, path, data, stat):
+        self._add(('updated', path, data))
+
+    def node_removed(self, path):
+        self._add(('removed', path))
+
+    def wait_for(self, event, timeout=1.):
+        '''Waits until the event was received.'''
+        deadline = time.time() + timeout
+        self.received.acquire()
+        try:
+            while event not in self.events and time.time() < deadline:
+                self.received.wait(deadline - time.time())
+            return event in self.events
+        finally:
+            self.received.release()
+
+
+class TestTreeCache(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+        self.listener = Listener()
+        self.cache = TreeCache(self.conn, '/config', self.listener)
+
+    def tearDown(self):
+        self.cache.stop()
+        self.conn.close()
+
+    def testStart(self):
+        self.conn.create('/config', 'root', ACL)
+        self.conn.create('/config/a', 'a', ACL)
+        self.conn.create('/config/a/b', 'b', ACL)
+        self.assertTrue(self.cache.start(1))
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get('/config/a/b')[0], 'b')
+        self.assertEqual(self.cache.get_children('/config'), ['a'])
+        self.assertEqual(self.cache.exists('/config/missing'), None)
+        self.assertEqual(sorted(self.listener.events),
+                         [('added', '/config', 'root'), ('added', '/config/a', 'a'),
+                          ('added', '/config/a/b', 'b')])
+        self.assertRaises(RuntimeError, self.cache.start)
+
+    def testChanges(self):
+        self.conn.create('/config', '', ACL)
+        self.assertTrue(self.cache.start(1))
+
+        self.conn.create('/config/a', 'a', ACL)
+        self.assertTrue(self.listener.wait_for(('added', '/config/a', 'a')))
+        self.conn.set('/config/a', 'changed')
+        self.assertTrue(self.listener.wait_for(('updated', '/config/a', 'changed')))
+        self.assertEqual(self.cache.get('/config/a')[0], 'changed')
+        self.conn.delete('/config/a')
+        self.assertTrue(self.listener.wait_for(('removed', '/config/a')))
+        self.assertFalse('/config/a' in self.cache)
+        self.assertEqual(self.cache.get_children('/config'), [])
+
+    def testMissingRoot(self):
+        self.assertTrue(self.cache.start(1))
+        self.assertEqual(len(self.cache), 0)
+        self.conn.create('/config', 'root', ACL)
+        self.assertTrue(self.listener.wait_for(('added', '/config', 'root')))
+
+    def testRootDeletedAndRecreated(self):
+        self.conn.create('/config', 'root', ACL)
+        self.conn.create('/config/a', 'a', ACL)
+        self.assertTrue(self.cache.start(1))
+
+        self.conn.delete('/config/a')
+        self.conn.delete('/config')
+        self.assertTrue(self.listener.wait_for(('removed', '/config')))
+        self.assertEqual(len(self.cache), 0)
+
+        self.conn.create('/config', 'new root', ACL)
+        self.assertTrue(self.listener.wait_for(('added', '/config', 'new root')))
+        self.conn.create('/config/b', 'b', ACL)
+        self.assertTrue(self.listener.wait_for(('added', '/config/b', 'b')))
+        self.assertEqual(self.cache.get_children('/config'), ['b'])
+
+    def testStop(self):
+        self.conn.create('/config', '', ACL)
+        self.assertTrue(self.cache.start(1))
+        self.cache.stop()
+        self.conn.create('/config/a', 'a', ACL)
+        self.assertFalse(self.listener.wait_for(('added', '/config/a', 'a'), 0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#! /bin/env python
+import unittest
+from zkpy.acl import Acls
+from zkpy.codec import (CodecError, CodecMap, JsonCodec, ZlibCodec, HEADER,
+                        decode)
+from zkpy.connection import Connection
+from zkpy.queue import Queue
+from zkpy.testing import FakeZooKeeper
+
+
+class TestCodec(unittest.TestCase):
+    def testJson(self):
+        codec = JsonCodec()
+        data = codec.encode({'threads': 8})
+        self.assertTrue(data.startswith(HEADER))
+        self.assertEqual(decode(data), {'threads': 8})
+
+    def testPlainData(self):
+        self.assertEqual(decode('plain'), 'plain')
+        self.assertEqual(decode(''), '')
+        self.assertEqual(decode(None), None)
+
+    def testUnknownTag(self):
+        self.assertRaises(CodecError, decode, HEADER + '?payload')
+
+    def testCompression(self):
+        codec = ZlibCodec(JsonCodec(), min_size=100)
+        small = codec.encode([1, 2])
+        self.assertEqual(small, JsonCodec().encode([1, 2]))
+        value = ['item-%d' % i for i in range(1000)]
+        large = codec.encode(value)
+        self.assertTrue(len(large) < len(JsonCodec().encode(value)))
+        self.assertEqual(decode(large), value)
+
+    def testCompressedStrings(self):
+        codec = ZlibCodec(min_size=0)
+        self.assertEqual(decode(codec.encode('a' * 1000)), 'a' * 1000)
+
+    def testCodecMap(self):
+        codecs = CodecMap()
+        json_codec = JsonCodec()
+        zlib_codec = ZlibCodec(json_codec)
+        codecs.register('/config', json_codec)
+        codecs.register('/config/large', zlib_codec)
+        self.assertEqual(codecs.codec('/config'), json_codec)
+        self.assertEqual(codecs.codec('/config/foo'), json_codec)
+        self.assertEqual(codecs.codec('/config/large/bar'), zlib_codec)
+        self.assertEqual(codecs.codec('/configuration'), None)
+        self.assertEqual(codecs.encode('/other', 'raw'), 'raw')
+        self.assertEqual(codecs.decode(codecs.encode('/config/foo', {'a': 1})), {'a': 1})
+
+        codecs.register('/', zlib_codec)
+        self.assertEqual(codecs.codec('/other'), zlib_codec)
+
+    def testQueueKeepsUndecodableItem(self):
+        conn = Connection('fake:2181', 5, backend=FakeZooKeeper())
+        try:
+            conn.create('/queue', '', [Acls.Unsafe])
+            conn.codecs.register('/queue', JsonCodec())
+            queue = Queue(conn, '/queue')
+            conn.create('/queue/item-0000000000', HEADER + '?payload', [Acls.Unsafe])
+            queue.push({'a': 1})
+            self.assertRaises(CodecError, queue.pop)
+            self.assertEqual(len(conn.get_children('/queue')), 2)
+
+            conn.delete('/queue/item-0000000000')
+            self.assertEqual(queue.pop(), {'a': 1})
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+from zkpy.acl import Acls
+from zkpy.connection import Connection
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class ConcurrentZooKeeper(FakeZooKeeper):
+    '''Counts the asynchronous requests in flight and runs hooks before
+    requests (changes of other clients).
+    '''
+
+    def __init__(self, *args, **kwargs):
+        FakeZooKeeper.__init__(self, *args, **kwargs)
+        self.hooks = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def _count(self, delta):
+        self._counter_lock.acquire()
+        self.in_flight += delta
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self._counter_lock.release()
+
+    def _acall(self, handle, operation, apply, completion, *args):
+        hook = self.hooks.pop((operation, args[0]), None)
+        if hook is not None:
+            hook()
+        self._count(1)
+        def counted(*values):
+            self._count(-1)
+            completion(*values)
+        return FakeZooKeeper._acall(self, handle, operation, apply, counted, *args)
+
+
+class TestEnsurePathExists(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+        self.zk.reset_stats()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def requests(self):
+        requests = self.zk.stats()['requests']
+        return dict((name, count) for name, count in requests.items() if count)
+
+    def testRecursive(self):
+        self.assertTrue(self.conn.ensure_path_exists('/a/b/c/d/e', 'data', ACL, recursive=True))
+        self.assertEqual(self.conn.get('/a/b/c/d/e')[0], 'data')
+        self.assertEqual(self.conn.get('/a/b')[0], '')
+        # one exists and one create per node, no watches
+        self.assertEqual(self.requests(), {'exists': 5, 'create': 5, 'get': 2})
+
+        # cached: only the node itself is checked
+        self.zk.reset_stats()
+        self.conn.ensure_path_exists('/a/b/c/d/e', '', ACL, recursive=True)
+        self.conn.ensure_path_exists('/a/b/x', '', ACL, recursive=True)
+        self.assertEqual(self.requests(), {'exists': 2, 'create': 1})
+
+    def testOptimistic(self):
+        self.conn.create('/a', '', ACL)
+        self.assertTrue(self.conn.ensure_path_exists('/a/b/c', 'data', ACL, optimistic=True))
+        self.assertEqual(self.conn.get('/a/b/c')[0], 'data')
+        self.assertEqual(self.requests(), {'create': 4, 'get': 1})
+
+        self.zk.reset_stats()
+        self.conn.ensure_path_exists('/a/b/c/d', '', ACL, optimistic=True)
+        self.assertEqual(self.requests(), {'create': 1})
+
+    def testDeleteForgetsPath(self):
+        self.conn.ensure_path_exists('/a', '', ACL)
+        self.conn.delete('/a')
+        self.conn.ensure_path_exists('/a', 'new', ACL)
+        self.assertEqual(self.conn.get('/a')[0], 'new')
+
+        self.conn.delete_async('/a').result(1)
+        self.conn.ensure_path_exists('/a', 'again', ACL, optimistic=True)
+        self.assertEqual(self.conn.get('/a')[0], 'again')
+
+    def testPathDeletedByOtherSession(self):
+        self.conn.ensure_path_exists('/a', '', ACL)
+        other = Connection('fake:2181', 5, backend=self.zk)
+        other.delete('/a')
+        self.assertTrue(self.conn.ensure_path_exists('/a', 'new', ACL))
+        self.assertEqual(self.conn.get('/a')[0], 'new')
+
+        other.delete('/a')
+        self.assertTrue(self.conn.ensure_path_exists('/a', 'again', ACL, optimistic=True))
+        self.assertEqual(self.conn.get('/a')[0], 'again')
+        other.close()
+
+    def testAncestorDeletedByOtherSession(self):
+        self.conn.ensure_path_exists('/a/b', '', ACL, recursive=True)
+        other = Connection('fake:2181', 5, backend=self.zk)
+        other.delete('/a/b')
+        other.delete('/a')
+        other.close()
+
+        self.conn.ensure_path_exists('/a/b/c', 'data', ACL, recursive=True)
+        self.assertEqual(self.conn.get('/a/b/c')[0], 'data')
+
+        other = Connection('fake:2181', 5, backend=self.zk)
+        other.delete_recursive('/a')
+        other.close()
+        self.conn.ensure_path_exists('/a/b/c/d', 'data', ACL, optimistic=True)
+        self.assertEqual(self.conn.get('/a/b/c/d')[0], 'data')
+
+    def testExpirationForgetsPaths(self):
+        self.conn.ensure_path_exists('/a', '', ACL)
+        self.assertTrue('/a' in self.conn._known_paths)
+        self.zk.expire()
+        # the global watcher runs on the completion thread
+        for _i in range(100):
+            if not self.conn._known_paths:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.conn._known_paths, set())
+
+
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        self.zk = ConcurrentZooKeeper(latency=0.001)
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+        self.other = Connection('fake:2181', 5, backend=self.zk)
+        self.conn.create('/tree', 'root', ACL)
+        for name in 'abc':
+            self.conn.create('/tree/%s' % name, name, ACL)
+            for index in range(10):
+                self.conn.create('/tree/%s/%d' % (name, index), '', ACL)
+
+    def tearDown(self):
+        self.other.close()
+        self.conn.close()
+
+    def testWalk(self):
+        nodes = list(self.conn.walk('/tree'))
+        self.assertEqual(len(nodes), 34)
+        self.assertEqual([node for node, _data, _stat in nodes[:4]],
+                         ['/tree', '/tree/a', '/tree/b', '/tree/c'])
+        self.assertEqual(nodes[1][1], 'a')
+        self.assertEqual(nodes[1][2]['numChildren'], 10)
+        self.assertEqual(list(self.conn.walk('/tree/a/0', with_data=False)),
+                         [('/tree/a/0', None, None)])
+        self.assertEqual(list(self.conn.walk('/missing')), [])
+
+    def testDepthFirst(self):
+        nodes = [node for node, _data, _stat in self.conn.walk('/tree', 1, False)]
+        self.assertEqual(nodes[:3], ['/tree', '/tree/a', '/tree/a/0'])
+        self.assertEqual(nodes.index('/tree/b'), 12)
+
+    def testMaxOutstandingCountsRequests(self):
+        for max_outstanding in (1, 2, 5):
+            self.zk.max_in_flight = 0
+            self.assertEqual(len(list(self.conn.walk('/tree', max_outstanding))), 34)
+            self.assertEqual(self.zk.max_in_flight, max(2, max_outstanding - max_outstanding % 2))
+            self.zk.max_in_flight = 0
+            self.assertEqual(len(list(self.conn.walk('/tree', max_outstanding, False))), 34)
+            self.assertEqual(self.zk.max_in_flight, max_outstanding)
+
+    def testWalkSkipsConcurrentlyDeletedNodes(self):
+        walked = []
+        for node, _data, _stat in self.conn.walk('/tree', max_outstanding=2):
+            walked.append(node)
+            if node == '/tree':
+                # listed, but not requested yet
+                self.other.delete_recursive('/tree/b')
+        self.assertEqual(len(walked), 23)
+        self.assertFalse('/tree/b' in walked)
+
+    def testDeleteRecursive(self):
+        self.assertEqual(self.conn.delete_recursive('/tree', max_outstanding=5), 34)
+        self.assertTrue(self.zk.max_in_flight <= 5)
+        self.assertEqual(self.conn.exists('/tree'), None)
+
+    def testDeleteRecursiveWithConcurrentChanges(self):
+        # another client deletes a node and adds one before the deletes
+        def change():
+            self.other.delete('/tree/c/5')
+            self.other.create('/tree/b/new', '', ACL)
+        self.zk.hooks[('delete', '/tree/c/9')] = change
+        self.assertEqual(self.conn.delete_recursive('/tree'), 34)
+        self.assertEqual(self.conn.exists('/tree'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
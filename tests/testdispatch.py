@@ -0,0 +1,112 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+from zkpy.acl import Acls
+from zkpy.connection import Connection, EventType, KeeperState
+from zkpy.dispatch import WatchDispatcher
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class Recorder(object):
+    '''Records the calls (and threads) of a callback.'''
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.calls = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        if self.delay:
+            time.sleep(self.delay)
+        self._lock.acquire()
+        self.calls.append(args)
+        self.threads.add(threading.currentThread())
+        self._lock.release()
+
+    def wait_for(self, count, timeout=2.):
+        deadline = time.time() + timeout
+        while len(self.calls) < count and time.time() < deadline:
+            time.sleep(0.005)
+        return self.calls
+
+
+class TestWatchDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = WatchDispatcher(workers=4)
+
+    def tearDown(self):
+        self.dispatcher.stop(1)
+
+    def testEventsOfAPathAreOrdered(self):
+        recorder = Recorder()
+        for index in range(100):
+            self.dispatcher.dispatch('/foo', recorder, index)
+        self.assertEqual(recorder.wait_for(100), [(index,) for index in range(100)])
+        self.assertEqual(len(recorder.threads), 1)
+        self.assertEqual(self.dispatcher.stats()['dispatched'], 100)
+
+    def testSlowWatcherDoesNotBlockOtherPaths(self):
+        slow = Recorder(delay=0.3)
+        fast = Recorder()
+        self.dispatcher.dispatch('/slow', slow, 1)
+        paths = [path for path in ('/a', '/b', '/c', '/d', '/e')
+                 if hash(path) % 4 != hash('/slow') % 4]
+        for path in paths:
+            self.dispatcher.dispatch(path, fast, path)
+        started = time.time()
+        self.assertEqual(len(fast.wait_for(len(paths))), len(paths))
+        self.assertTrue(time.time() - started < 0.2)
+        self.assertEqual(slow.calls, [])
+
+    def testCoalesce(self):
+        dispatcher = WatchDispatcher(workers=1, coalesce=True)
+        blocker = threading.Event()
+        dispatcher.dispatch('/foo', blocker.wait, 1)
+        recorder = Recorder()
+        for _i in range(10):
+            dispatcher.dispatch('/foo', recorder, 'changed')
+        dispatcher.dispatch('/foo', recorder, 'other')
+        blocker.set()
+        dispatcher.stop(1)
+        self.assertEqual(recorder.calls, [('changed',), ('other',)])
+        self.assertEqual(dispatcher.stats()['coalesced'], 9)
+
+    def testStopDeliversPendingEvents(self):
+        recorder = Recorder(delay=0.01)
+        for index in range(10):
+            self.dispatcher.dispatch('/foo', recorder, index)
+        self.dispatcher.stop(1)
+        self.assertEqual(len(recorder.calls), 10)
+
+    def testConnectionWatchers(self):
+        zk = FakeZooKeeper()
+        conn = Connection('fake:2181', 5, dispatcher=self.dispatcher, backend=zk)
+        recorder = Recorder()
+        conn.exists('/foo', recorder)
+        conn.create('/foo', '', ACL)
+        calls = recorder.wait_for(1)
+        self.assertEqual([(type, path) for _handle, type, _state, path in calls],
+                         [(EventType.NodeCreated, '/foo')])
+        self.assertFalse(threading.currentThread() in recorder.threads)
+        conn.close()
+
+    def testRecoveryEventFollowsExpiration(self):
+        zk = FakeZooKeeper()
+        conn = Connection('fake:2181', 5, recover_session=True,
+                          dispatcher=self.dispatcher, backend=zk)
+        recorder = Recorder()
+        conn.add_global_watcher(recorder)
+        # the expiration is still queued, when the session is recovered
+        self.dispatcher.dispatch('', time.sleep, 0.2)
+        zk.expire()
+        states = [state for _type, state, _path in recorder.wait_for(2)]
+        self.assertEqual(states, [KeeperState.Expired, KeeperState.Connected])
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
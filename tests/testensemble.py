@@ -0,0 +1,107 @@
+#! /bin/env python
+import socket
+import threading
+import time
+import unittest
+from zkpy.connection import Connection
+from zkpy.ensemble import split_server, probe, probe_servers, ServerSelector
+from zkpy.testing import FakeZooKeeper
+
+
+class FakeServer(object):
+    '''Answers four letter words like a zookeeper server.'''
+
+    def __init__(self, delay=0., mntr=True, outstanding=0):
+        self.delay = delay
+        self.mntr = mntr
+        self.outstanding = outstanding
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(5)
+        self.address = '127.0.0.1:%d' % self._socket.getsockname()[1]
+        thread = threading.Thread(target=self._serve)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _address = self._socket.accept()
+            except socket.error:
+                return
+            command = client.recv(4)
+            time.sleep(self.delay)
+            if command == 'ruok':
+                client.sendall('imok')
+            elif self.mntr:
+                client.sendall('zk_server_state\tfollower\n'
+                               'zk_outstanding_requests\t%d\n' % self.outstanding)
+            else:
+                client.sendall('mntr is not executed because it is not in the whitelist.\n')
+            client.close()
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+
+
+class TestEnsemble(unittest.TestCase):
+    def testSplitServer(self):
+        self.assertEqual(split_server('zk1:2182'), ('zk1', 2182))
+        self.assertEqual(split_server('zk1'), ('zk1', 2181))
+
+    def testProbe(self):
+        server = FakeServer(outstanding=3)
+        status = probe(server.address)
+        self.assertTrue(status.ok)
+        self.assertEqual(status.mode, 'follower')
+        self.assertEqual(status.outstanding_requests, 3)
+        server.close()
+
+    def testProbeRuok(self):
+        server = FakeServer(mntr=False)
+        status = probe(server.address)
+        self.assertTrue(status.ok)
+        self.assertEqual(status.mode, None)
+        server.close()
+
+    def testOrder(self):
+        slow = FakeServer(delay=0.2)
+        fast = FakeServer()
+        local = FakeServer(delay=0.1)
+        down = FakeServer()
+        down.close()
+        servers = [down.address, slow.address, fast.address, local.address]
+        ordered = [status.server for status in
+                   probe_servers(servers, timeout=1., local=[local.address])]
+        self.assertEqual(ordered, [local.address, fast.address, slow.address, down.address])
+        for server in (slow, fast, local):
+            server.close()
+
+    def testProbeTimeout(self):
+        server = FakeServer(delay=1.)
+        started = time.time()
+        statuses = probe_servers([server.address], timeout=0.1)
+        self.assertFalse(statuses[0].ok)
+        self.assertTrue(time.time() - started < 0.5)
+        server.close()
+
+    def testSelectorPinsBackendOrder(self):
+        server = FakeServer()
+        zk = FakeZooKeeper()
+        flags = []
+        zk.deterministic_conn_order = flags.append
+        selector = ServerSelector(probe_timeout=0.5)
+        conn = Connection(server.address, 5, selector=selector, backend=zk)
+        conn.close()
+        # set on the backend of the connection
+        self.assertEqual(flags, [True])
+        self.assertEqual([status.server for status in selector.last_probe], [server.address])
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+import zookeeper
+import zkpy.exceptions
+from zkpy.acl import Acls
+from zkpy.connection import Connection, EventType, KeeperState, NodeCreationMode
+from zkpy.future import Future
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class Events(object):
+    '''Collects watcher events.'''
+
+    def __init__(self):
+        self.events = []
+        self.received = threading.Event()
+
+    def __call__(self, handle, type, state, path):
+        self.events.append((type, state, path))
+        self.received.set()
+
+    def wait(self, timeout=1.):
+        self.received.wait(timeout)
+        return self.events
+
+
+class TestFakeZooKeeper(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testNodes(self):
+        self.assertEqual(self.conn.create('/foo', 'bar', ACL), '/foo')
+        data, stat = self.conn.get('/foo')
+        self.assertEqual((data, stat['version']), ('bar', 0))
+        self.assertEqual(self.conn.set2('/foo', 'baz', 0)['version'], 1)
+        self.assertRaises(zookeeper.BadVersionException, self.conn.set, '/foo', 'x', 0)
+        self.assertRaises(zookeeper.NodeExistsException, self.conn.create, '/foo', '', ACL)
+        self.assertRaises(zookeeper.NoNodeException, self.conn.create, '/bar/foo', '', ACL)
+        self.conn.create('/foo/child', '', ACL)
+        self.assertRaises(zookeeper.NotEmptyException, self.conn.delete, '/foo')
+        self.assertEqual(self.conn.get_children('/foo'), ['child'])
+        self.conn.delete('/foo/child')
+        self.conn.delete('/foo')
+        self.assertEqual(self.conn.exists('/foo'), None)
+
+    def testSequentialAndEphemeral(self):
+        self.conn.create('/seq', '', ACL)
+        first = self.conn.create('/seq/item-', '', ACL, NodeCreationMode.PersistentSequential)
+        second = self.conn.create('/seq/item-', '', ACL, NodeCreationMode.EphemeralSequential)
+        self.assertEqual((first, second), ('/seq/item-0000000000', '/seq/item-0000000001'))
+        self.assertRaises(zookeeper.NoChildrenForEphemeralsException,
+                          self.conn.create, second + '/child', '', ACL)
+
+        other = Connection('fake:2181', 5, backend=self.zk)
+        self.assertEqual(other.get_children('/seq'), ['item-0000000000', 'item-0000000001'])
+        self.conn.close()
+        self.assertEqual(other.get_children('/seq'), ['item-0000000000'])
+        other.close()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+
+    def testWatches(self):
+        other = Connection('fake:2181', 5, backend=self.zk)
+        created = Events()
+        self.assertEqual(other.exists('/watched', created), None)
+        self.conn.create('/watched', '', ACL)
+        self.assertEqual(created.wait(), [(EventType.NodeCreated, KeeperState.Connected, '/watched')])
+
+        children = Events()
+        other.get_children('/watched', children)
+        self.conn.create('/watched/child', '', ACL)
+        self.conn.create('/watched/child2', '', ACL)
+        time.sleep(0.05)
+        # watches fire once
+        self.assertEqual(children.wait(), [(EventType.NodeChildrenChanged, KeeperState.Connected, '/watched')])
+        other.close()
+
+    def testAsync(self):
+        futures = [self.conn.create_async('/item-', '', ACL, NodeCreationMode.PersistentSequential)
+                   for _i in range(10)]
+        self.assertEqual([future.result(1) for future in futures],
+                         ['/item-%010d' % i for i in range(10)])
+        self.assertEqual(self.conn.exists_async('/missing').result(1), None)
+        self.assertTrue(isinstance(self.conn.get_async('/missing').exception(1),
+                                   zookeeper.NoNodeException))
+
+    def testAsyncResultsMatchSync(self):
+        self.conn.create('/foo', 'bar', ACL)
+        self.conn.set('/foo', 'baz')
+        self.assertEqual(self.conn.get_acl_async('/foo').result(1), self.conn.get_acl('/foo'))
+        self.assertEqual(self.conn.get_async('/foo').result(1), self.conn.get('/foo'))
+        self.assertEqual(self.conn.exists_async('/foo').result(1), self.conn.exists('/foo'))
+        self.assertEqual(self.conn.get_children_async('/').result(1), self.conn.get_children('/'))
+        stat, acl = self.conn.get_acl_async('/foo').result(1)
+        self.assertEqual((stat['version'], acl), (1, ACL))
+
+    def testLatencyIsPipelined(self):
+        self.zk.latency = 0.05
+        started = time.time()
+        futures = [self.conn.exists_async('/') for _i in range(20)]
+        for future in futures:
+            future.result(1)
+        self.assertTrue(time.time() - started < 0.5)
+        started = time.time()
+        self.conn.exists('/')
+        self.assertTrue(time.time() - started >= 0.05)
+
+    def testFailureInjection(self):
+        self.zk.fail('create')
+        self.assertRaises(zookeeper.ConnectionLossException, self.conn.create, '/foo', '', ACL)
+        self.assertEqual(self.conn.exists('/foo'), None)
+        self.zk.fail('create', applied=True)
+        self.assertRaises(zookeeper.ConnectionLossException, self.conn.create, '/foo', '', ACL)
+        self.assertNotEqual(self.conn.exists('/foo'), None)
+        self.assertEqual(self.zk.stats()['failures'], 2)
+
+    def testDisconnect(self):
+        events = Events()
+        self.conn.add_global_watcher(lambda type, state, path: events(None, type, state, path))
+        self.zk.disconnect()
+        self.assertRaises(zookeeper.ConnectionLossException, self.conn.get, '/')
+        self.zk.reconnect()
+        self.conn.get('/')
+        time.sleep(0.05)
+        self.assertEqual([state for _type, state, _path in events.events],
+                         [KeeperState.Connecting, KeeperState.Connected])
+
+    def testExpire(self):
+        self.conn.create('/ephemeral', '', ACL, NodeCreationMode.Ephemeral)
+        watcher = Events()
+        self.conn.exists('/ephemeral', watcher)
+        self.zk.expire()
+        self.assertEqual(watcher.wait(), [(EventType.NoneType, KeeperState.Expired, '')])
+        self.assertRaises(zookeeper.SessionExpiredException, self.conn.get, '/')
+        other = Connection('fake:2181', 5, backend=self.zk)
+        self.assertEqual(other.exists('/ephemeral'), None)
+        other.close()
+
+    def testAtomicTransaction(self):
+        self.conn.create('/existing', '', ACL)
+        transaction = self.conn.transaction()
+        self.assertTrue(transaction.atomic)
+        transaction.create('/new', '', ACL).create('/existing', '', ACL)
+        try:
+            transaction.commit()
+            self.fail('TransactionError expected')
+        except zkpy.exceptions.TransactionError as e:
+            self.assertTrue(isinstance(e.results[0], zookeeper.RuntimeInconsistencyException))
+            self.assertTrue(isinstance(e.results[1], zookeeper.NodeExistsException))
+        self.assertEqual(self.conn.exists('/new'), None)
+
+        # the completion reports the error of the failed operation
+        completed = []
+        done = threading.Event()
+        def completion(handle, return_code, results):
+            completed.append((return_code, results))
+            done.set()
+        self.zk.amulti(self.conn._handle, [('create', '/new', '', ACL), ('create', '/existing', '', ACL)],
+                       completion)
+        done.wait(1)
+        self.assertEqual(completed, [(zookeeper.NODEEXISTS, [(zookeeper.RUNTIMEINCONSISTENCY, None),
+                                                             (zookeeper.NODEEXISTS, None)])])
+
+        results = self.conn.transaction().create('/new', 'a', ACL).set('/new', 'b').check('/new', 1).commit()
+        self.assertEqual(results[0], '/new')
+        self.assertEqual(self.conn.get('/new')[0], 'b')
+        self.assertEqual(self.zk.stats()['requests']['multi'], 3)
+
+    def testPipeline(self):
+        self.conn.create('/existing', '', ACL)
+        pipeline = self.conn.pipeline()
+        self.assertFalse(pipeline.atomic)
+        pipeline.create('/new', '', ACL).create('/existing', '', ACL).set('/new', 'a')
+        try:
+            pipeline.commit()
+            self.fail('TransactionError expected')
+        except zkpy.exceptions.TransactionError as e:
+            self.assertEqual(e.results[0], '/new')
+            self.assertTrue(isinstance(e.results[1], zookeeper.NodeExistsException))
+            self.assertEqual(e.results[2]['version'], 1)
+        # not applied atomically
+        self.assertEqual(self.conn.get('/new')[0], 'a')
+        self.assertEqual(self.zk.stats()['requests'].get('multi', 0), 0)
+
+    def testCommitTimeoutIsOverall(self):
+        # the operations complete one after the other, each within the timeout
+        futures = [Future() for _i in range(3)]
+        for i, future in enumerate(futures):
+            threading.Timer(.04 * (i + 1), future.set_result, ('/item-%d' % i,)).start()
+        pipeline = self.conn.pipeline()
+        pipeline.commit_async = lambda: futures
+        start = time.time()
+        self.assertRaises(zkpy.exceptions.TimeoutException, pipeline.commit, .1)
+        self.assertTrue(time.time() - start < .11)
+        self.assertEqual(self.conn.pipeline().commit(.1), [])
+
+    def testStats(self):
+        self.zk.reset_stats()
+        self.conn.create('/foo', 'data', ACL)
+        self.conn.get('/foo')
+        stats = self.zk.stats()
+        self.assertEqual(stats['total_requests'], 2)
+        self.assertEqual((stats['bytes_sent'], stats['bytes_received']), (4, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
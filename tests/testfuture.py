@@ -0,0 +1,64 @@
+#! /bin/env python
+import unittest
+import threading
+import zkpy.exceptions
+from zkpy.future import Future, wait_all, as_completed
+
+
+class TestFuture(unittest.TestCase):
+    def testResult(self):
+        future = Future()
+        self.assertEqual(future.done(), False)
+        future.set_result('/foo')
+        self.assertEqual(future.done(), True)
+        self.assertEqual(future.result(), '/foo')
+        self.assertEqual(future.exception(), None)
+
+    def testException(self):
+        future = Future()
+        future.set_exception(ValueError('bar'))
+        self.assertRaises(ValueError, future.result)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+
+    def testTimeout(self):
+        future = Future()
+        self.assertRaises(zkpy.exceptions.TimeoutException, future.result, 0.01)
+
+    def testCompleteTwice(self):
+        future = Future()
+        future.set_result(1)
+        self.assertRaises(RuntimeError, future.set_result, 2)
+
+    def testDoneCallback(self):
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [])
+        future.set_result(1)
+        self.assertEqual(called, [future])
+        # callbacks added after completion are called immediately
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future, future])
+
+    def testWaitAll(self):
+        futures = [Future() for _i in range(10)]
+        for i, future in reversed(list(enumerate(futures))):
+            threading.Timer(0.001 * i, future.set_result, (i,)).start()
+        self.assertEqual(wait_all(futures, 5), range(10))
+
+    def testAsCompleted(self):
+        futures = [Future() for _i in range(3)]
+        for delay, i in ((0.05, 0), (0.1, 1), (0.0, 2)):
+            threading.Timer(delay, futures[i].set_result, (i,)).start()
+        self.assertEqual([f.result() for f in as_completed(futures)], [2, 0, 1])
+
+    def testAsCompletedTimeout(self):
+        futures = [Future(), Future()]
+        futures[0].set_result(0)
+        iterator = as_completed(futures, 0.01)
+        self.assertEqual(iterator.next().result(), 0)
+        self.assertRaises(zkpy.exceptions.TimeoutException, iterator.next)
+
+
+if __name__ == '__main__':
+    unittest.main()
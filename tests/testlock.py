@@ -4,6 +4,9 @@ import zkpy.exceptions
 import zkpy.connection
 import zkpy.lock
 import zkpy.acl
+import zkpy.testing
+import os
+import threading
 import time
 import logging
 import inspect
@@ -11,12 +14,18 @@ logging.basicConfig()
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
-ZOOKEEPER_HOST = 'dfbetasynchap81:2181'
+# runs against an in-process fake, unless a server is given
+ZOOKEEPER_HOST = os.environ.get('ZOOKEEPER_HOST')
+if ZOOKEEPER_HOST:
+    CONNECTION_ARGS = {}
+else:
+    ZOOKEEPER_HOST = 'fake:2181'
+    CONNECTION_ARGS = {'backend': zkpy.testing.FakeZooKeeper()}
 
 
 class TestLock(unittest.TestCase):
     def testLockSynchronous(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
@@ -32,7 +41,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testLockNoAcquireNodeException(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
@@ -46,7 +55,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testLockSynchronousTwice(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
@@ -64,7 +73,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testLockSynchronousConnectionClosed(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             lockNode = '/locktest_' + inspect.stack()[0][3]
             conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
             lock1 = zkpy.lock.Lock(conn1, lockNode)
@@ -73,7 +82,7 @@ class TestLock(unittest.TestCase):
             self.assertEqual(lock1.release(), None)
 
     def testLockNoNodeException(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 try:
@@ -85,7 +94,7 @@ class TestLock(unittest.TestCase):
                 pass
 
     def testLockRunTimeException(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
@@ -102,7 +111,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testLockSynchronousCreate2(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             try:
                 lockNode = '/locktest_' + inspect.stack()[0][3]
                 conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
@@ -122,7 +131,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testLockAsynchronous(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             class LockObserver(object):
                 def __init__(self):
                     self.acquired = None
@@ -149,7 +158,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testMultipleLockAsynchronous(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             class LockObserver(object):
                 def __init__(self):
                     self.acquired = None
@@ -169,7 +178,7 @@ class TestLock(unittest.TestCase):
                 lock1 = zkpy.lock.Lock(conn1, lockNode, observer1)
                 self.assertEqual(lock1.acquire(), True)
                 self.assertEqual((observer1.acquired, observer1.released), (True, None))
-                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
                     lock2 = zkpy.lock.Lock(conn1, lockNode, observer2)
                     self.assertEqual(lock2.acquire(), False)
                     self.assertEqual((observer2.acquired, observer2.released), (None, None))
@@ -186,7 +195,7 @@ class TestLock(unittest.TestCase):
                     pass
 
     def testMultipleLockAsynchronousDel(self):
-        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
             class LockObserver(object):
                 def __init__(self):
                     self.acquired = None
@@ -205,7 +214,7 @@ class TestLock(unittest.TestCase):
                 lock1 = zkpy.lock.Lock(conn1, lockNode, observer1)
                 self.assertEqual(lock1.acquire(), True)
                 self.assertEqual((observer1.acquired, observer1.released), (True, None))
-                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5) as conn1:
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
                     lock2 = zkpy.lock.Lock(conn1, lockNode, observer2)
                     self.assertEqual(lock2.acquire(), False)
                     self.assertEqual((observer2.acquired, observer2.released), (None, None))
@@ -222,6 +231,339 @@ class TestLock(unittest.TestCase):
                 except:
                     pass
 
+    def testLockBlocking(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                lock1 = zkpy.lock.Lock(conn1, lockNode)
+                self.assertEqual(lock1.acquire(blocking=True), True)
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn2:
+                    lock2 = zkpy.lock.Lock(conn2, lockNode)
+                    # the request is withdrawn after the timeout
+                    self.assertEqual(lock2.acquire(blocking=True, timeout=0.1), False)
+                    self.assertEqual(lock2.id, None)
+                    self.assertEqual(len(conn1.get_children(lockNode)), 1)
+
+                    releaser = threading.Timer(0.1, lock1.release)
+                    releaser.start()
+                    started = time.time()
+                    self.assertEqual(lock2.acquire(blocking=True, timeout=5), True)
+                    self.assertTrue(time.time() - started < 2)
+                    self.assertEqual(lock2.is_owner(), True)
+                    releaser.join()
+                    lock2.release()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testLockContextManager(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn2:
+                    lock1 = zkpy.lock.Lock(conn1, lockNode)
+                    lock2 = zkpy.lock.Lock(conn2, lockNode)
+                    holders = []
+                    def hold(lock, name):
+                        with lock:
+                            holders.append(name)
+                            time.sleep(0.05)
+                            holders.append(name)
+                    threads = [threading.Thread(target=hold, args=(lock1, 1)),
+                               threading.Thread(target=hold, args=(lock2, 2))]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join(5)
+                    # the critical sections did not overlap
+                    self.assertEqual(sorted(holders), [1, 1, 2, 2])
+                    self.assertEqual(holders[0], holders[1])
+                    self.assertFalse(lock1.is_owner() or lock2.is_owner())
+                    self.assertEqual(conn1.get_children(lockNode), [])
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testLocksOfOneConnection(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                lock1 = zkpy.lock.Lock(conn1, lockNode)
+                lock2 = zkpy.lock.Lock(conn1, lockNode)
+                self.assertEqual(lock1.acquire(), True)
+                self.assertEqual(lock2.acquire(), False)
+                self.assertNotEqual(lock1.id, lock2.id)
+                lock1.release()
+                self.assertEqual(lock2.acquire(blocking=True, timeout=5), True)
+                lock2.release()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testLockCreateConnectionLoss(self):
+        zk = CONNECTION_ARGS.get('backend')
+        if zk is None:
+            # needs failure injection
+            return
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                lock1 = zkpy.lock.Lock(conn1, lockNode)
+                # the node is created, but the response is lost
+                zk.fail('create', applied=True)
+                self.assertEqual(lock1.acquire(), True)
+                self.assertEqual(conn1.get_children(lockNode), [lock1.id])
+                lock1.release()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testLockHandoverWithoutListing(self):
+        zk = CONNECTION_ARGS.get('backend')
+        if zk is None:
+            # needs the request counters
+            return
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                locks = [zkpy.lock.Lock(conn1, lockNode) for _i in range(5)]
+                for lock in locks:
+                    lock.acquire()
+                self.assertEqual(locks[0].is_owner(), True)
+                time.sleep(0.1)
+                zk.reset_stats()
+                for lock in locks:
+                    self.assertEqual(lock.acquire(blocking=True, timeout=5), True)
+                    lock.release()
+                self.assertEqual(zk.stats()['requests'].get('get_children', 0), 0)
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testUncontendedLockIsNotMarked(self):
+        zk = CONNECTION_ARGS.get('backend')
+        if zk is None:
+            # needs the request counters
+            return
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                lock1 = zkpy.lock.Lock(conn1, lockNode)
+                lock2 = zkpy.lock.Lock(conn1, lockNode)
+                zk.reset_stats()
+                self.assertEqual(lock1.acquire(), True)
+                self.assertEqual(lock2.acquire(), False)
+                time.sleep(0.1)
+                self.assertEqual(zk.stats()['requests'].get('set', 0), 0)
+                lock1.release()
+                # the waiter marks its node, when it took over
+                self.assertEqual(lock2.acquire(blocking=True, timeout=5), True)
+                time.sleep(0.1)
+                self.assertEqual(zk.stats()['requests'].get('set', 0), 1)
+                lock2.release()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testReadWriteLock(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn2:
+                    rw1 = zkpy.lock.ReadWriteLock(conn1, lockNode)
+                    rw2 = zkpy.lock.ReadWriteLock(conn2, lockNode)
+                    rw3 = zkpy.lock.ReadWriteLock(conn2, lockNode)
+                    # readers share the lock
+                    self.assertEqual(rw1.read_lock.acquire(), True)
+                    self.assertEqual(rw2.read_lock.acquire(), True)
+                    # a writer waits for the readers, later readers for the writer
+                    self.assertEqual(rw3.write_lock.acquire(), False)
+                    self.assertEqual(rw1.write_lock.acquire(blocking=True, timeout=0.1), False)
+                    reader = zkpy.lock.ReadWriteLock(conn1, lockNode).read_lock
+                    self.assertEqual(reader.acquire(), False)
+
+                    rw1.read_lock.release()
+                    time.sleep(0.1)
+                    self.assertFalse(rw3.write_lock.is_owner())
+                    rw2.read_lock.release()
+                    self.assertEqual(rw3.write_lock.acquire(blocking=True, timeout=5), True)
+                    self.assertFalse(reader.is_owner())
+                    rw3.write_lock.release()
+                    self.assertEqual(reader.acquire(blocking=True, timeout=5), True)
+                    reader.release()
+                    self.assertEqual(conn1.get_children(lockNode), [])
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testReadWriteLockWatcher(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            class LockObserver(object):
+                def __init__(self):
+                    self.acquired = threading.Event()
+                    self.released = None
+
+                def lock_acquired(self):
+                    self.acquired.set()
+
+                def lock_released(self):
+                    self.released = True
+            observer = LockObserver()
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                writer = zkpy.lock.ReadWriteLock(conn1, lockNode).write_lock
+                self.assertEqual(writer.acquire(), True)
+                rw_lock = zkpy.lock.ReadWriteLock(conn1, lockNode, read_watcher=observer)
+                self.assertEqual(rw_lock.read_lock.acquire(), False)
+                writer.release()
+                observer.acquired.wait(5)
+                self.assertEqual(observer.acquired.isSet(), True)
+                releaser = threading.Timer(0.1, rw_lock.read_lock.release)
+                releaser.start()
+                with rw_lock.write_lock:
+                    # the write lock waited for the read lock
+                    self.assertEqual(observer.released, True)
+                releaser.join()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testReadLockWatcherAfterReconnect(self):
+        zk = CONNECTION_ARGS.get('backend')
+        if zk is None:
+            # needs the disconnect
+            return
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            class LockObserver(object):
+                def __init__(self):
+                    self.acquired = 0
+
+                def lock_acquired(self):
+                    self.acquired += 1
+
+                def lock_released(self):
+                    pass
+            observer = LockObserver()
+            try:
+                lockNode = '/locktest_' + inspect.stack()[0][3]
+                conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                first = zkpy.lock.ReadWriteLock(conn1, lockNode).read_lock
+                self.assertEqual(first.acquire(), True)
+                # holds the read lock behind another reader
+                second = zkpy.lock.ReadWriteLock(conn1, lockNode, read_watcher=observer).read_lock
+                self.assertEqual(second.acquire(), True)
+                self.assertEqual(observer.acquired, 1)
+
+                zk.disconnect()
+                time.sleep(0.05)
+                zk.reconnect()
+                time.sleep(0.1)
+                self.assertEqual(second.is_owner(), True)
+                self.assertEqual(observer.acquired, 1)
+                first.release()
+                second.release()
+            finally:
+                try:
+                    conn1.delete(lockNode)
+                except:
+                    pass
+
+    def testLockManager(self):
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            lockNodes = ['/locktest_%s_%d' % (inspect.stack()[0][3], i) for i in range(50)]
+            try:
+                for lockNode in lockNodes:
+                    conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                watchers = len(conn1._watchers)
+                manager1 = zkpy.lock.LockManager(conn1)
+                for lockNode in lockNodes:
+                    self.assertEqual(manager1.acquire(lockNode), True)
+                self.assertEqual(sorted(manager1.owned()), sorted(lockNodes))
+                # a single global watcher for all locks
+                self.assertEqual(len(conn1._watchers), watchers + 1)
+
+                with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn2:
+                    manager2 = zkpy.lock.LockManager(conn2)
+                    self.assertEqual(manager2.acquire(lockNodes[0], blocking=True, timeout=0.1), False)
+                    self.assertEqual(len(manager2), 0)
+                    for lockNode in lockNodes[:10]:
+                        self.assertEqual(manager2.acquire(lockNode), False)
+                    for lockNode in lockNodes[:10]:
+                        manager1.release(lockNode)
+                    for lockNode in lockNodes[:10]:
+                        self.assertEqual(manager2.acquire(lockNode, blocking=True, timeout=5), True)
+                    self.assertEqual(manager1.is_owner(lockNodes[0]), False)
+                    manager2.release_all()
+                    self.assertEqual(len(manager2), 0)
+
+                manager1.release_all()
+                self.assertEqual(len(manager1), 0)
+                self.assertEqual(len(conn1._watchers), watchers)
+            finally:
+                for lockNode in lockNodes:
+                    try:
+                        conn1.delete(lockNode)
+                    except:
+                        pass
+
+    def testLockRevalidationAfterReconnect(self):
+        zk = CONNECTION_ARGS.get('backend')
+        if zk is None:
+            # needs the disconnect and the request counters
+            return
+        with zkpy.connection.zkopen(ZOOKEEPER_HOST, 5, **CONNECTION_ARGS) as conn1:
+            lockNodes = ['/locktest_%s_%d' % (inspect.stack()[0][3], i) for i in range(3)]
+            try:
+                for lockNode in lockNodes:
+                    conn1.ensure_path_exists(lockNode, '', [zkpy.acl.Acls.Unsafe])
+                locks = [zkpy.lock.Lock(conn1, lockNode) for lockNode in lockNodes for _i in range(10)]
+                for lock in locks:
+                    lock.acquire()
+                owners = [lock for lock in locks if lock.is_owner()]
+                self.assertEqual(len(owners), 3)
+
+                zk.disconnect()
+                time.sleep(0.05)
+                zk.reset_stats()
+                zk.reconnect()
+                time.sleep(0.1)
+                # one listing per lock path
+                self.assertEqual(zk.stats()['requests'].get('get_children'), 3)
+                self.assertEqual([lock for lock in locks if lock.is_owner()], owners)
+
+                for lock in locks:
+                    lock.release()
+            finally:
+                for lockNode in lockNodes:
+                    try:
+                        conn1.delete(lockNode)
+                    except:
+                        pass
+
 
 if __name__ == '__main__':
     unittest.main()
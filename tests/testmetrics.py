@@ -0,0 +1,139 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+import zookeeper
+from zkpy.acl import Acls
+from zkpy.connection import Connection
+from zkpy.metrics import Histogram, Metrics
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class Sink(object):
+    def __init__(self):
+        self.measurements = []
+
+    def operation_completed(self, name, latency, exception):
+        self.measurements.append((name, exception))
+
+
+class TestHistogram(unittest.TestCase):
+    def testPercentiles(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.to_dict()['p99'], 0.)
+        for _i in range(90):
+            histogram.record(0.0003)
+        for _i in range(9):
+            histogram.record(0.02)
+        histogram.record(0.2)
+        stats = histogram.to_dict()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual((stats['p50'], stats['p90'], stats['p99']), (0.0005, 0.0005, 0.025))
+        self.assertEqual(histogram.percentile(100), 0.2)
+        self.assertEqual(stats['max'], 0.2)
+        self.assertAlmostEqual(stats['mean'], (90 * 0.0003 + 9 * 0.02 + 0.2) / 100)
+
+    def testPercentileIsCappedByMax(self):
+        histogram = Histogram()
+        histogram.record(0.003)
+        self.assertEqual(histogram.percentile(50), 0.003)
+        histogram.record(60.)
+        self.assertEqual(histogram.percentile(50), 0.005)
+        # the unbounded bucket
+        self.assertEqual(histogram.percentile(99), 60.)
+
+
+class TestMetrics(unittest.TestCase):
+    def testCounters(self):
+        sink = Sink()
+        metrics = Metrics(sink)
+        started = metrics.started('get')
+        self.assertEqual(metrics.outstanding, 1)
+        metrics.finished('get', started)
+        error = zookeeper.NoNodeException()
+        metrics.finished('get', metrics.started('get'), error)
+        metrics.retried('get')
+        metrics.retries_exhausted('get')
+
+        stats = metrics.to_dict()
+        self.assertEqual(stats['outstanding'], 0)
+        self.assertEqual(stats['operations']['get']['count'], 2)
+        self.assertEqual(stats['operations']['get']['errors'], {'NoNodeException': 1})
+        self.assertEqual(stats['retries'], {'get': {'retries': 1, 'exhausted': 1}})
+        self.assertEqual(sink.measurements, [('get', None), ('get', error)])
+
+
+class TestConnectionMetrics(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _wait_for(self, key, value):
+        '''Waits until a statistic has the given value (the completion
+        callbacks might still run).
+        '''
+        for _i in range(100):
+            if self.conn.stats()[key] == value:
+                return
+            time.sleep(0.01)
+        self.assertEqual(self.conn.stats()[key], value)
+
+    def testInstrumentation(self):
+        self.assertEqual(self.conn.stats(), None)
+        sink = Sink()
+        self.conn.enable_metrics(sink)
+        self.conn.create('/foo', 'bar', ACL)
+        self.conn.get('/foo')
+        self.assertRaises(zookeeper.NoNodeException, self.conn.get, '/missing')
+        self.conn.get_async('/foo').result(1)
+        self.assertRaises(zookeeper.NodeExistsException,
+                          self.conn.create_async('/foo', '', ACL).result, 1)
+
+        operations = self.conn.stats()['operations']
+        self.assertEqual(operations['create']['count'], 1)
+        self.assertEqual(operations['get']['count'], 2)
+        self.assertEqual(operations['get']['errors'], {'NoNodeException': 1})
+        self.assertEqual(operations['get_async']['count'], 1)
+        self.assertEqual(operations['create_async']['errors'], {'NodeExistsException': 1})
+        self._wait_for('outstanding', 0)
+        self.assertEqual(len(sink.measurements), 5)
+
+        self.conn.disable_metrics()
+        self.conn.get('/foo')
+        self.assertEqual(self.conn.stats(), None)
+        self.assertEqual(len(sink.measurements), 5)
+
+    def testOutstanding(self):
+        self.zk.latency = 0.1
+        self.conn.enable_metrics()
+        futures = [self.conn.exists_async('/') for _i in range(10)]
+        self.assertEqual(self.conn.stats()['outstanding'], 10)
+        for future in futures:
+            future.result(1)
+        self._wait_for('outstanding', 0)
+        self.assertTrue(self.conn.stats()['operations']['exists_async']['latency']['p50'] >= 0.1)
+
+    def testActiveWatches(self):
+        self.conn.enable_metrics()
+        fired = threading.Event()
+        watcher = lambda handle, type, state, path: fired.set()
+        self.assertEqual(self.conn.exists('/foo', watcher), None)
+        self.conn.get_children_async('/', watcher).result(1)
+        # no watch is set for missing nodes
+        self.assertRaises(zookeeper.NoNodeException, self.conn.get, '/missing', watcher)
+        self.assertEqual(self.conn.stats()['active_watches'], 2)
+
+        # fires both watches
+        self.conn.create('/foo', '', ACL)
+        fired.wait(1)
+        self.assertTrue(fired.isSet())
+        self._wait_for('active_watches', 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#! /bin/env python
+import unittest
+from zkpy.acl import Acls
+from zkpy.pool import ConnectionPool
+from zkpy.retry import FixedDelay
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+
+    def testConnectionArguments(self):
+        policy = FixedDelay(3, 0.01)
+        pool = ConnectionPool('fake1:2181,fake2:2181', 5, size=3, backend=self.zk,
+                              retry_policy=policy, recover_session=True)
+        self.assertEqual(len(pool), 3)
+        for connection in pool.connections:
+            self.assertTrue(connection._zk is self.zk)
+            self.assertTrue(connection.retry_policy is policy)
+            self.assertTrue(connection._recovery is not None)
+        # all sessions of the pool have their own handle
+        self.assertEqual(len(set([connection._handle for connection in pool.connections])), 3)
+        pool.close()
+
+    def testPinServers(self):
+        pool = ConnectionPool(['a:2181', 'b:2181', 'c:2181'], 5, size=4,
+                              pin_servers=True, backend=self.zk)
+        self.assertEqual([connection._servers[0] for connection in pool.connections],
+                         ['a:2181', 'b:2181', 'c:2181', 'a:2181'])
+        pool.close()
+
+    def testReads(self):
+        pool = ConnectionPool('fake:2181', 5, size=2, backend=self.zk)
+        pool.session.create('/foo', 'bar', ACL)
+        self.assertEqual(pool.get('/foo')[0], 'bar')
+        self.assertEqual(pool.get_children('/'), ['foo'])
+        self.assertEqual(pool.exists_async('/missing').result(1), None)
+        self.assertEqual(pool.get_async('/foo').result(1)[0], 'bar')
+        pool.close()
+
+    def testLeastOutstanding(self):
+        pool = ConnectionPool('fake:2181', 5, size=3, backend=self.zk)
+        self.zk.latency = 0.05
+        futures = [pool.exists_async('/') for _i in range(6)]
+        self.assertEqual(pool.outstanding(), [2, 2, 2])
+        with pool.reader() as connection:
+            self.assertTrue(connection in pool.connections)
+            self.assertEqual(sorted(pool.outstanding()), [2, 2, 3])
+        for future in futures:
+            future.result(1)
+        pool.close()
+
+    def testInvalidSize(self):
+        self.assertRaises(ValueError, ConnectionPool, 'fake:2181', 5, size=0, backend=self.zk)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+import zookeeper
+from zkpy.acl import Acls
+from zkpy.connection import Connection, EventType, KeeperState
+from zkpy.lock import Lock
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+
+
+class SlowInitZooKeeper(FakeZooKeeper):
+    '''Blocks new sessions until allow_init is set.'''
+
+    def __init__(self, *args, **kwargs):
+        FakeZooKeeper.__init__(self, *args, **kwargs)
+        self.allow_init = threading.Event()
+        self.allow_init.set()
+        self.init_blocked = threading.Event()
+
+    def init(self, *args, **kwargs):
+        if not self.allow_init.isSet():
+            self.init_blocked.set()
+            self.allow_init.wait(5)
+        return FakeZooKeeper.init(self, *args, **kwargs)
+
+
+class Recovered(object):
+    '''Global watcher waiting for the Connected event after an expiration.'''
+
+    def __init__(self, connection):
+        self.states = []
+        self.recovered = threading.Event()
+        connection.add_global_watcher(self)
+
+    def __call__(self, type, state, path):
+        self.states.append(state)
+        if state == KeeperState.Connected and KeeperState.Expired in self.states:
+            self.recovered.set()
+
+    def wait(self, timeout=2.):
+        self.recovered.wait(timeout)
+        return self.recovered.isSet()
+
+
+class TestSessionRecovery(unittest.TestCase):
+    def setUp(self):
+        self.zk = SlowInitZooKeeper()
+        self.conn = Connection('fake:2181', 5, recover_session=True, backend=self.zk)
+        self.other = Connection('fake:2181', 5, backend=self.zk)
+        self.recovered = Recovered(self.conn)
+
+    def tearDown(self):
+        self.zk.allow_init.set()
+        self.other.close()
+        self.conn.close()
+
+    def expire(self):
+        self.zk.expire(self.conn._handle)
+
+    def testEphemeralsAreRecreated(self):
+        self.conn.register_ephemeral('/registered', 'data', ACL)
+        self.conn.create('/unregistered', '', ACL, zookeeper.EPHEMERAL)
+        session_id = self.conn.client_id()[0]
+
+        self.expire()
+        self.assertTrue(self.recovered.wait())
+        self.assertNotEqual(self.conn.client_id()[0], session_id)
+        data, stat = self.other.get('/registered')
+        self.assertEqual((data, stat['ephemeralOwner']), ('data', self.conn.client_id()[0]))
+        self.assertEqual(self.other.exists('/unregistered'), None)
+        self.assertEqual(self.conn._recovery.recoveries, 1)
+
+        # deleted nodes are not re-created anymore
+        self.conn.delete('/registered')
+        self.recovered.recovered.clear()
+        self.expire()
+        self.assertTrue(self.recovered.wait())
+        self.assertEqual(self.other.exists('/registered'), None)
+
+    def testWatchesAreRearmed(self):
+        self.other.create('/deleted', '', ACL)
+        events = []
+        fired = threading.Event()
+        def watcher(handle, type, state, path):
+            if type != EventType.NoneType:
+                events.append((type, path))
+                fired.set()
+        self.assertEqual(self.conn.exists('/created', watcher), None)
+        self.conn.get('/deleted', watcher)
+
+        self.zk.allow_init.clear()
+        self.expire()
+        self.zk.init_blocked.wait(1)
+        self.assertTrue(self.zk.init_blocked.isSet())
+        # deleted without a session
+        self.other.delete('/deleted')
+        self.zk.allow_init.set()
+        self.assertTrue(self.recovered.wait())
+        fired.wait(1)
+        self.assertEqual(events, [(EventType.NodeDeleted, '/deleted')])
+
+        self.other.create('/created', '', ACL)
+        for _i in range(100):
+            if len(events) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(events[1], (EventType.NodeCreated, '/created'))
+
+    def testRequestsWhileReconnectingFailWithConnectionLoss(self):
+        self.zk.allow_init.clear()
+        self.expire()
+        self.zk.init_blocked.wait(1)
+        self.assertTrue(self.zk.init_blocked.isSet())
+        self.assertRaises(zookeeper.ConnectionLossException, self.conn.get_children, '/')
+        self.assertTrue(isinstance(self.conn.get_async('/').exception(1),
+                                   zookeeper.ConnectionLossException))
+        self.assertFalse(self.conn.is_connected())
+
+        self.zk.allow_init.set()
+        self.assertTrue(self.recovered.wait())
+        self.assertTrue(self.conn.is_connected())
+        self.assertEqual(self.conn.get('/')[0], '')
+
+    def testLockIsReacquired(self):
+        self.conn.create('/lock', '', ACL)
+        lock = Lock(self.conn, '/lock')
+        self.assertTrue(lock.acquire())
+        node = lock.id
+
+        self.expire()
+        self.assertTrue(self.recovered.wait())
+        for _i in range(100):
+            if lock.is_owner() and lock.id != node:
+                break
+            time.sleep(0.01)
+        self.assertTrue(lock.is_owner())
+        self.assertEqual(self.other.get_children('/lock'), [lock.id])
+        self.assertNotEqual(lock.id, node)
+        lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#! /bin/env python
+import unittest
+import zookeeper
+from zkpy import zk_retry_operation
+from zkpy.metrics import Metrics
+from zkpy.retry import (RetryOperationError, RetryBudget, FixedDelay,
+                        ExponentialBackoff)
+
+
+class FlakyOperation(object):
+    '''Fails with a connection loss for the given number of calls.'''
+
+    def __init__(self, failures, exception=zookeeper.ConnectionLossException):
+        self.failures = failures
+        self.exception = exception
+        self.calls = 0
+        self.__name__ = 'flaky'
+
+    def __call__(self, value):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception()
+        return value
+
+
+class FakeConnection(object):
+    def __init__(self, retry_policy=None):
+        self.retry_policy = retry_policy
+        self.metrics = Metrics()
+
+
+class TestRetry(unittest.TestCase):
+    def testRetriesUntilSuccess(self):
+        operation = FlakyOperation(2)
+        self.assertEqual(FixedDelay(3, 0).call(operation, 'foo'), 'foo')
+        self.assertEqual(operation.calls, 3)
+
+    def testMaxAttempts(self):
+        operation = FlakyOperation(3)
+        self.assertRaises(RetryOperationError, FixedDelay(3, 0).call, operation, 'foo')
+        self.assertEqual(operation.calls, 3)
+
+    def testSessionExpiredIsNotRetried(self):
+        operation = FlakyOperation(1, zookeeper.SessionExpiredException)
+        self.assertRaises(zookeeper.SessionExpiredException,
+                          FixedDelay(3, 0).call, operation, 'foo')
+        self.assertEqual(operation.calls, 1)
+
+    def testDeadline(self):
+        operation = FlakyOperation(100)
+        self.assertRaises(RetryOperationError,
+                          FixedDelay(100, 0.01, deadline=0.05).call, operation, 'foo')
+        self.assertTrue(operation.calls < 10)
+
+    def testBackoff(self):
+        policy = ExponentialBackoff(base_delay=0.1, max_delay=0.5, jitter=False)
+        self.assertEqual([policy.delay(attempt) for attempt in range(1, 5)],
+                         [0.1, 0.2, 0.4, 0.5])
+        policy = ExponentialBackoff(base_delay=0.1, max_delay=0.5)
+        for attempt in range(1, 10):
+            self.assertTrue(0 <= policy.delay(attempt) <= 0.5)
+
+    def testBudget(self):
+        budget = RetryBudget(max_tokens=2, success_credit=0.5)
+        policy = FixedDelay(10, 0, budget=budget)
+        operation = FlakyOperation(100)
+        self.assertRaises(RetryOperationError, policy.call, operation, 'foo')
+        self.assertEqual(operation.calls, 3)
+        # the budget is empty: no retries anymore
+        self.assertRaises(RetryOperationError, policy.call, FlakyOperation(1), 'foo')
+        policy.call(FlakyOperation(0), 'foo')
+        policy.call(FlakyOperation(0), 'foo')
+        self.assertEqual(policy.call(FlakyOperation(1), 'foo'), 'foo')
+
+    def testDecoratorUsesConnectionPolicy(self):
+        connection = FakeConnection(FixedDelay(2, 0))
+        operation = FlakyOperation(1)
+        retried = zk_retry_operation(lambda conn, value: operation(value))
+        self.assertEqual(retried(connection, 'foo'), 'foo')
+
+        operation = FlakyOperation(2)
+        self.assertRaises(RetryOperationError, retried, connection, 'foo')
+        self.assertEqual(operation.calls, 2)
+
+        # per call policy
+        operation = FlakyOperation(2)
+        self.assertEqual(retried(connection, 'foo', retry_policy=FixedDelay(3, 0)), 'foo')
+
+        retries = connection.metrics.to_dict()['retries']['<lambda>']
+        self.assertEqual(retries, {'retries': 4, 'exhausted': 1})
+
+    def testDecoratorRetryCount(self):
+        operation = FlakyOperation(100)
+        retried = zk_retry_operation(operation, retry_count=4, retry_delay=0)
+        self.assertRaises(RetryOperationError, retried, 'foo')
+        self.assertEqual(operation.calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+import zkpy.acl
+import zkpy.connection
+from zkpy.semaphore import Semaphore
+from zkpy.testing import FakeZooKeeper
+
+ACL = [zkpy.acl.Acls.Unsafe]
+
+
+class TestSemaphore(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = zkpy.connection.Connection('fake:2181', 5, backend=self.zk)
+        self.conn.ensure_path_exists('/semaphore', '', ACL)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testPermits(self):
+        semaphores = [Semaphore(self.conn, '/semaphore', 2) for _i in range(4)]
+        self.assertEqual([semaphore.acquire() for semaphore in semaphores],
+                         [True, True, False, False])
+        # holders release in any order
+        semaphores[1].release()
+        self.assertEqual(semaphores[2].acquire(blocking=True, timeout=5), True)
+        self.assertFalse(semaphores[3].is_owner())
+        semaphores[0].release()
+        self.assertEqual(semaphores[3].acquire(blocking=True, timeout=5), True)
+        for semaphore in semaphores[2:]:
+            semaphore.release()
+        self.assertEqual(self.conn.get_children('/semaphore'), [])
+
+    def testTimeout(self):
+        holder = Semaphore(self.conn, '/semaphore', 1)
+        self.assertEqual(holder.acquire(), True)
+        waiter = Semaphore(self.conn, '/semaphore', 1)
+        self.assertEqual(waiter.acquire(blocking=True, timeout=0.1), False)
+        self.assertEqual(len(self.conn.get_children('/semaphore')), 1)
+        holder.release()
+
+    def testConcurrency(self):
+        holders = [0]
+        maximum = [0]
+        mutex = threading.Lock()
+        def work():
+            connection = zkpy.connection.Connection('fake:2181', 5, backend=self.zk)
+            try:
+                semaphore = Semaphore(connection, '/semaphore', 3)
+                for _i in range(5):
+                    with semaphore:
+                        mutex.acquire()
+                        holders[0] += 1
+                        maximum[0] = max(maximum[0], holders[0])
+                        mutex.release()
+                        time.sleep(0.005)
+                        mutex.acquire()
+                        holders[0] -= 1
+                        mutex.release()
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=work) for _i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(maximum[0], 3)
+        self.assertEqual(self.conn.get_children('/semaphore'), [])
+
+    def testInvalidPermits(self):
+        self.assertRaises(ValueError, Semaphore, self.conn, '/semaphore', 0)
+        # the finalizer of the half constructed object does not fail
+        Semaphore.__new__(Semaphore).__del__()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#! /bin/env python
+import os
+import StringIO
+import unittest
+from zkpy.acl import Acls
+from zkpy.connection import Connection, NodeCreationMode
+from zkpy.snapshot import export_tree, import_tree, SnapshotFormatError
+from zkpy.testing import FakeZooKeeper
+
+ACL = [Acls.Unsafe]
+# runs against an in-process fake, unless a server is given
+ZOOKEEPER_HOST = os.environ.get('ZOOKEEPER_HOST')
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        if ZOOKEEPER_HOST:
+            self.conn = Connection(ZOOKEEPER_HOST, 5)
+        else:
+            self.conn = Connection('fake:2181', 5, backend=FakeZooKeeper())
+        self._cleanup()
+        self.conn.create('/config', 'root', ACL)
+        self.conn.create('/config/a', 'a', ACL)
+        self.conn.create('/config/a/b', '', [Acls.Unsafe, Acls.Readonly])
+        self.conn.create('/config/c', 'c' * 1000, ACL)
+        self.conn.create('/config/c/session', 'eph', ACL, NodeCreationMode.Ephemeral)
+
+    def tearDown(self):
+        self._cleanup()
+        self.conn.close()
+
+    def _cleanup(self):
+        for path in ('/config', '/config-copy'):
+            if self.conn.exists(path):
+                self.conn.delete_recursive(path)
+
+    def _tree(self, root):
+        '''Returns relative path -> (data, acl) of all nodes below root.'''
+        tree = {}
+        for path, data, _stat in self.conn.walk(root):
+            _stat, acl = self.conn.get_acl(path)
+            tree[path[len(root):]] = (data, sorted(acl))
+        return tree
+
+    def testRoundTrip(self):
+        stream = StringIO.StringIO()
+        self.assertEqual(export_tree(self.conn, '/config', stream, max_outstanding=2), 4)
+
+        stream.seek(0)
+        self.assertEqual(import_tree(self.conn, stream, '/config-copy', max_outstanding=2), 4)
+        expected = self._tree('/config')
+        del expected['/c/session']
+        self.assertEqual(self._tree('/config-copy'), expected)
+        self.assertEqual(expected['/a/b'][1], sorted([Acls.Unsafe, Acls.Readonly]))
+
+    def testEphemeral(self):
+        stream = StringIO.StringIO()
+        self.assertEqual(export_tree(self.conn, '/config', stream, include_ephemeral=True), 5)
+        stream.seek(0)
+        import_tree(self.conn, stream, '/config-copy')
+        data, stat = self.conn.get('/config-copy/c/session')
+        self.assertEqual((data, stat['ephemeralOwner']), ('eph', 0))
+
+    def testOverwrite(self):
+        stream = StringIO.StringIO()
+        export_tree(self.conn, '/config', stream)
+        self.conn.set('/config/a', 'changed')
+        self.conn.delete('/config/a/b')
+
+        stream.seek(0)
+        self.assertEqual(import_tree(self.conn, stream), 1)
+        self.assertEqual(self.conn.get('/config/a')[0], 'changed')
+        stream.seek(0)
+        self.assertEqual(import_tree(self.conn, stream, overwrite=True), 4)
+        self.assertEqual(self.conn.get('/config/a')[0], 'a')
+
+    def testFormatError(self):
+        self.assertRaises(SnapshotFormatError, import_tree, self.conn,
+                          StringIO.StringIO('not a snapshot'))
+        stream = StringIO.StringIO()
+        export_tree(self.conn, '/config', stream)
+        self.assertRaises(SnapshotFormatError, import_tree, self.conn,
+                          StringIO.StringIO(stream.getvalue()[:-3]), '/config-copy')
+
+
+if __name__ == '__main__':
+    unittest.main()
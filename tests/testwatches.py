@@ -0,0 +1,126 @@
+#! /bin/env python
+import threading
+import time
+import unittest
+import zookeeper
+from zkpy.acl import Acls
+from zkpy.connection import Connection, EventType
+from zkpy.testing import FakeZooKeeper
+from zkpy.watches import WatchKind
+
+ACL = [Acls.Unsafe]
+
+
+class Callback(object):
+    '''Counts the node events it gets.'''
+
+    def __init__(self, fired):
+        self.events = []
+        self._fired = fired
+
+    def __call__(self, handle, type, state, path):
+        if type != EventType.NoneType:
+            self.events.append((type, path))
+            self._fired.release()
+
+
+class TestWatchRegistry(unittest.TestCase):
+    def setUp(self):
+        self.zk = FakeZooKeeper()
+        self.conn = Connection('fake:2181', 5, backend=self.zk)
+        self.conn.create('/parent', '', ACL)
+        self.fired = threading.Semaphore(0)
+        self.zk.reset_stats()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def wait_for_events(self, count, timeout=2.):
+        deadline = time.time() + timeout
+        for _i in range(count):
+            while not self.fired.acquire(False):
+                self.assertTrue(time.time() < deadline, 'watch events missing')
+                time.sleep(0.005)
+
+    def requests(self, operation):
+        return self.zk.stats()['requests'][operation]
+
+    def testCallbacksShareOneWatch(self):
+        callbacks = [Callback(self.fired) for _i in range(500)]
+        for callback in callbacks:
+            self.assertEqual(self.conn.watches.add('/parent', WatchKind.Children, callback), [])
+        self.assertEqual(self.requests('get_children'), 1)
+        self.assertEqual(self.conn.watches.watch_count(), 1)
+        self.assertEqual(self.conn.watches.callback_count(), 500)
+
+        self.conn.create('/parent/child', '', ACL)
+        self.wait_for_events(500)
+        for callback in callbacks:
+            self.assertEqual(callback.events, [(EventType.NodeChildrenChanged, '/parent')])
+        # re-armed once for all callbacks
+        time.sleep(0.05)
+        self.assertEqual(self.requests('get_children'), 2)
+        extra = Callback(self.fired)
+        self.assertEqual(self.conn.watches.add('/parent', WatchKind.Children, extra), ['child'])
+        self.assertEqual(self.requests('get_children'), 2)
+
+    def testRemoveLastCallback(self):
+        callbacks = [Callback(self.fired) for _i in range(3)]
+        for callback in callbacks:
+            self.conn.watches.add('/parent', WatchKind.Children, callback)
+        for callback in callbacks[1:]:
+            self.conn.watches.remove('/parent', WatchKind.Children, callback)
+        self.assertEqual(self.conn.watches.callback_count(), 1)
+        self.conn.watches.remove('/parent', WatchKind.Children, callbacks[0])
+        self.assertEqual(self.conn.watches.callback_count(), 0)
+
+        # the armed watch fires, but is not re-armed anymore
+        self.conn.create('/parent/child', '', ACL)
+        time.sleep(0.05)
+        self.assertEqual(self.conn.watches.watch_count(), 0)
+        self.assertEqual(self.requests('get_children'), 1)
+        self.assertEqual([callback.events for callback in callbacks], [[], [], []])
+
+    def testOnce(self):
+        once = Callback(self.fired)
+        always = Callback(self.fired)
+        self.conn.watches.add('/parent', WatchKind.Data, once, once=True)
+        self.conn.watches.add('/parent', WatchKind.Data, always)
+        self.conn.set('/parent', 'a')
+        self.wait_for_events(2)
+        time.sleep(0.05)
+        self.conn.set('/parent', 'b')
+        self.wait_for_events(1)
+        self.assertEqual(len(once.events), 1)
+        self.assertEqual(len(always.events), 2)
+
+    def testMissingNode(self):
+        first = Callback(self.fired)
+        second = Callback(self.fired)
+        self.assertRaises(zookeeper.NoNodeException,
+                          self.conn.watches.add, '/missing', WatchKind.Children, first)
+        time.sleep(0.05)
+        self.assertRaises(zookeeper.NoNodeException,
+                          self.conn.watches.add, '/missing', WatchKind.Children, second)
+        self.assertEqual((self.requests('get_children'), self.requests('exists')), (1, 1))
+
+        self.conn.create('/missing', '', ACL)
+        self.wait_for_events(2)
+        self.assertEqual(second.events, [(EventType.NodeCreated, '/missing')])
+        time.sleep(0.05)
+        self.conn.create('/missing/child', '', ACL)
+        self.wait_for_events(2)
+        self.assertEqual(first.events[1], (EventType.NodeChildrenChanged, '/missing'))
+
+    def testFiredWatchInvalidatesResult(self):
+        callback = Callback(self.fired)
+        self.assertEqual(self.conn.watches.add('/node', WatchKind.Exists, callback), None)
+        self.conn.create('/node', '', ACL)
+        self.wait_for_events(1)
+        time.sleep(0.05)
+        stat = self.conn.watches.add('/node', WatchKind.Exists, Callback(self.fired))
+        self.assertEqual(stat['version'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
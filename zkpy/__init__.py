@@ -1,16 +1,29 @@
 from functools import wraps
+from zkpy.retry import RetryOperationError, FixedDelay, default_policy
 import logging
-import time
-import zookeeper
 
 
-logger = logging.getLogger(__name__)
+__all__ = ['RetryOperationError', 'zk_retry_operation']
 
-class RetryOperationError(Exception):
-    pass
+logger = logging.getLogger(__name__)
 
-def zk_retry_operation(operation,  retry_count = 10, retry_delay = 0.5):
-    '''Retries a zk operation for several times.
+def _connection_of(operation, args):
+    '''Returns the connection an operation belongs to (or None): the object
+    of a bound method or the first argument, or their _connection or zk_conn
+    attribute.
+    '''
+    owner = getattr(operation, 'im_self', None)
+    if owner is None and args:
+        owner = args[0]
+    for candidate in (owner,
+                      getattr(owner, '_connection', None),
+                      getattr(owner, 'zk_conn', None)):
+        if hasattr(candidate, 'retry_policy'):
+            return candidate
+    return None
+
+def zk_retry_operation(operation, retry_count = None, retry_delay = None, policy = None):
+    '''Retries a zk operation after connection losses and operation timeouts.
     Can be used as a decorator (with default arguments)
 
     @zk_retry_operation
@@ -22,20 +35,24 @@ def zk_retry_operation(operation,  retry_count = 10, retry_delay = 0.5):
         print arg1
     zk_retry_operation(runner, retry_count=10, retry_delay=2)('thearg')
 
+    The retry policy (see zkpy.retry) is taken from, in that order,
+     - the retry_policy keyword argument of the call (it is not passed on)
+     - the policy argument
+     - retry_count and retry_delay (a FixedDelay policy)
+     - the retry_policy of the connection of the operation
+     - zkpy.retry.default_policy
+    Retries are counted by the metrics of the connection (if enabled).
     '''
+    if policy is None and (retry_count is not None or retry_delay is not None):
+        policy = FixedDelay(retry_count or 10, retry_delay if retry_delay is not None else 0.5)
+
     @wraps(operation)
     def wrapper(*args, **kwargs):
-        for attempt_count in range(1, retry_count):
-            try:
-                return operation(*args, **kwargs)
-            except zookeeper.SessionExpiredException:
-                logger.error('''Zookeeper session expired. Please clean up your state and start a new session and retry.''')
-                raise
-            except zookeeper.ConnectionLossException:
-                if attempt_count >= retry_count:
-                    logger.error('Retried operation for %d times. Giving up' % attempt_count)
-                    raise
-                time.sleep(retry_delay)
-        raise RetryOperationError('Could not execute %s. Retried for %d times' % (operation, retry_count))
+        call_policy = kwargs.pop('retry_policy', None) or policy
+        connection = _connection_of(operation, args)
+        metrics = None
+        if connection is not None:
+            call_policy = call_policy or connection.retry_policy
+            metrics = connection.metrics
+        return (call_policy or default_policy).call(operation, metrics=metrics, *args, **kwargs)
     return wrapper
-
@@ -60,6 +60,16 @@ class Id(object):
         else:
             self.id = id
 
+    @classmethod
+    def raw(cls, scheme, id):
+        '''Creates an id from an already encoded id string (e.g. the digest
+        as returned by get_acl()).
+        '''
+        instance = cls.__new__(cls)
+        instance.scheme = scheme
+        instance.id = id
+        return instance
+
     @staticmethod
     def digest(user, password):
         '''Encodes the zookeeper credentials into a zookeeper digest.'''
@@ -76,6 +86,11 @@ class Acl(dict):
         self.perms = permissions
         self.id = id
 
+    @classmethod
+    def from_dict(cls, acl):
+        '''Creates an Acl from an ACL item as returned by get_acl()'''
+        return cls(acl['perms'], Id.raw(acl['scheme'], acl['id']))
+
     def __getattr__(self, key):
         if key not in self.__slots__:
                 raise AttributeError
@@ -0,0 +1,340 @@
+'''
+asyncio integration.
+
+Bridges the completion and watcher callbacks of the zookeeper client thread
+into an asyncio event loop (via call_soon_threadsafe), so that a single loop
+can drive many concurrent operations and waiters without a thread each.
+
+All operations return asyncio futures, e.g.
+
+    conn = AsyncConnection(Connection('localhost:2181', 5))
+    data, stat = yield From(conn.get('/foo'))   # trollius
+    data, stat = await conn.get('/foo')         # asyncio
+
+Needs asyncio (or trollius on python 2).
+'''
+
+from zkpy.connection import NodeCreationMode
+from zkpy.lock import Lock
+import logging
+import zookeeper
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+logger = logging.getLogger(__name__)
+
+
+def _create_future(loop):
+    '''Creates an asyncio future bound to the given loop.'''
+    if hasattr(loop, 'create_future'):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)
+
+
+def _transfer(source, target):
+    '''Copies the outcome of a zkpy future to an asyncio future.
+    Needs to run on the loop.
+    '''
+    if target.done():
+        # cancelled in the meantime
+        return
+    exception = source.exception()
+    if exception is not None:
+        target.set_exception(exception)
+    else:
+        target.set_result(source.result())
+
+
+class AsyncConnection(object):
+    '''asyncio front end for a zkpy connection.'''
+
+    def __init__(self, connection, loop=None):
+        '''
+        :param connection: The (connected) zkpy connection
+        :param loop: The event loop, the results are delivered to. Defaults to
+                     the current event loop.
+        '''
+        self.connection = connection
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+    def wrap_future(self, future):
+        '''Returns an asyncio future, which completes on the loop as soon as
+        the given zkpy future completes.
+        '''
+        aio_future = _create_future(self.loop)
+        loop = self.loop
+        future.add_done_callback(
+            lambda done: loop.call_soon_threadsafe(_transfer, done, aio_future))
+        return aio_future
+
+    def wrap_watcher(self, watcher):
+        '''Returns a zookeeper watcher, which calls
+        watcher(handle, type, state, path) on the loop.
+        '''
+        if watcher is None:
+            return None
+        loop = self.loop
+        def loop_watcher(handle, type, state, path):
+            loop.call_soon_threadsafe(watcher, handle, type, state, path)
+        return loop_watcher
+
+    def run_in_executor(self, call, *args):
+        '''Runs a synchronous call in the loop's default executor.'''
+        return self.loop.run_in_executor(None, call, *args)
+
+    def create(self, path, data, acl, flags=0):
+        return self.wrap_future(self.connection.create_async(path, data, acl, flags))
+
+    def delete(self, path, version=-1):
+        return self.wrap_future(self.connection.delete_async(path, version))
+
+    def set(self, path, data, version=-1):
+        return self.wrap_future(self.connection.set_async(path, data, version))
+
+    def exists(self, path, watcher=None):
+        return self.wrap_future(
+            self.connection.exists_async(path, self.wrap_watcher(watcher)))
+
+    def get(self, path, watcher=None):
+        return self.wrap_future(
+            self.connection.get_async(path, self.wrap_watcher(watcher)))
+
+    def get_children(self, path, watcher=None):
+        return self.wrap_future(
+            self.connection.get_children_async(path, self.wrap_watcher(watcher)))
+
+    def get_acl(self, path):
+        return self.wrap_future(self.connection.get_acl_async(path))
+
+    def set_acl(self, path, version, acl):
+        return self.wrap_future(self.connection.set_acl_async(path, version, acl))
+
+
+class AsyncLock(object):
+    '''Awaitable front end for zkpy.lock.Lock.
+
+    acquire() returns a future, which completes as soon as the lock is held.
+    Waiting for the lock does not occupy a thread: the lock's neighbor watch
+    completes the future on the loop. Cancelling the future withdraws from the
+    lock queue.
+    '''
+
+    def __init__(self, connection, path, watcher=None, name=None):
+        '''
+        :param connection: The AsyncConnection
+        :param path: Parent node of the lock nodes. Needs to exist.
+        :param watcher: Optional lock watcher object. Its lock_acquired() and
+                        lock_released() methods are called on the loop.
+        '''
+        self._connection = connection
+        self._loop = connection.loop
+        self.watcher = watcher
+        self._lock = Lock(connection.connection, path, self, name)
+        self._acquired = None
+        # executor future of the running Lock.acquire() call
+        self._requesting = None
+
+    @property
+    def lock(self):
+        '''The underlying zkpy.lock.Lock'''
+        return self._lock
+
+    def is_owner(self):
+        return self._lock.is_owner()
+
+    def acquire(self):
+        '''Returns a future, which completes with True, as soon as the lock
+        is acquired.
+
+        Note: the synchronous Lock.acquire() (creating the lock node, listing
+        the children and setting the neighbor watch) runs in the loop's
+        default executor and occupies one of its threads for these round
+        trips. It does not block while waiting for the lock.
+        '''
+        if self._acquired is not None and not self._acquired.done():
+            return self._acquired
+        self._acquired = acquired = _create_future(self._loop)
+        if self._lock.is_owner():
+            acquired.set_result(True)
+            return acquired
+        acquired.add_done_callback(self._acquire_done)
+
+        # only the initial round trips run in the executor, waiting is
+        # done by the neighbor watch
+        def locked(future):
+            if acquired.done():
+                return
+            exception = future.exception()
+            if exception is not None:
+                acquired.set_exception(exception)
+            elif future.result():
+                acquired.set_result(True)
+        self._requesting = self._connection.run_in_executor(self._lock.acquire)
+        self._requesting.add_done_callback(locked)
+        return acquired
+
+    def _acquire_done(self, acquired):
+        if acquired.cancelled():
+            # leave the lock queue
+            self._release()
+
+    def _release(self):
+        '''Runs Lock.release() in the executor, once a running Lock.acquire()
+        returned (an earlier release would miss the lock node, which would
+        be left behind and get the lock without a holder). Returns a future.
+        '''
+        requesting = self._requesting
+        if requesting is None or requesting.done():
+            return self._connection.run_in_executor(self._lock.release)
+        released = _create_future(self._loop)
+        def requested(_future):
+            self._connection.run_in_executor(self._lock.release).add_done_callback(
+                lambda done: _transfer(done, released))
+        requesting.add_done_callback(requested)
+        return released
+
+    def release(self):
+        '''Returns a future, which completes, when the lock is released.'''
+        acquired, self._acquired = self._acquired, None
+        if acquired is not None and not acquired.done():
+            # stop waiting, the release below leaves the lock queue
+            acquired.remove_done_callback(self._acquire_done)
+            acquired.cancel()
+        return self._release()
+
+    def _set_acquired(self):
+        if self._acquired is not None and not self._acquired.done():
+            self._acquired.set_result(True)
+        if self.watcher:
+            self.watcher.lock_acquired()
+
+    def _set_released(self):
+        if self.watcher:
+            self.watcher.lock_released()
+
+    # watcher interface of zkpy.lock.Lock (called on zookeeper's threads)
+    def lock_acquired(self):
+        self._loop.call_soon_threadsafe(self._set_acquired)
+
+    def lock_released(self):
+        self._loop.call_soon_threadsafe(self._set_released)
+
+    def __aenter__(self):
+        return self.acquire()
+
+    def __aexit__(self, type, value, traceback):
+        return self.release()
+
+
+class AsyncQueue(object):
+    '''Awaitable front end for the distributed zookeeper queue
+    (see zkpy.queue.Queue), implemented on the asynchronous zookeeper api.
+    '''
+
+    def __init__(self, connection, path):
+        '''
+        :param connection: The AsyncConnection
+        :param path: The parent path of the Queue. Needs to exist!
+        '''
+        self._connection = connection
+        self._loop = connection.loop
+        self.path = path
+
+        try:
+            _stat, self.node_acl = connection.connection.get_acl(path)
+        except zookeeper.NoNodeException:
+            raise RuntimeError('Path %s does not exists.' % self.path)
+
+    def push(self, data):
+        '''Returns a future with the path of the new queue item.'''
+        return self._connection.create('%s/item-' % self.path,
+                                       self._connection.connection.codecs.encode(self.path, data),
+                                       self.node_acl,
+                                       NodeCreationMode.PersistentSequential)
+
+    def pop(self):
+        '''Returns a future with the data of the head of the queue. The future
+        fails with an IndexError, if the queue is empty.
+        '''
+        result = _create_future(self._loop)
+        self._pop(result, False)
+        return result
+
+    def pop_blocking(self):
+        '''Returns a future with the data of the head of the queue. The future
+        completes as soon as there is an item (use asyncio.wait_for() for a
+        timeout).
+        '''
+        result = _create_future(self._loop)
+        self._pop(result, True)
+        return result
+
+    def _pop(self, result, blocking):
+        if result.done():
+            return
+        watcher = None
+        if blocking:
+            # retry, as soon as the items change
+            watcher = lambda *_args: self._pop(result, blocking)
+        items = self._connection.get_children(self.path, watcher)
+        items.add_done_callback(
+            lambda items: self._on_items(result, blocking, items))
+
+    def _on_items(self, result, blocking, items):
+        if result.done():
+            return
+        exception = items.exception()
+        if exception is not None:
+            result.set_exception(exception)
+            return
+        self._remove(result, blocking, sorted(items.result()))
+
+    def _remove(self, result, blocking, items):
+        '''Tries to get and delete the first of the given items.'''
+        if result.done():
+            return
+        if not items:
+            if not blocking:
+                result.set_exception(IndexError('pop from empty list'))
+            # otherwise the watcher triggers the next attempt
+            return
+
+        item_path = '%s/%s' % (self.path, items[0])
+        def got(future):
+            if result.done():
+                return
+            exception = future.exception()
+            if isinstance(exception, zookeeper.NoNodeException):
+                # another consumer already popped this item
+                self._remove(result, blocking, items[1:])
+            elif exception is not None:
+                result.set_exception(exception)
+            else:
+                data, stat = future.result()
+                # decoded before the delete: an item, which can not be
+                # decoded, stays in the queue
+                try:
+                    value = self._connection.connection.codecs.decode(data)
+                except Exception as e:
+                    result.set_exception(e)
+                    return
+                self._connection.delete(item_path, stat['version']).add_done_callback(
+                    lambda deleted: self._on_deleted(result, blocking, items, item_path, value, deleted))
+        self._connection.get(item_path).add_done_callback(got)
+
+    def _on_deleted(self, result, blocking, items, item_path, value, deleted):
+        if result.done():
+            return
+        exception = deleted.exception()
+        if exception is None:
+            result.set_result(value)
+        elif isinstance(exception, zookeeper.NoNodeException):
+            self._remove(result, blocking, items[1:])
+        elif isinstance(exception, zookeeper.BadVersionException):
+            logger.warn('Queue item "%s" was modified. This should not be done.' % item_path)
+            self._remove(result, blocking, items)
+        else:
+            result.set_exception(exception)
@@ -0,0 +1,325 @@
+'''
+Throughput and latency benchmark of the zkpy recipes.
+
+    python -m zkpy.bench                                  # in-process fake
+    python -m zkpy.bench --latency 0.0005 --threads 16
+    python -m zkpy.bench --servers zk1:2181,zk2:2181 --sessions 4 \\
+                         --processes 2 --json results.json lock queue
+
+Every scenario is run by threads (in each of processes) sharing sessions
+connections and reports per high level operation: ops/s and p50/p99
+latency. The zookeeper requests (not sequential round trips, requests may
+be pipelined) are counted per scenario by the connection metrics, shared by
+the threads, and reported per operation of the scenario on average. Thus
+requests the client does not send itself (multi requests of the fake
+backend) are not included.
+
+Scenarios: lock (acquire and release of one contended lock), queue (push
+and pop), ensure_path (recursive creation of new paths), get and set.
+'''
+
+from zkpy.acl import Acls
+from zkpy.connection import Connection
+from zkpy.lock import Lock
+from zkpy.queue import Queue
+import json
+import multiprocessing
+import optparse
+import sys
+import threading
+import time
+import zookeeper
+
+ACL = [Acls.Unsafe]
+
+
+class Scenario(object):
+    '''Base class of the scenarios. worker() returns the step function of a
+    thread, which executes one operation and returns its name.
+    '''
+
+    name = None
+
+    def __init__(self, root):
+        self.path = '%s/%s' % (root, self.name)
+
+    def prepare(self, connection):
+        connection.ensure_path_exists(self.path, '', ACL, recursive=True)
+
+    def worker(self, connection, index):
+        raise NotImplementedError()
+
+    def cleanup(self, connection):
+        connection.delete_recursive(self.path)
+
+
+class LockScenario(Scenario):
+    name = 'lock'
+
+    def worker(self, connection, index):
+        lock = Lock(connection, self.path)
+        def step(operation):
+            with lock:
+                pass
+            return 'acquire_release'
+        return step
+
+
+class QueueScenario(Scenario):
+    name = 'queue'
+
+    def worker(self, connection, index):
+        queue = Queue(connection, self.path)
+        def step(operation):
+            if operation % 2 == 0:
+                queue.push('item-%d-%d' % (index, operation))
+                return 'push'
+            try:
+                queue.pop()
+            except IndexError:
+                pass
+            return 'pop'
+        return step
+
+
+class EnsurePathScenario(Scenario):
+    name = 'ensure_path'
+
+    def worker(self, connection, index):
+        def step(operation):
+            connection.ensure_path_exists(
+                '%s/%d/%d/leaf' % (self.path, index, operation), '', ACL, recursive=True)
+            return 'ensure_path_exists'
+        return step
+
+
+class GetScenario(Scenario):
+    name = 'get'
+
+    def prepare(self, connection):
+        Scenario.prepare(self, connection)
+        connection.set(self.path, 'x' * 100)
+
+    def worker(self, connection, index):
+        def step(operation):
+            connection.get(self.path)
+            return 'get'
+        return step
+
+
+class SetScenario(Scenario):
+    name = 'set'
+
+    def worker(self, connection, index):
+        path = '%s/%d' % (self.path, index)
+        connection.ensure_path_exists(path, '', ACL)
+        def step(operation):
+            connection.set(path, 'x' * 100)
+            return 'set'
+        return step
+
+
+SCENARIOS = dict((scenario.name, scenario) for scenario in
+                 (LockScenario, QueueScenario, EnsurePathScenario, GetScenario, SetScenario))
+
+
+def _requests(connections):
+    '''Returns the number of requests sent by the connections.'''
+    count = 0
+    for connection in connections:
+        for stats in connection.stats()['operations'].values():
+            count += stats['count']
+    return count
+
+
+def run_scenario(name, options, backend=None, process=0):
+    '''Runs a scenario in this process. Returns a dict with the latencies
+    per operation name, the errors, the number of requests and the elapsed
+    seconds.
+    '''
+    scenario = SCENARIOS[name](options.root)
+    sessions = options.sessions
+    connections = [Connection(options.servers, options.timeout, backend=backend)
+                   for _i in range(sessions)]
+    try:
+        for connection in connections:
+            connection.enable_metrics()
+        steps = [scenario.worker(connections[index % sessions], process * options.threads + index)
+                 for index in range(options.threads)]
+        requests = _requests(connections)
+
+        latencies = {}
+        errors = {}
+        lock = threading.Lock()
+        def run(step):
+            for operation in range(options.operations):
+                started = time.time()
+                try:
+                    operation_name = step(operation)
+                except Exception as e:
+                    lock.acquire()
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    lock.release()
+                    continue
+                latency = time.time() - started
+                lock.acquire()
+                latencies.setdefault(operation_name, []).append(latency)
+                lock.release()
+
+        threads = [threading.Thread(target=run, args=(step,)) for step in steps]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+        return {'latencies': latencies, 'errors': errors, 'elapsed': elapsed,
+                'requests': _requests(connections) - requests}
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def _run_process(args):
+    name, options, process = args
+    return run_scenario(name, options, process=process)
+
+
+def _percentile(values, percent):
+    '''Returns the percentile of sorted values.'''
+    index = max(0, int(len(values) * percent / 100. + 0.5) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(runs):
+    '''Merges the results of the processes of a scenario.'''
+    latencies = {}
+    errors = {}
+    requests = 0
+    elapsed = 0.
+    for run in runs:
+        for name, values in run['latencies'].items():
+            latencies.setdefault(name, []).extend(values)
+        for name, count in run['errors'].items():
+            errors[name] = errors.get(name, 0) + count
+        requests += run['requests']
+        elapsed = max(elapsed, run['elapsed'])
+
+    total = sum(len(values) for values in latencies.values())
+    operations = {}
+    for name, values in latencies.items():
+        values.sort()
+        operations[name] = {
+            'count': len(values),
+            'ops_per_second': len(values) / elapsed if elapsed else 0.,
+            'p50': _percentile(values, 50),
+            'p99': _percentile(values, 99),
+            'max': values[-1],
+        }
+    return {
+        'operations': operations,
+        'errors': errors,
+        'elapsed': elapsed,
+        'ops_per_second': total / elapsed if elapsed else 0.,
+        'requests': requests,
+        'requests_per_operation': float(requests) / total if total else 0.,
+    }
+
+
+def benchmark(names, options):
+    '''Runs the scenarios. Returns the results per scenario name.'''
+    backend = None
+    if options.servers is None:
+        from zkpy.testing import FakeZooKeeper
+        backend = FakeZooKeeper(latency=options.latency, seed=options.seed)
+        options.servers = 'fake:2181'
+
+    setup = Connection(options.servers, options.timeout, backend=backend)
+    results = {}
+    try:
+        for name in names:
+            scenario = SCENARIOS[name](options.root)
+            scenario.prepare(setup)
+            try:
+                if options.processes > 1:
+                    pool = multiprocessing.Pool(options.processes)
+                    try:
+                        runs = pool.map(_run_process, [(name, options, process)
+                                                       for process in range(options.processes)])
+                    finally:
+                        pool.close()
+                        pool.join()
+                else:
+                    runs = [run_scenario(name, options, backend)]
+            finally:
+                scenario.cleanup(setup)
+            results[name] = summarize(runs)
+    finally:
+        setup.close()
+    return results
+
+
+def format_results(results):
+    lines = ['%-12s %-20s %8s %10s %10s %10s' % (
+        'scenario', 'operation', 'count', 'ops/s', 'p50 ms', 'p99 ms')]
+    for name in sorted(results):
+        result = results[name]
+        for operation in sorted(result['operations']):
+            stats = result['operations'][operation]
+            lines.append('%-12s %-20s %8d %10.1f %10.3f %10.3f' % (
+                name, operation, stats['count'], stats['ops_per_second'],
+                stats['p50'] * 1000, stats['p99'] * 1000))
+        # the sessions are shared by the operations of a scenario
+        lines.append('%-12s requests per operation (all operations): %.2f' % (
+                name, result['requests_per_operation']))
+        if result['errors']:
+            lines.append('%-12s errors: %s' % (name, result['errors']))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = optparse.OptionParser(
+        usage='%prog [options] [scenario ...]',
+        description='Scenarios: %s (default: all)' % ', '.join(sorted(SCENARIOS)))
+    parser.add_option('--servers', help='zookeeper servers (default: in-process fake)')
+    parser.add_option('--latency', type='float', default=0.,
+                      help='request latency of the fake in seconds [%default]')
+    parser.add_option('--seed', type='int', default=None, help='seed of the fake')
+    parser.add_option('--threads', type='int', default=4, help='threads per process [%default]')
+    parser.add_option('--processes', type='int', default=1,
+                      help='processes (needs --servers) [%default]')
+    parser.add_option('--sessions', type='int', default=2, help='sessions per process [%default]')
+    parser.add_option('--operations', type='int', default=200,
+                      help='operations per thread [%default]')
+    parser.add_option('--root', default='/zkpy-bench', help='root path of the benchmark nodes [%default]')
+    parser.add_option('--timeout', type='float', default=5., help='connect timeout [%default]')
+    parser.add_option('--json', metavar='FILE', help="write the results as JSON ('-' for stdout)")
+    options, names = parser.parse_args(args)
+
+    names = names or sorted(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %s' % name)
+    if options.processes > 1 and options.servers is None:
+        parser.error('--processes needs --servers (the fake is per process)')
+    if options.sessions < 1 or options.threads < 1:
+        parser.error('at least one session and thread are needed')
+
+    zookeeper.set_debug_level(zookeeper.LOG_LEVEL_ERROR)
+    results = benchmark(names, options)
+    report = {'options': {'servers': options.servers, 'latency': options.latency,
+                          'threads': options.threads, 'processes': options.processes,
+                          'sessions': options.sessions, 'operations': options.operations},
+              'results': results}
+    if options.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        if options.json:
+            with open(options.json, 'w') as stream:
+                json.dump(report, stream, indent=2, sort_keys=True)
+        print format_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+'''
+Values larger than a single znode.
+
+Zookeeper limits node data to about 1 MB (jute.maxbuffer). A blob splits a
+value into chunk nodes below a manifest node:
+
+    write_blob(conn, '/artifacts/routing', data, acl)
+    data = read_blob(conn, '/artifacts/routing')
+
+    # or without holding the whole value in memory
+    with open('routing.bin', 'rb') as source:
+        write_blob(conn, '/artifacts/routing', source, acl)
+    reader = open_blob(conn, '/artifacts/routing')
+    for chunk in reader:
+        target.write(chunk)
+
+Layout: the manifest node (at path) holds a JSON document with the
+generation, number of chunks, size and SHA-1 of the value; the chunks are
+its children named <generation>-<index>. A write creates the chunks of a new
+generation (pipelined creates), then switches the manifest (checked
+against the manifest version, see write_blob()) and finally deletes the
+chunks of the previous generation. Readers therefore never see a partly
+written value; a reader, whose blob is replaced while it reads, gets a
+BlobChangedError.
+'''
+
+import collections
+import hashlib
+import json
+import logging
+import uuid
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+# below zookeeper's default jute.maxbuffer of 1 MB (minus request overhead)
+DEFAULT_CHUNK_SIZE = 512 * 1024
+# chunk data sent in one pipeline (held in memory and in flight); every chunk
+# is a request of its own, thus only the chunk size is bound to jute.maxbuffer
+DEFAULT_BATCH_SIZE = 4 * 1024 * 1024
+
+
+class BlobChangedError(Exception):
+    '''Raised, if a blob was replaced while it was read.'''
+    pass
+
+
+class BlobCorruptedError(Exception):
+    '''Raised, if a blob does not match its manifest.'''
+    pass
+
+
+def _chunk_path(path, generation, index):
+    return '%s/%s-%06d' % (path, generation, index)
+
+
+def _read_manifest(connection, path):
+    '''Returns (manifest, stat) of a blob. The manifest is None, if the
+    manifest node exists but no value was written yet.
+    '''
+    data, stat = connection.get(path)
+    if not data:
+        return None, stat
+    manifest = json.loads(data)
+    manifest['generation'] = str(manifest['generation'])
+    manifest['sha1'] = str(manifest['sha1'])
+    return manifest, stat
+
+
+def _chunks(value, chunk_size):
+    '''Yields the chunks of a string or a file like object.'''
+    if isinstance(value, basestring):
+        for offset in range(0, len(value), chunk_size):
+            yield value[offset:offset + chunk_size]
+    else:
+        while True:
+            chunk = value.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def write_blob(connection, path, value, acl, version=-1,
+               chunk_size=DEFAULT_CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+               max_outstanding=16):
+    '''Writes a blob. Returns the stat of the manifest node.
+
+    :param value: The value (string) or a file like object to read it from
+    :param acl: ACL of the manifest and the chunk nodes
+    :param version: Expected version of the manifest node. With -1 the
+                    version read at the start of the write is expected.
+                    If the manifest was changed, the new chunks are removed
+                    and a BadVersionException is raised.
+    :param batch_size: Maximal number of chunk bytes sent in one pipeline
+                       (and thus held in memory). A batch holds at least one
+                       chunk.
+    :param max_outstanding: Number of pipelined deletes of old chunks
+    '''
+    try:
+        old_manifest, stat = _read_manifest(connection, path)
+    except zookeeper.NoNodeException:
+        try:
+            connection.create(path, '', acl)
+            old_manifest, stat = None, None
+        except zookeeper.NodeExistsException:
+            # created by a concurrent writer
+            old_manifest, stat = _read_manifest(connection, path)
+    if stat is not None and version not in (-1, stat['version']):
+        raise zookeeper.BadVersionException(
+            '%s has version %d, expected %d' % (path, stat['version'], version))
+    if version == -1:
+        # the manifest node was created by us otherwise
+        version = stat['version'] if stat is not None else 0
+
+    generation = uuid.uuid4().hex[:12]
+    digest = hashlib.sha1()
+    count = 0
+    size = 0
+    try:
+        pipeline = connection.pipeline()
+        batched = 0
+        for chunk in _chunks(value, chunk_size):
+            if len(pipeline) and batched + len(chunk) > batch_size:
+                pipeline.commit()
+                pipeline = connection.pipeline()
+                batched = 0
+            digest.update(chunk)
+            size += len(chunk)
+            batched += len(chunk)
+            pipeline.create(_chunk_path(path, generation, count), chunk, acl)
+            count += 1
+        if len(pipeline):
+            pipeline.commit()
+
+        manifest = {'generation': generation, 'chunks': count, 'size': size,
+                    'sha1': digest.hexdigest()}
+        stat = connection.set2(path, json.dumps(manifest), version)
+    except:
+        _delete_chunks(connection, path, generation, count, max_outstanding)
+        raise
+
+    if old_manifest is not None:
+        _delete_chunks(connection, path, old_manifest['generation'],
+                       old_manifest['chunks'], max_outstanding)
+    logger.debug('Wrote blob %s: %d bytes in %d chunks' % (path, size, count))
+    return stat
+
+
+def _delete_chunks(connection, path, generation, count, max_outstanding):
+    '''Deletes the chunks of a generation (missing ones are ignored).'''
+    for first in range(0, count, max_outstanding):
+        futures = [connection.delete_async(_chunk_path(path, generation, index))
+                   for index in range(first, min(count, first + max_outstanding))]
+        for future in futures:
+            exception = future.exception()
+            if exception is not None and not isinstance(exception, zookeeper.NoNodeException):
+                logger.error('Could not delete chunk of blob %s: %s' % (path, exception))
+
+
+class BlobReader(object):
+    '''Streams the value of a blob. The chunks are fetched with up to
+    max_outstanding pipelined requests. Iterating yields the chunks; read()
+    behaves like file.read(). The SHA-1 of the value is verified after the
+    last chunk.
+    '''
+
+    def __init__(self, connection, path, max_outstanding=4):
+        self._connection = connection
+        self.path = path
+        self.manifest, self.stat = _read_manifest(connection, path)
+        if self.manifest is None:
+            raise zookeeper.NoNodeException('%s holds no blob' % path)
+        self.size = self.manifest['size']
+        self._max_outstanding = max_outstanding
+        self._next = 0
+        self._in_flight = collections.deque()
+        self._digest = hashlib.sha1()
+        self._buffer = ''
+
+    @property
+    def version(self):
+        '''Version of the manifest node.'''
+        return self.stat['version']
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        '''Returns the next chunk.'''
+        if self._buffer:
+            chunk, self._buffer = self._buffer, ''
+            return chunk
+        return self._fetch()
+
+    def _fetch(self):
+        count = self.manifest['chunks']
+        while self._next < count and len(self._in_flight) < self._max_outstanding:
+            self._in_flight.append(self._connection.get_async(
+                _chunk_path(self.path, self.manifest['generation'], self._next)))
+            self._next += 1
+        if not self._in_flight:
+            raise StopIteration()
+
+        try:
+            chunk, _stat = self._in_flight.popleft().result()
+        except zookeeper.NoNodeException:
+            raise BlobChangedError('%s was replaced while reading' % self.path)
+        self._digest.update(chunk)
+        if not self._in_flight and self._next == count:
+            if self._digest.hexdigest() != self.manifest['sha1']:
+                raise BlobCorruptedError('Checksum of %s does not match' % self.path)
+        return chunk
+
+    def read(self, size=-1):
+        '''Reads up to size bytes (everything, if size is negative).'''
+        parts = []
+        length = 0
+        while size < 0 or length < size:
+            try:
+                chunk = self.next()
+            except StopIteration:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size >= 0 and len(data) > size:
+            data, self._buffer = data[:size], data[size:]
+        return data
+
+    def close(self):
+        '''Drops the outstanding requests.'''
+        for future in self._in_flight:
+            future.exception()
+        self._in_flight.clear()
+        self._next = self.manifest['chunks']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_blob(connection, path, max_outstanding=4):
+    '''Returns a BlobReader for the blob at path.'''
+    return BlobReader(connection, path, max_outstanding)
+
+
+def read_blob(connection, path, max_outstanding=16, retries=3):
+    '''Returns the value of a blob. Reads again, if the blob was replaced
+    while reading (up to retries times).
+    '''
+    for attempt in range(retries + 1):
+        reader = BlobReader(connection, path, max_outstanding)
+        try:
+            return reader.read()
+        except BlobChangedError:
+            if attempt == retries:
+                raise
+            logger.debug('%s was replaced while reading. Reading again.' % path)
+
+
+def delete_blob(connection, path, max_outstanding=100):
+    '''Deletes a blob with all its chunks (also orphaned ones of failed
+    writes). Returns the number of deleted nodes.
+    '''
+    return connection.delete_recursive(path, max_outstanding)
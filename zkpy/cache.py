@@ -0,0 +1,353 @@
+'''
+Local, watch driven cache of a zookeeper subtree.
+
+    cache = TreeCache(conn, '/config')
+    cache.start(timeout=10)
+    data, stat = cache.get('/config/foo')   # no round trip
+
+The subtree is loaded with pipelined requests and kept up to date with data
+and child watches.
+'''
+
+from zkpy.connection import EventType, KeeperState
+from zkpy.utils import enum
+import logging
+import threading
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+TreeEvents = enum(
+    NodeAdded   = 1,
+    NodeUpdated = 2,
+    NodeRemoved = 3
+)
+
+
+class _Node(object):
+    __slots__ = ['data', 'stat', 'children']
+
+    def __init__(self, data, stat):
+        self.data = data
+        self.stat = stat
+        self.children = set()
+
+
+class TreeCache(object):
+    '''Caches the data and children of all nodes below (and including) path.
+
+    Listeners need to implement the methods
+     - node_added(path, data, stat)
+     - node_updated(path, data, stat)
+     - node_removed(path)
+    They are called on zookeeper's completion thread.
+    '''
+
+    def __init__(self, connection, path, listener=None):
+        '''
+        :param connection: The zkpy connection
+        :param path: Root of the cached subtree. May not exist (yet).
+        :param listener: Optional listener object
+        '''
+        self._connection = connection
+        self._path = path.rstrip('/') or '/'
+        self._nodes = {}
+        self._lock = threading.RLock()
+        self._listeners = set()
+        if listener:
+            self.register_listener(listener)
+
+        self._started = False
+        self._stopped = False
+        self._waiting_for_root = False
+        self._pending = 0
+        self._initialized = threading.Event()
+
+    @property
+    def path(self):
+        return self._path
+
+    def register_listener(self, listener):
+        self._listeners.add(listener)
+
+    def unregister_listener(self, listener):
+        self._listeners.discard(listener)
+
+    def start(self, timeout=None):
+        '''Loads the subtree and starts following its changes.
+        Waits up to timeout seconds for the initial load. Returns True, if
+        the subtree was loaded completely.
+        '''
+        if self._started:
+            raise RuntimeError('TreeCache was already started')
+        self._started = True
+        self._session_id = self._connection.client_id()[0]
+        self._connection.add_global_watcher(self._connection_watcher)
+        self._load(self._path)
+        self._initialized.wait(timeout)
+        return self._initialized.isSet()
+
+    def stop(self):
+        '''Stops following changes. Pending watches are ignored.'''
+        self._stopped = True
+        self._connection.remove_global_watcher(self._connection_watcher)
+
+    def is_initialized(self):
+        '''Returns True, once the initial load completed.'''
+        return self._initialized.isSet()
+
+    def get(self, path):
+        '''Returns the cached (data, stat) tuple of a node.
+        Raises a zookeeper.NoNodeException, if the node is not cached.
+        '''
+        node = self._node(path)
+        return node.data, node.stat
+
+    def get_children(self, path):
+        '''Returns the cached children names of a node.
+        Raises a zookeeper.NoNodeException, if the node is not cached.
+        '''
+        return sorted(self._node(path).children)
+
+    def exists(self, path):
+        '''Returns the cached stat of a node or None'''
+        self._lock.acquire()
+        try:
+            node = self._nodes.get(path)
+            return node.stat if node is not None else None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, path):
+        return path in self._nodes
+
+    def _node(self, path):
+        self._lock.acquire()
+        try:
+            node = self._nodes.get(path)
+        finally:
+            self._lock.release()
+        if node is None:
+            raise zookeeper.NoNodeException('%s is not cached' % path)
+        return node
+
+    def _child_path(self, path, child):
+        if path == '/':
+            return '/' + child
+        return '%s/%s' % (path, child)
+
+    def _begin(self):
+        self._lock.acquire()
+        self._pending += 1
+        self._lock.release()
+
+    def _end(self):
+        self._lock.acquire()
+        try:
+            self._pending -= 1
+            if self._pending == 0 and not self._initialized.isSet():
+                logger.debug('Loaded %d nodes below %s' % (len(self._nodes), self._path))
+                self._initialized.set()
+        finally:
+            self._lock.release()
+
+    def _load(self, path):
+        '''Fetches data and children of a node and sets the watches.'''
+        self._fetch_data(path)
+        self._fetch_children(path)
+
+    def _fetch_data(self, path):
+        self._begin()
+        self._connection.get_async(path, self._data_watcher).add_done_callback(
+            lambda future: self._on_data(path, future))
+
+    def _fetch_children(self, path):
+        self._begin()
+        self._connection.get_children_async(path, self._child_watcher).add_done_callback(
+            lambda future: self._on_children(path, future))
+
+    def _on_data(self, path, future):
+        try:
+            if self._stopped:
+                return
+            exception = future.exception()
+            if isinstance(exception, zookeeper.NoNodeException):
+                self._remove(path)
+                if path == self._path:
+                    self._wait_for_root()
+                return
+            if exception is not None:
+                logger.error('Could not get %s: %s' % (path, exception))
+                return
+
+            data, stat = future.result()
+            self._lock.acquire()
+            try:
+                node = self._nodes.get(path)
+                if node is None:
+                    self._nodes[path] = _Node(data, stat)
+                    event = TreeEvents.NodeAdded
+                elif node.stat['mzxid'] != stat['mzxid']:
+                    node.data = data
+                    node.stat = stat
+                    event = TreeEvents.NodeUpdated
+                else:
+                    return
+            finally:
+                self._lock.release()
+            self._notify(event, path, data, stat)
+        finally:
+            self._end()
+
+    def _on_children(self, path, future):
+        try:
+            if self._stopped:
+                return
+            exception = future.exception()
+            if isinstance(exception, zookeeper.NoNodeException):
+                # the data request handles deleted nodes
+                return
+            if exception is not None:
+                logger.error('Could not get children of %s: %s' % (path, exception))
+                return
+
+            children = set(future.result())
+            self._lock.acquire()
+            try:
+                node = self._nodes.get(path)
+                if node is None:
+                    # the data and children requests are pipelined, thus the
+                    # node is only missing, if it was deleted in the meantime
+                    return
+                added = children - node.children
+                removed = node.children - children
+                node.children = children
+            finally:
+                self._lock.release()
+            for child in removed:
+                self._remove(self._child_path(path, child))
+            for child in added:
+                self._load(self._child_path(path, child))
+        finally:
+            self._end()
+
+    def _remove(self, path):
+        '''Removes a node and its descendants from the cache.'''
+        removed = []
+        self._lock.acquire()
+        try:
+            if path not in self._nodes:
+                return
+            stack = [path]
+            while stack:
+                current = stack.pop()
+                node = self._nodes.pop(current, None)
+                if node is None:
+                    continue
+                removed.append(current)
+                stack.extend(self._child_path(current, child) for child in node.children)
+            parent = self._nodes.get(path[:path.rfind('/')] or '/')
+            if parent is not None and path != self._path:
+                parent.children.discard(path[path.rfind('/') + 1:])
+        finally:
+            self._lock.release()
+        for removed_path in removed:
+            self._notify(TreeEvents.NodeRemoved, removed_path)
+
+    def _notify(self, event, path, data=None, stat=None):
+        for listener in list(self._listeners):
+            try:
+                if event == TreeEvents.NodeAdded:
+                    listener.node_added(path, data, stat)
+                elif event == TreeEvents.NodeUpdated:
+                    listener.node_updated(path, data, stat)
+                else:
+                    listener.node_removed(path)
+            except Exception:
+                logger.exception('Listener %s failed for %s' % (listener, path))
+
+    def _data_watcher(self, handle, type, state, path):
+        if self._stopped or type == EventType.NoneType:
+            return
+        if type == EventType.NodeDeleted:
+            self._remove(path)
+            if path == self._path:
+                self._wait_for_root()
+        elif type == EventType.NodeDataChanged:
+            self._fetch_data(path)
+
+    def _child_watcher(self, handle, type, state, path):
+        if self._stopped or type == EventType.NoneType:
+            return
+        if type == EventType.NodeChildrenChanged:
+            self._fetch_children(path)
+
+    def _wait_for_root(self):
+        '''Sets a watch for the creation of the (missing) root.'''
+        self._lock.acquire()
+        try:
+            if self._waiting_for_root:
+                return
+            self._waiting_for_root = True
+        finally:
+            self._lock.release()
+        self._begin()
+        self._connection.exists_async(self._path, self._root_watcher).add_done_callback(
+            self._on_root_exists)
+
+    def _root_created(self):
+        '''Loads the root, if it was not loaded since it was missing.'''
+        self._lock.acquire()
+        try:
+            waiting, self._waiting_for_root = self._waiting_for_root, False
+        finally:
+            self._lock.release()
+        if waiting and not self._stopped:
+            self._load(self._path)
+
+    def _root_watcher(self, handle, type, state, path):
+        if type == EventType.NodeCreated:
+            self._root_created()
+
+    def _on_root_exists(self, future):
+        try:
+            if future.exception() is None and future.result() is not None:
+                # created in the meantime
+                self._root_created()
+        finally:
+            self._end()
+
+    def _connection_watcher(self, type, state, path):
+        if state == KeeperState.Expired:
+            if not self._connection.recovers_session:
+                logger.warning('Session expired. TreeCache of %s does not receive updates anymore.' % self._path)
+        elif state == KeeperState.Connected:
+            session_id = self._connection.client_id()[0]
+            if session_id != self._session_id:
+                self._session_id = session_id
+                self._resync()
+
+    def _resync(self):
+        '''Compares all cached nodes with zookeeper after the session was
+        recovered. The connection re-armed the watches already, thus the nodes
+        are fetched without watches.
+        '''
+        logger.info('Session recovered. Resynchronising TreeCache of %s' % self._path)
+        self._lock.acquire()
+        try:
+            paths = list(self._nodes)
+        finally:
+            self._lock.release()
+        if not paths:
+            # the root is missing: the re-armed root watch waits for it
+            return
+        for path in paths:
+            self._begin()
+            self._connection.get_async(path).add_done_callback(
+                lambda future, path=path: self._on_data(path, future))
+            self._begin()
+            self._connection.get_children_async(path).add_done_callback(
+                lambda future, path=path: self._on_children(path, future))
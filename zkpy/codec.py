@@ -0,0 +1,216 @@
+'''
+Node data codecs.
+
+Zookeeper stores plain byte strings. Codecs turn values into node data and
+back. Encoded data starts with a header naming its codec, thus readers decode
+it without knowing the codec of the writer; data without header (written
+without a codec) is returned unchanged.
+
+Codecs are selected per path prefix on a connection:
+
+    conn.codecs.register('/config', ZlibCodec(JsonCodec()))
+    conn.set_value('/config/app', {'threads': 8})
+    value, stat = conn.get_value('/config/app')
+
+Recipes (e.g. the Queue) encode their items with the codec of their path.
+
+Built in codecs:
+ - JsonCodec
+ - MsgpackCodec (needs msgpack)
+ - ZlibCodec and Lz4Codec (needs lz4) compress the encoding of an inner codec
+   (or plain strings), if it is at least min_size bytes long.
+'''
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.block as lz4
+except ImportError:
+    try:
+        import lz4
+    except ImportError:
+        lz4 = None
+
+
+# marks encoded data, followed by the tag of the codec
+HEADER = '\x00ZK'
+_HEADER_LENGTH = len(HEADER) + 1
+
+# tag -> codec decoding data with that tag
+_decoders = {}
+
+
+class CodecError(Exception):
+    pass
+
+
+def register_codec(codec):
+    '''Makes decode() recognise the data of a codec (built in codecs are
+    registered already).
+    '''
+    if len(codec.tag) != 1:
+        raise ValueError('Codec tags are single characters')
+    _decoders[codec.tag] = codec
+
+
+def decode(data):
+    '''Decodes data of any registered codec. Data without header is returned
+    unchanged.
+    '''
+    if data is None or not data.startswith(HEADER) or len(data) < _HEADER_LENGTH:
+        return data
+    tag = data[len(HEADER)]
+    codec = _decoders.get(tag)
+    if codec is None:
+        raise CodecError('Unknown codec tag %r' % tag)
+    return codec.decode_payload(data[_HEADER_LENGTH:])
+
+
+class Codec(object):
+    '''Base class of the codecs. Subclasses define a unique tag and
+    implement encode_payload() and decode_payload().
+    '''
+
+    tag = None
+
+    def encode(self, value):
+        '''Returns the node data (with header) of value.'''
+        return HEADER + self.tag + self.encode_payload(value)
+
+    def decode(self, data):
+        return decode(data)
+
+    def encode_payload(self, value):
+        raise NotImplementedError()
+
+    def decode_payload(self, payload):
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    tag = 'j'
+
+    def encode_payload(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def decode_payload(self, payload):
+        return json.loads(payload)
+
+
+class MsgpackCodec(Codec):
+    tag = 'm'
+
+    def encode_payload(self, value):
+        if msgpack is None:
+            raise CodecError('msgpack is not installed')
+        return msgpack.packb(value)
+
+    def decode_payload(self, payload):
+        if msgpack is None:
+            raise CodecError('msgpack is not installed')
+        return msgpack.unpackb(payload)
+
+
+class _CompressingCodec(Codec):
+    '''Compresses the encoding of an inner codec. Values smaller than
+    min_size are stored with the inner codec only.
+    '''
+
+    def __init__(self, inner=None, min_size=512):
+        '''
+        :param inner: Codec of the values (None for plain strings)
+        :param min_size: Minimal encoded size (in bytes) worth compressing
+        '''
+        self.inner = inner
+        self.min_size = min_size
+
+    def encode(self, value):
+        data = self.inner.encode(value) if self.inner is not None else value
+        if len(data) < self.min_size:
+            return data
+        return HEADER + self.tag + self.compress(data)
+
+    def encode_payload(self, value):
+        return self.compress(value)
+
+    def decode_payload(self, payload):
+        # the decompressed data may carry the header of the inner codec
+        return decode(self.decompress(payload))
+
+
+class ZlibCodec(_CompressingCodec):
+    tag = 'z'
+
+    def __init__(self, inner=None, min_size=512, level=6):
+        _CompressingCodec.__init__(self, inner, min_size)
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Codec(_CompressingCodec):
+    tag = '4'
+
+    def compress(self, data):
+        if lz4 is None:
+            raise CodecError('lz4 is not installed')
+        return lz4.compress(data)
+
+    def decompress(self, data):
+        if lz4 is None:
+            raise CodecError('lz4 is not installed')
+        return lz4.decompress(data)
+
+
+for _codec in (JsonCodec(), MsgpackCodec(), ZlibCodec(), Lz4Codec()):
+    register_codec(_codec)
+
+
+class CodecMap(object):
+    '''Selects the codec of a path by its longest registered prefix.'''
+
+    def __init__(self, default=None):
+        ''':param default: Codec of paths without registered prefix (None
+                           for plain strings)
+        '''
+        self.default = default
+        self._codecs = {}
+
+    def register(self, prefix, codec):
+        '''Sets the codec of all nodes below (and including) prefix.'''
+        self._codecs[prefix.rstrip('/') or '/'] = codec
+
+    def unregister(self, prefix):
+        self._codecs.pop(prefix.rstrip('/') or '/', None)
+
+    def codec(self, path):
+        '''Returns the codec of a path (or None).'''
+        prefix = path
+        while prefix:
+            codec = self._codecs.get(prefix)
+            if codec is not None:
+                return codec
+            prefix = prefix[:prefix.rfind('/')]
+        return self._codecs.get('/', self.default)
+
+    def encode(self, path, value):
+        '''Encodes value with the codec of path. Without codec value needs
+        to be a string.
+        '''
+        codec = self.codec(path)
+        if codec is None:
+            return value
+        return codec.encode(value)
+
+    def decode(self, data):
+        return decode(data)
@@ -5,9 +5,16 @@ Created on 19.08.2010
 @author: luk
 '''
 
-from functools import wraps
 from zkpy import zk_retry_operation
+from zkpy.codec import CodecMap
+from zkpy.exceptions import error_to_exception
+from zkpy.future import Future
+from zkpy.metrics import Metrics
+from zkpy.recovery import SessionRecovery
+from zkpy.transaction import Pipeline, Transaction
 from zkpy.utils import enum
+from zkpy.watches import WatchRegistry
+import collections
 import logging
 import threading
 import zookeeper
@@ -24,56 +31,80 @@ class Connection(object):
 
 
     logger = logger #logging.getLogger('zookeeper.connection')
-    __wrapped_functions = set([
-        # 'add_auth',#overwritten
-        'client_id',
-        'close',
-        'create',
-        'delete',
-        'set',
-        'set2',
-        'get_acl',
-        'set_acl',
-        'is_unrecoverable',
-        'recv_timeout', # property
-        'set_watcher',
-        'state',
-        #'deterministic_conn_order', # overwritten, does not need a handle
-        #### with watchers
-        'exists',
-        'get',
-        'get_children',
-        #init #forbidden -> handled in Connection construction
-            ])
-
-
-    def __init__(self, servers, timeout):
+
+    # operations, which are instrumented, if metrics are enabled
+    _measured_calls = ('create', 'delete', 'set', 'set2', 'get_acl', 'set_acl',
+                       'create_async', 'delete_async', 'set_async',
+                       'get_acl_async', 'set_acl_async')
+    _measured_watch_calls = ('exists', 'get', 'get_children', 'exists_async',
+                             'get_async', 'get_children_async')
+    metrics = None
+    retry_policy = None
+
+    def __init__(self, servers, timeout, recover_session=False, dispatcher=None,
+                 retry_policy=None, selector=None, backend=None):
         '''Creates a new Connection object.
 
         :param servers: either a python list or a comma (',')
                         sepparated list of  zookeper servers
         :param timeout: timeout in seconds after connection initialisation fails
+        :param recover_session: If set to 'True', a new session is created
+                                after the session expired and the watches and
+                                registered ephemeral nodes are restored (see
+                                zkpy.recovery)
+        :param dispatcher: Optional zkpy.dispatch.WatchDispatcher. If set,
+                           watchers (global and per node) are called by its
+                           worker threads instead of zookeeper's completion
+                           thread.
+        :param retry_policy: Optional zkpy.retry.RetryPolicy of the retried
+                             operations of this connection and its recipes.
+                             Defaults to zkpy.retry.default_policy.
+        :param selector: Optional zkpy.ensemble.ServerSelector. If set, the
+                         servers are probed on connect and tried in order of
+                         their responsiveness. The backend is switched to
+                         deterministic connection order (a process wide
+                         setting of the binding).
+        :param backend: Implementation of the zookeeper binding api to use
+                        instead of the zookeeper module (e.g. a
+                        zkpy.testing.FakeZooKeeper)
         '''
 
         # set up members
+        self._zk = backend if backend is not None else zookeeper
         if isinstance(servers, basestring):
             self._servers = [server.strip() for server in servers.split(',')]
         else:
             self._servers = servers
-        self._handle = None
+        self._session_handle = None
+        # a new session replaces the expired one (see _reconnect())
+        self._reconnecting = False
         self._timeout = timeout
-
-        # connect
-        self.connect(self._timeout)
+        # paths, which are known to exist (see ensure_path_exists)
+        self._known_paths = set()
+        self._recovery = SessionRecovery(self) if recover_session else None
+        self._dispatcher = dispatcher
+        self.retry_policy = retry_policy
+        self._selector = selector
+        if selector is not None:
+            # keeps the order of the selector (once, it is process wide)
+            self._zk.deterministic_conn_order(True)
+        # node data codecs per path prefix (see zkpy.codec)
+        self.codecs = CodecMap()
+        # callbacks sharing zookeeper watches (see zkpy.watches)
+        self.watches = WatchRegistry(self)
 
         # set up watch queue
         self._watchers = set()
 
+        # connect
+        self.connect(self._timeout)
+
 
     def __del__(self):
         '''Makes sure, that the connection is not left open'''
         logger.debug('ConnectionWatcher: __del__')
-        if self._handle and zookeeper.state(self._handle) == zookeeper.CONNECTED_STATE:
+        handle = getattr(self, '_session_handle', None)
+        if handle and self._zk.state(handle) == zookeeper.CONNECTED_STATE:
             self.logger.warn('Closing open zookeeper connection')
             self.close()
 
@@ -84,41 +115,159 @@ class Connection(object):
         self.logger.debug(
             'handle=%d type=%s state=%s path=%s' % (handle, type, state, path))
 
-        if self._handle != handle:
+        if self._session_handle != handle:
             raise RuntimeError('Inconsistend handles!')
 
+        self._deliver_global_event(type, state, path)
+
+        if state == KeeperState.Expired:
+            self.forget_known_paths()
+            if self._recovery is not None:
+                self._recovery.start()
+
+    def _watcher(self, watcher):
+        '''Returns the watcher to register for a node watch.'''
+        if self._dispatcher is not None:
+            return self._dispatcher.wrap(watcher)
+        return watcher
+
+    def _deliver_global_event(self, type, state, path):
+        '''Notifies the global watchers, via the dispatcher (if any), so that
+        events of the connection are delivered in order.
+        '''
+        if self._dispatcher is not None:
+            self._dispatcher.dispatch(path, self._notify_global_watchers, type, state, path)
+        else:
+            self._notify_global_watchers(type, state, path)
+
+    def _notify_global_watchers(self, type, state, path):
         # copy list: watchers might remove themselve during this call...
         for watcher in list(self._watchers):
             watcher(type, state, path)
 
-        #TODO: handle expiration
+    # wrapped zookeeper calls: provide the zookeeper methods with the handle
+    # e.g. zookeeper.state(handle) -> conn.state()
+
+    def client_id(self):
+        '''Returns the (session id, password) tuple of the session.'''
+        return self._zk.client_id(self._handle)
+
+    def state(self):
+        '''Returns the connection state (see KeeperState).'''
+        return self._zk.state(self._handle)
+
+    def is_unrecoverable(self):
+        '''Returns True, if the session is in an unrecoverable state (e.g.
+        expired) and the connection needs to be recreated.
+        '''
+        return self._zk.is_unrecoverable(self._handle)
+
+    def create(self, path, data, acl, flags=0):
+        '''Creates a node and returns its path (which differs from the
+        provided one for sequential nodes).
+
+        :param flags: The NodeCreationMode
+        '''
+        return self._zk.create(self._handle, path, data, acl, flags)
+
+    def delete(self, path, version=-1):
+        '''Deletes a node. Returns zookeeper.OK.
 
-    def __getattr__(self, call):
+        :param version: Expected version of the node (-1 for any version)
         '''
-        Wraps zookeeper calls and automagically provide the original zookeeper
-        methods with the its handle.
-        e.g. zookeeper.state(handle) -> conn.state()
+        self._known_paths.discard(path)
+        if self._recovery is not None:
+            self._recovery.unregister_ephemeral(path)
+        return self._zk.delete(self._handle, path, version)
+
+    def set(self, path, data, version=-1):
+        '''Sets the data of a node. Returns zookeeper.OK.
+
+        :param version: Expected version of the node (-1 for any version)
+        '''
+        return self._zk.set(self._handle, path, data, version)
+
+    def set2(self, path, data, version=-1):
+        '''Sets the data of a node and returns its new stat.'''
+        return self._zk.set2(self._handle, path, data, version)
 
+    def get_acl(self, path):
+        '''Returns a (stat, acl) tuple of a node.'''
+        return self._zk.get_acl(self._handle, path)
+
+    def set_acl(self, path, version, acl):
+        '''Sets the acl of a node. Returns zookeeper.OK.'''
+        return self._zk.set_acl(self._handle, path, version, acl)
+
+    def exists(self, path, watcher=None):
+        '''Returns the stat of a node or None, if it does not exist.
+
+        :param watcher: Called as watcher(handle, type, state, path) when the
+                        node is created, deleted or its data changes
         '''
-        if call not in self.__wrapped_functions:
-            logger.warn('unknown property/method %s' % call)
-#            raise AttributeError
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call('exists', path, watcher)
+        return self._zk.exists(self._handle, path, watcher)
 
-        # try to the the wrapped call from the zookeeper package
-        wrapped = getattr(zookeeper, call)
+    def get(self, path, watcher=None):
+        '''Returns a (data, stat) tuple of a node.
+
+        :param watcher: Called as watcher(handle, type, state, path) when the
+                        node is deleted or its data changes
+        '''
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call('get', path, watcher)
+        return self._zk.get(self._handle, path, watcher)
 
-        # if it is not a method/function
-        if not hasattr(wrapped, '__call__'):
-            raise AttributeError
+    def get_children(self, path, watcher=None):
+        '''Returns the names of the children of a node.
 
-        # create and return a wrapper function (http://gael-varoquaux.info/blog/?p=120)s
-        @wraps(wrapped)
-        def wrapper(*args, **kwargs):
-            #logger.debug('calling %s(%s, %s)' % (call, ', '.join(str(arg) for arg in args), ', '.join('%s=%s' % (k,v) for k,v in kwargs.items())))
-            return wrapped(self._handle, *args, **kwargs)
+        :param watcher: Called as watcher(handle, type, state, path) when the
+                        node is deleted or its children change
+        '''
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call('get_children', path, watcher)
+        return self._zk.get_children(self._handle, path, watcher)
+
+    def create_value(self, path, value, acl, flags=0):
+        '''Creates a node with value encoded by the codec of path (see
+        zkpy.codec). Returns the path of the new node.
+        '''
+        return self.create(path, self.codecs.encode(path, value), acl, flags)
 
-        return wrapper
+    def set_value(self, path, value, version=-1):
+        '''Sets the value of a node, encoded by the codec of path.
+        Returns zookeeper.OK.
+        '''
+        return self.set(path, self.codecs.encode(path, value), version)
 
+    def get_value(self, path, watcher=None):
+        '''Returns a (value, stat) tuple of a node. The data is decoded with
+        the codec of the writer.
+        '''
+        data, stat = self.get(path, watcher)
+        return self.codecs.decode(data), stat
+
+    @property
+    def recovers_session(self):
+        '''True, if the connection recovers from session expiration.'''
+        return self._recovery is not None
+
+    def register_ephemeral(self, path, data, acl):
+        '''Creates an ephemeral node, which is re-created after the session
+        expired (if the connection recovers sessions). Deleting the node
+        with delete() unregisters it. Returns the path of the node.
+        '''
+        path = self.create(path, data, acl, NodeCreationMode.Ephemeral)
+        if self._recovery is not None:
+            self._recovery.register_ephemeral(path, data, acl)
+        return path
 
     def set_watcher(self, watcher):
         '''Overwrite zookeeper.set_watcher method and forwards to
@@ -142,7 +291,7 @@ class Connection(object):
 
     def recv_timeout(self):
         '''Returns zookeeper's recv timout in seconds.'''
-        return zookeeper.recv_timeout(self._handle) / 1000.
+        return self._zk.recv_timeout(self._handle) / 1000.
 
     def add_auth(self, scheme, credentials):
         '''Specifies the connection credentials
@@ -169,7 +318,7 @@ class Connection(object):
 
         # call method
         logger.debug('Adding auth')
-        zookeeper.add_auth(self._handle, scheme, credentials, auth_watch)
+        self._zk.add_auth(self._handle, scheme, credentials, auth_watch)
 
         # wait for completion
         wait_time = self.recv_timeout()
@@ -182,6 +331,200 @@ class Connection(object):
         # return result
         return condition.isSet()
 
+    def _submit(self, call, *args, **options):
+        '''Submits an asynchronous zookeeper call. The completion callback
+        needs to be the last argument. Errors while submitting the request are
+        set on the returned future as well. The keyword options are passed to
+        _completion().
+        '''
+        future = Future()
+        try:
+            call(self._handle, *(args + (self._completion(future, args[0], **options),)))
+        except zookeeper.ZooKeeperException as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def _completion(future, path, swap_values=False, none_if_missing=False):
+        '''Creates the completion callback for an asynchronous call. The
+        callback translates the zookeeper return code into the result or the
+        exception of the future.
+
+        :param swap_values: Reverse a pair of result values (the completion of
+                            aget_acl gets (acl, stat), get_acl() returns
+                            (stat, acl))
+        :param none_if_missing: Result None instead of a NoNodeException (as
+                                exists() does for missing nodes)
+        '''
+        def completion(handle, return_code, *values):
+            if return_code == zookeeper.OK:
+                if not values:
+                    future.set_result(return_code)
+                elif len(values) == 1:
+                    future.set_result(values[0])
+                elif swap_values:
+                    future.set_result((values[1], values[0]))
+                else:
+                    future.set_result(values)
+            elif return_code == zookeeper.NONODE and none_if_missing:
+                future.set_result(None)
+            else:
+                future.set_exception(error_to_exception(return_code, path))
+        return completion
+
+    def create_async(self, path, data, acl, flags=0):
+        '''Asynchronous version of create().
+        Returns a Future with the path of the created node.
+        '''
+        return self._submit(self._zk.acreate, path, data, acl, flags)
+
+    def delete_async(self, path, version=-1):
+        '''Asynchronous version of delete().
+        Returns a Future with zookeeper.OK as result.
+        '''
+        self._known_paths.discard(path)
+        if self._recovery is not None:
+            self._recovery.unregister_ephemeral(path)
+        return self._submit(self._zk.adelete, path, version)
+
+    def set_async(self, path, data, version=-1):
+        '''Asynchronous version of set().
+        Returns a Future with the stat of the node after the update (as set2()).
+        '''
+        return self._submit(self._zk.aset, path, data, version)
+
+    def exists_async(self, path, watcher=None):
+        '''Asynchronous version of exists().
+        Returns a Future with the node's stat or None, if the node does not
+        exist.
+        '''
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call_async('exists', path, watcher)
+        return self._submit(self._zk.aexists, path, watcher, none_if_missing=True)
+
+    def get_async(self, path, watcher=None):
+        '''Asynchronous version of get().
+        Returns a Future with a (data, stat) tuple.
+        '''
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call_async('get', path, watcher)
+        return self._submit(self._zk.aget, path, watcher)
+
+    def get_children_async(self, path, watcher=None):
+        '''Asynchronous version of get_children().
+        Returns a Future with the list of child names.
+        '''
+        if watcher is not None:
+            watcher = self._watcher(watcher)
+            if self._recovery is not None:
+                return self._recovery.call_async('get_children', path, watcher)
+        return self._submit(self._zk.aget_children, path, watcher)
+
+    def get_acl_async(self, path):
+        '''Asynchronous version of get_acl().
+        Returns a Future with a (stat, acl) tuple.
+        '''
+        return self._submit(self._zk.aget_acl, path, swap_values=True)
+
+    def set_acl_async(self, path, version, acl):
+        '''Asynchronous version of set_acl().
+        Returns a Future with zookeeper.OK as result.
+        '''
+        return self._submit(self._zk.aset_acl, path, version, acl)
+
+    def transaction(self):
+        '''Returns a new Transaction (see zkpy.transaction), which applies
+        a batch of create/delete/set/check operations atomically.
+        Raises a NotImplementedError, if the backend does not support multi
+        requests (as the zookeeper python binding).
+        '''
+        return Transaction(self)
+
+    def pipeline(self):
+        '''Returns a new Pipeline (see zkpy.transaction), which sends a batch
+        of create/delete/set operations at once, without applying them
+        atomically.
+        '''
+        return Pipeline(self)
+
+    def enable_metrics(self, sink=None):
+        '''Starts collecting per operation counts, errors and latencies as
+        well as the number of outstanding requests and active watches (see
+        zkpy.metrics). Operations are only instrumented while metrics are
+        enabled.
+
+        :param sink: Optional object, whose operation_completed(name, latency,
+                     exception) method is called for every operation
+        '''
+        self.disable_metrics()
+        self.metrics = Metrics(sink)
+        for name in self._measured_calls:
+            setattr(self, name, self._measured(name, getattr(self, name)))
+        for name in self._measured_watch_calls:
+            setattr(self, name, self._measured_watch(name, getattr(self, name)))
+
+    def disable_metrics(self):
+        '''Stops collecting statistics and removes the instrumentation.'''
+        for name in self._measured_calls + self._measured_watch_calls:
+            self.__dict__.pop(name, None)
+        self.metrics = None
+
+    def stats(self):
+        '''Returns a snapshot of the statistics (see enable_metrics()) or
+        None, if metrics are disabled.
+        '''
+        if self.metrics is None:
+            return None
+        stats = self.metrics.to_dict()
+        if self._dispatcher is not None:
+            stats['dispatcher'] = self._dispatcher.stats()
+        return stats
+
+    def _measured(self, name, call):
+        '''Instruments a synchronous or asynchronous operation.'''
+        metrics = self.metrics
+        def measured(*args, **kwargs):
+            started = metrics.started(name)
+            try:
+                result = call(*args, **kwargs)
+            except Exception as e:
+                metrics.finished(name, started, e)
+                raise
+            if isinstance(result, Future):
+                result.add_done_callback(
+                    lambda future: metrics.finished(name, started, future.exception()))
+            else:
+                metrics.finished(name, started)
+            return result
+        return measured
+
+    def _measured_watch(self, name, call):
+        '''Instruments an operation, which may set a watch.'''
+        metrics = self.metrics
+        measured_call = self._measured(name, call)
+        def measured(path, watcher=None):
+            if watcher is None:
+                return measured_call(path)
+            watcher = metrics.watching(watcher)
+            try:
+                result = measured_call(path, watcher)
+            except Exception:
+                # no watch was set
+                watcher.cancel()
+                raise
+            if isinstance(result, Future):
+                def cancel_failed(future):
+                    # exists() sets the watch for missing nodes as well
+                    if future.exception() is not None:
+                        watcher.cancel()
+                result.add_done_callback(cancel_failed)
+            return result
+        return measured
+
 
     def is_connected(self):
         ''' Returns True, if the connection is in the Connection state.'''
@@ -205,7 +548,7 @@ class Connection(object):
             timeout = self._timeout
 
         # check, if we're already connected
-        if self._handle is not None and not self.is_connected():
+        if self._session_handle is not None and not self.is_connected():
             raise RuntimeError('Already connected')
             return
 
@@ -215,53 +558,88 @@ class Connection(object):
             condition.notify()
             condition.release()
 
+        servers = self._servers
+        if self._selector is not None:
+            servers = self._selector.order(servers)
+
         # try to connect
         condition.acquire()
-        self._handle = zookeeper.init(
-			','.join(self._servers),
+        handle = self._zk.init(
+			','.join(servers),
             connection_watch,
             self._timeout * 1000)
         condition.wait(self._timeout)
         condition.release()
 
-        if zookeeper.state(self._handle) != zookeeper.CONNECTED_STATE:
-            zookeeper.close(self._handle)
+        if self._zk.state(handle) != zookeeper.CONNECTED_STATE:
+            self._zk.close(handle)
             raise RuntimeError(
                 'unable to connect to %s ' % (' or '.join(self._servers)))
-        zookeeper.set_watcher(self._handle, self.__global_watch)
+        # only a connected handle is used for requests
+        self._session_handle = handle
+        self._reconnecting = False
+        self._zk.set_watcher(handle, self.__global_watch)
+
 
+    @property
+    def _handle(self):
+        '''The zookeeper handle of the session. While the session is replaced
+        after an expiration (see zkpy.recovery), requests fail with a
+        ConnectionLossException (and are retried by zk_retry_operation).
+        '''
+        handle = self._session_handle
+        if handle is None and self._reconnecting:
+            raise zookeeper.ConnectionLossException('Reconnecting with a new session')
+        return handle
+
+    def _reconnect(self):
+        '''Replaces the (expired) handle with a new session.'''
+        self._reconnecting = True
+        handle, self._session_handle = self._session_handle, None
+        if handle is not None:
+            try:
+                self._zk.close(handle)
+            except zookeeper.ZooKeeperException:
+                pass
+        self.connect()
 
     def close(self):
         '''Overwrites the zookeeper.close() method'''
 
 
-        if self._handle is None:
+        if self._session_handle is None:
             logger.error('Can not close an uninitialized connection.')
             return
 
         logger.debug('closing connection')
 
         try:
-            _state = zookeeper.state(self._handle)
+            _state = self._zk.state(self._handle)
         except zookeeper.ZooKeeperException:
             logger.warn('Connection is already closed')
             return True
 
         for _i in range(3):
             try:
-                return zookeeper.close(self._handle) == zookeeper.OK
+                return self._zk.close(self._handle) == zookeeper.OK
             except: #zookeeper.ConnectionLossException:
                 logger.info('Got exception while closing. Retrying...')
         logger.error('Failed closing the zookeeper connection')
         return False
 
     @zk_retry_operation
-    def ensure_path_exists(self, path, data, acl, recursive = False):
+    def ensure_path_exists(self, path, data, acl, recursive = False, optimistic = False):
         '''Checks, if a given path exists. If this is not the case, the path is
         created with the provided data and ACL, otherwise, the data and acl
         arguments are ignored.
         The operation will be retried in case of a ConnectionLossException
         Throws an exception, if this was not possible.
+        Paths, which are known to exist, are cached per connection (until
+        they are deleted by this connection or the session expires). A cached
+        path costs a single exists request (another session might have
+        deleted it), its cached ancestors are not checked. If another session
+        deleted a cached ancestor, the creation fails with a NoNodeException,
+        the ancestors are forgotten and the path is created again.
         :param conn: Connection object
         :param path: Path to check/create
         :param data: Eventual Znode data
@@ -269,25 +647,206 @@ class Connection(object):
         :param recursive: If set to 'True' the whole path is created.
                           NOTE: Each node on the path is created with the provided
                           ACL, but with empty data.
+        :param optimistic: If set to 'True' the node and all its ancestors,
+                           which are not known to exist, are created in a
+                           single pipelined batch (i.e. one round trip)
+                           without checking their existence first. Implies
+                           'recursive'.
 
         '''
+        if path in self._known_paths:
+            if self.exists(path):
+                return True
+            # deleted by another session
+            self._known_paths.discard(path)
+
+        if optimistic:
+            try:
+                return self._create_path(path, data, acl)
+            except zookeeper.NoNodeException:
+                if not self._forget_ancestors(path):
+                    raise
+                return self._create_path(path, data, acl)
 
         # check, if path exists
         stat = self.exists(path)
         if stat:
+            self._remember_path(path)
             return True
         else:
             # if recursie: ensure existance of parent node
             if recursive:
                 parent_path = path[:path.rfind('/')]
-                # if parent_path is not empty (the root): try to create it
-                if parent_path:
+                # if parent_path is not empty (the root) and not known to
+                # exist: try to create it
+                if parent_path and parent_path not in self._known_paths:
                     self.ensure_path_exists(parent_path, '', acl, recursive)
 
             # create this node
-            self.create(path, data, acl, NodeCreationMode.Persistent)
+            try:
+                self.create(path, data, acl, NodeCreationMode.Persistent)
+            except zookeeper.NodeExistsException:
+                pass
+            except zookeeper.NoNodeException:
+                if not recursive or not self._forget_ancestors(path):
+                    raise
+                return self.ensure_path_exists(path, data, acl, recursive)
+            self._remember_path(path)
             return True
 
+    def _create_path(self, path, data, acl):
+        '''Creates a node and its ancestors (unless they are known to exist)
+        with pipelined create requests. Already existing nodes are fine.
+        '''
+        missing = []
+        current = path
+        while current and current not in self._known_paths:
+            missing.append(current)
+            current = current[:current.rfind('/')]
+        missing.reverse()
+
+        # zookeeper processes the requests of a session in order, thus the
+        # parents are created before their children
+        futures = [self.create_async(node, data if node == path else '', acl)
+                   for node in missing]
+        for node, future in zip(missing, futures):
+            exception = future.exception()
+            if exception is not None and not isinstance(exception, zookeeper.NodeExistsException):
+                raise exception
+            self._remember_path(node)
+        return True
+
+    def _remember_path(self, path):
+        '''Adds a path to the known paths. Deletions by this connection and
+        the session expiration remove it again (no watch is set, deletions by
+        other sessions are noticed by ensure_path_exists).
+        '''
+        self._known_paths.add(path)
+
+    def _forget_ancestors(self, path):
+        '''Removes the ancestors of path from the known paths (another session
+        deleted one of them). Returns True, if any of them was known.
+        '''
+        known = False
+        current = path[:path.rfind('/')]
+        while current:
+            if current in self._known_paths:
+                self._known_paths.discard(current)
+                known = True
+            current = current[:current.rfind('/')]
+        return known
+
+    def walk(self, path, max_outstanding=100, with_data=True):
+        '''Yields a (path, data, stat) tuple for the node and all its
+        descendants (depth first, parents before their children). Up to
+        max_outstanding requests are pipelined (a data and a children request
+        per node, the requests of at least one node). Nodes, which are deleted
+        during the walk, are skipped.
+
+        The memory needed is bounded by the depth of the tree times the number
+        of children per node (the siblings of the nodes on the current path),
+        not by the width of a level or the size of the tree.
+
+        :param with_data: If set to 'False' data and stat are not fetched
+                          (and yielded as None).
+        '''
+        for node, value, stat, names in self._walk(path, max_outstanding, with_data):
+            if names is not None:
+                yield node, value, stat
+
+    def _walk(self, path, max_outstanding, with_data):
+        '''Implementation of walk(). Yields (path, data, stat, child names)
+        tuples; the child names of nodes, which were deleted during the walk,
+        are None.
+        '''
+        requests_per_node = 2 if with_data else 1
+        max_nodes = max(1, max_outstanding // requests_per_node)
+        # stack of the nodes to request: the children of the last node are
+        # walked first
+        pending = [path]
+        in_flight = collections.deque()
+        while pending or in_flight:
+            # keep the pipeline filled
+            while pending and len(in_flight) < max_nodes:
+                node = pending.pop()
+                data = self.get_async(node) if with_data else None
+                in_flight.append((node, data, self.get_children_async(node)))
+
+            node, data, children = in_flight.popleft()
+            try:
+                value, stat = data.result() if with_data else (None, None)
+                names = children.result()
+            except zookeeper.NoNodeException:
+                yield node, None, None, None
+                continue
+            prefix = node.rstrip('/')
+            pending.extend('%s/%s' % (prefix, name) for name in reversed(names))
+            yield node, value, stat, names
+
+    @zk_retry_operation
+    def delete_recursive(self, path, max_outstanding=100):
+        '''Deletes a node and all its descendants. Returns the number of
+        deleted nodes.
+
+        The subtree is listed depth first (see walk()) while it is deleted:
+        a node is deleted as soon as the deletes of all its children are
+        sent. As zookeeper processes the requests of a session in order, the
+        children are gone before their parent is deleted. Up to
+        max_outstanding requests are pipelined (half of them listings, at
+        least one listing and one delete); the memory needed is bounded like
+        the one of walk().
+        '''
+        max_listings = max(1, max_outstanding // 2)
+        max_deletes = max(1, max_outstanding - max_listings)
+
+        deleted = [0]
+        not_empty = []
+        in_flight = collections.deque()
+        def collect():
+            '''Waits for the oldest delete request.'''
+            node, future = in_flight.popleft()
+            exception = future.exception()
+            if exception is None:
+                deleted[0] += 1
+            elif isinstance(exception, zookeeper.NotEmptyException):
+                # children were added concurrently
+                not_empty.append(node)
+            elif not isinstance(exception, zookeeper.NoNodeException):
+                raise exception
+
+        def delete(node):
+            if len(in_flight) >= max_deletes:
+                collect()
+            in_flight.append((node, self.delete_async(node)))
+
+        # number of children of a listed node, whose deletes were not sent
+        remaining = {}
+        for node, _data, _stat, names in self._walk(path, max_listings, False):
+            if names:
+                remaining[node] = len(names)
+                continue
+            # a leaf (or a node deleted meanwhile): its subtree is done
+            if names is not None:
+                delete(node)
+            while node != path:
+                parent = node[:node.rfind('/')] or '/'
+                remaining[parent] -= 1
+                if remaining[parent]:
+                    break
+                del remaining[parent]
+                delete(parent)
+                node = parent
+        while in_flight:
+            collect()
+
+        for node in not_empty:
+            deleted[0] += self.delete_recursive(node, max_outstanding)
+        return deleted[0]
+
+    def forget_known_paths(self):
+        '''Clears the cache of paths, which are known to exist.'''
+        self._known_paths.clear()
+
 
 
 
@@ -298,18 +857,20 @@ class zkopen(object):
     with open('localhost:2181", 10) as conn:
         print conn.state()
     '''
-    def __init__(self, servers, timeout):
+    def __init__(self, servers, timeout, **kwargs):
         '''Creates the open object.
         :param servers: either a coma separated list of zookeeper servers,
                         or a list of servers.
         :param timeout: timeout for connecting to the server (seconds)
+        Further keyword arguments are passed to the Connection.
         '''
         self.servers = servers
         self.timeout = timeout
+        self.kwargs = kwargs
         self.connection = None
 
     def __enter__(self):
-        self.connection = Connection(self.servers, self.timeout)
+        self.connection = Connection(self.servers, self.timeout, **self.kwargs)
         return self.connection
 
     def __exit__(self, type, value, traceback):
@@ -0,0 +1,152 @@
+'''
+Off-thread delivery of watch events.
+
+By default the zookeeper client calls all watchers on its completion thread:
+a slow watcher delays every other event and completion of the session. With
+a WatchDispatcher, the connection only enqueues the events and a pool of
+worker threads calls the watchers:
+
+    conn = Connection('localhost:2181', 5, dispatcher=WatchDispatcher(workers=4))
+
+Events for the same path are always handled by the same worker, thus they
+are delivered in order. There is no ordering between different paths.
+'''
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Worker(object):
+    '''Event queue and thread of a single worker.'''
+
+    def __init__(self, dispatcher, name):
+        self._dispatcher = dispatcher
+        self._events = collections.deque()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, callback, args):
+        '''Enqueues an event. Returns False, if it was coalesced with an
+        equal pending event.
+        '''
+        key = (callback, args)
+        self._condition.acquire()
+        try:
+            if self._dispatcher.coalesce:
+                try:
+                    if key in self._pending:
+                        return False
+                    self._pending[key] = True
+                except TypeError:
+                    # unhashable callback
+                    key = None
+            else:
+                key = None
+            self._events.append((key, callback, args))
+            self._condition.notify()
+            return True
+        finally:
+            self._condition.release()
+
+    def stop(self):
+        self._condition.acquire()
+        self._stopped = True
+        self._condition.notify()
+        self._condition.release()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._events and not self._stopped:
+                    self._condition.wait()
+                if not self._events:
+                    return
+                key, callback, args = self._events.popleft()
+                if key is not None:
+                    del self._pending[key]
+            finally:
+                self._condition.release()
+
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Watcher %s failed' % callback)
+
+
+class WatchDispatcher(object):
+    '''Calls watchers on a pool of worker threads.'''
+
+    def __init__(self, workers=4, coalesce=False):
+        '''
+        :param workers: Number of worker threads
+        :param coalesce: If set to 'True', an event is dropped, if an equal
+                         event (same watcher and arguments) is still waiting
+                         for delivery.
+        '''
+        if workers < 1:
+            raise ValueError('At least one worker is needed')
+        self.coalesce = coalesce
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._workers = [_Worker(self, 'zkpy-watch-dispatcher-%d' % index)
+                         for index in range(workers)]
+
+    def dispatch(self, path, callback, *args):
+        '''Enqueues callback(*args) on the worker responsible for path.'''
+        worker = self._workers[hash(path) % len(self._workers)]
+        queued = worker.put(callback, args)
+        self._lock.acquire()
+        try:
+            if queued:
+                self.dispatched += 1
+            else:
+                self.coalesced += 1
+            depth = self.depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        finally:
+            self._lock.release()
+
+    def wrap(self, watcher):
+        '''Returns a zookeeper watcher, which dispatches the events to
+        watcher(handle, type, state, path).
+        '''
+        def dispatching_watcher(handle, type, state, path):
+            self.dispatch(path, watcher, handle, type, state, path)
+        return dispatching_watcher
+
+    def depth(self):
+        '''Returns the number of events waiting for delivery.'''
+        return sum(len(worker) for worker in self._workers)
+
+    def stats(self):
+        return {
+            'workers': len(self._workers),
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'dispatched': self.dispatched,
+            'coalesced': self.coalesced,
+        }
+
+    def stop(self, timeout=None):
+        '''Stops the workers after they delivered the pending events.'''
+        for worker in self._workers:
+            worker.stop()
+        for worker in self._workers:
+            worker.join(timeout)
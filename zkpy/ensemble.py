@@ -0,0 +1,178 @@
+'''
+Latency aware server selection.
+
+The zookeeper client tries the servers of its connect string one after the
+other (in random order), thus a slow or unavailable server costs up to the
+full connect timeout. A ServerSelector probes all servers in parallel with the
+'mntr' four letter word (falling back to 'ruok', if mntr is not allowed) and
+orders the connect string: responsive servers first, local ones before remote
+ones, then by latency and load:
+
+    selector = ServerSelector(local=['zk1.rack1:2181'])
+    conn = Connection('zk1.rack1:2181,zk2.rack2:2181,zk3.rack3:2181', 5,
+                      selector=selector)
+
+The connection probes on every connect (also when it recovers a session).
+Note: to keep the order, a connection with a selector switches its backend
+(the zookeeper module by default) to deterministic connection order when it
+is created. This is a process wide setting of the binding.
+'''
+
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 2181
+
+
+def split_server(server):
+    '''Returns (host, port) of a 'host[:port]' string.'''
+    host, _sep, port = server.strip().rpartition(':')
+    if not host or ']' in port:
+        # no port (or an IPv6 address without port)
+        return server.strip(), DEFAULT_PORT
+    return host, int(port)
+
+
+def four_letter_word(server, command, timeout=1.):
+    '''Sends a four letter word command to a server and returns the
+    response.
+    '''
+    sock = socket.create_connection(split_server(server), timeout)
+    try:
+        sock.sendall(command)
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+    finally:
+        sock.close()
+
+
+class ServerStatus(object):
+    '''Result of probing a server.'''
+
+    # seconds of latency an outstanding request of the server is valued at
+    load_weight = 0.001
+
+    def __init__(self, server, local=False):
+        self.server = server
+        self.local = local
+        self.ok = False
+        self.latency = None
+        self.mode = None
+        self.outstanding_requests = 0
+        self.connections = 0
+        self.error = None
+
+    @property
+    def cost(self):
+        '''Latency plus a penalty for the load of the server.'''
+        if self.latency is None:
+            return float('inf')
+        return self.latency + self.outstanding_requests * self.load_weight
+
+    def sort_key(self):
+        return (not self.ok, not self.local, self.cost)
+
+    def __repr__(self):
+        if not self.ok:
+            return '<ServerStatus %s: %s>' % (self.server, self.error)
+        return '<ServerStatus %s: %s %.1fms outstanding=%d>' % (
+            self.server, self.mode, self.latency * 1000, self.outstanding_requests)
+
+
+def probe(server, timeout=1., local=False):
+    '''Probes a server. Returns a ServerStatus.'''
+    status = ServerStatus(server, local)
+    started = time.time()
+    try:
+        response = four_letter_word(server, 'mntr', timeout)
+        if response.startswith('zk_'):
+            for line in response.splitlines():
+                key, _sep, value = line.partition('\t')
+                if key == 'zk_server_state':
+                    status.mode = value
+                elif key == 'zk_outstanding_requests':
+                    status.outstanding_requests = int(value)
+                elif key == 'zk_num_alive_connections':
+                    status.connections = int(value)
+            status.ok = True
+        else:
+            # mntr is not supported or not whitelisted
+            started = time.time()
+            status.ok = four_letter_word(server, 'ruok', timeout) == 'imok'
+            if not status.ok:
+                status.error = 'not ok'
+        status.latency = time.time() - started
+    except (socket.error, ValueError) as e:
+        status.error = e
+    return status
+
+
+def probe_servers(servers, timeout=1., local=None):
+    '''Probes the servers in parallel. Returns their ServerStatus objects,
+    ordered by preference.
+
+    :param timeout: Seconds to wait for each server
+    :param local: Optional collection of local servers (or hosts) or a
+                  function returning True for local servers
+    '''
+    if local is None:
+        is_local = lambda server: False
+    elif callable(local):
+        is_local = local
+    else:
+        local = set(local)
+        is_local = lambda server: server in local or split_server(server)[0] in local
+
+    statuses = [None] * len(servers)
+    def run(index, server):
+        statuses[index] = probe(server, timeout, is_local(server))
+
+    threads = []
+    for index, server in enumerate(servers):
+        thread = threading.Thread(target=run, args=(index, server),
+                                  name='zkpy-probe-%s' % server)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()) + 0.1)
+
+    for index, server in enumerate(servers):
+        if statuses[index] is None:
+            statuses[index] = ServerStatus(server, is_local(server))
+            statuses[index].error = 'timed out'
+    statuses.sort(key=ServerStatus.sort_key)
+    return statuses
+
+
+class ServerSelector(object):
+    '''Orders the servers of a connection by probing them (see module
+    documentation).
+    '''
+
+    def __init__(self, probe_timeout=1., local=None):
+        '''
+        :param probe_timeout: Seconds to wait for the probe responses
+        :param local: Local servers (see probe_servers())
+        '''
+        self.probe_timeout = probe_timeout
+        self.local = local
+        self.last_probe = []
+
+    def order(self, servers):
+        '''Returns the servers ordered by preference. Servers, which did not
+        respond, stay in the list (behind the responsive ones).
+        '''
+        self.last_probe = probe_servers(servers, self.probe_timeout, self.local)
+        logger.debug('Probed servers: %s' % self.last_probe)
+        return [status.server for status in self.last_probe]
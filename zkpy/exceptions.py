@@ -4,6 +4,67 @@ Created on 01.10.2010
 @author: lbossard
 '''
 
+import zookeeper
+
 
 class NoNodeException(Exception):
     pass
+
+class TimeoutException(RuntimeError):
+    '''Raised, if an operation did not complete within the given timeout.'''
+    pass
+
+class TransactionError(Exception):
+    '''Raised, if operations of a transaction (or pipeline) failed.
+    The results attribute holds the result or the exception of each operation
+    (in the order the operations were added).
+    '''
+    def __init__(self, results):
+        self.results = results
+        failed = [(index, result) for index, result in enumerate(results)
+                  if isinstance(result, Exception)]
+        Exception.__init__(self, '%d of %d operations failed, first: #%d %r' % (
+                len(failed), len(results), failed[0][0], failed[0][1]))
+
+
+# zookeeper return codes and the exceptions the synchronous api raises for them
+_error_names = (
+    ('SYSTEMERROR',             'SystemErrorException'),
+    ('RUNTIMEINCONSISTENCY',    'RuntimeInconsistencyException'),
+    ('DATAINCONSISTENCY',       'DataInconsistencyException'),
+    ('CONNECTIONLOSS',          'ConnectionLossException'),
+    ('MARSHALLINGERROR',        'MarshallingErrorException'),
+    ('UNIMPLEMENTED',           'UnimplementedException'),
+    ('OPERATIONTIMEOUT',        'OperationTimeoutException'),
+    ('BADARGUMENTS',            'BadArgumentsException'),
+    ('INVALIDSTATE',            'InvalidStateException'),
+    ('APIERROR',                'ApiErrorException'),
+    ('NONODE',                  'NoNodeException'),
+    ('NOAUTH',                  'NoAuthException'),
+    ('BADVERSION',              'BadVersionException'),
+    ('NOCHILDRENFOREPHEMERALS', 'NoChildrenForEphemeralsException'),
+    ('NODEEXISTS',              'NodeExistsException'),
+    ('NOTEMPTY',                'NotEmptyException'),
+    ('SESSIONEXPIRED',          'SessionExpiredException'),
+    ('INVALIDCALLBACK',         'InvalidCallbackException'),
+    ('INVALIDACL',              'InvalidACLException'),
+    ('AUTHFAILED',              'AuthFailedException'),
+    ('CLOSING',                 'ClosingException'),
+    ('NOTHING',                 'NothingException'),
+    ('SESSIONMOVED',            'SessionMovedException'))
+
+_error_classes = dict(
+    (getattr(zookeeper, code), getattr(zookeeper, name))
+    for code, name in _error_names
+    if hasattr(zookeeper, code) and hasattr(zookeeper, name))
+
+
+def error_to_exception(return_code, path=None):
+    '''Translates a zookeeper return code (as passed to the completion
+    callbacks of the asynchronous api) into the exception the synchronous
+    api would have raised.
+    '''
+    message = zookeeper.zerror(return_code)
+    if path is not None:
+        message = '%s: %s' % (message, path)
+    return _error_classes.get(return_code, zookeeper.ZooKeeperException)(message)
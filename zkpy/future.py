@@ -0,0 +1,159 @@
+'''
+Futures for asynchronous zookeeper operations.
+
+The completion callbacks of the asynchronous zookeeper api are executed on
+the zookeeper client's completion thread. A Future stores the outcome of
+such a callback, so that the caller can issue many requests at once and
+collect the results later:
+
+    futures = [conn.create_async('/foo/item-', '', acl, flags)
+               for _i in range(1000)]
+    paths = wait_all(futures)
+
+'''
+
+from zkpy.exceptions import TimeoutException
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Future(object):
+    '''Result of an asynchronous zookeeper operation.'''
+
+    __slots__ = ['_event', '_result', '_exception', '_callbacks', '_lock']
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        '''Returns True, if the operation completed (successfully or not).'''
+        return self._event.isSet()
+
+    def set_result(self, result):
+        '''Completes the future with the given result.'''
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        '''Completes the future with the given exception.'''
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        self._lock.acquire()
+        try:
+            if self._event.isSet():
+                raise RuntimeError('Future is already completed')
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, None
+        finally:
+            self._lock.release()
+
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logger.exception('Future callback %s failed' % callback)
+
+    def add_done_callback(self, callback):
+        '''Calls callback(future) as soon as the future is done.
+        If the future is already done, the callback is called immediately.
+
+        Note: callbacks are usually executed on zookeeper's completion thread
+        and should therefore return quickly.
+        '''
+        self._lock.acquire()
+        try:
+            if not self._event.isSet():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        self._run_callback(callback)
+
+    def wait(self, timeout=None):
+        '''Waits until the future is done. Returns True if it is.'''
+        self._event.wait(timeout)
+        return self._event.isSet()
+
+    def exception(self, timeout=None):
+        '''Returns the exception of the operation (or None, if it succeeded).
+        Raises a TimeoutException, if the operation did not complete within
+        timeout seconds.
+        '''
+        if not self.wait(timeout):
+            raise TimeoutException('Operation did not complete within %.2f seconds' % timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        '''Returns the result of the operation or raises its exception.
+        Raises a TimeoutException, if the operation did not complete within
+        timeout seconds.
+        '''
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(0, deadline - time.time())
+
+
+def wait_all(futures, timeout=None):
+    '''Waits for all futures and returns their results as a list (in the
+    order of the futures).
+    Raises the first exception of a failed operation or a TimeoutException,
+    if not all operations completed within timeout seconds.
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    return [future.result(_remaining(deadline)) for future in futures]
+
+
+def as_completed(futures, timeout=None):
+    '''Yields the futures in the order they complete.
+    Raises a TimeoutException, if not all operations completed within timeout
+    seconds.
+    '''
+    futures = list(futures)
+    condition = threading.Condition()
+    completed = collections.deque()
+
+    def on_done(future):
+        condition.acquire()
+        try:
+            completed.append(future)
+            condition.notify()
+        finally:
+            condition.release()
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+    deadline = None if timeout is None else time.time() + timeout
+    for _i in range(len(futures)):
+        condition.acquire()
+        try:
+            while not completed:
+                remaining = _remaining(deadline)
+                if remaining == 0:
+                    raise TimeoutException('%d operations did not complete within %.2f seconds' % (
+                            len(futures) - _i, timeout))
+                condition.wait(remaining)
+            future = completed.popleft()
+        finally:
+            condition.release()
+        yield future
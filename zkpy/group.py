@@ -2,6 +2,7 @@ from socket import gethostname
 from zkpy import zk_retry_operation
 from zkpy.connection import EventType, NodeCreationMode, KeeperState
 from zkpy.utils import enum
+from zkpy.watches import WatchKind
 import logging
 import zookeeper
 
@@ -34,8 +35,8 @@ class Group(object):
         if observer:
             self.register_observer(observer)
 
-        # register observer
-        self.zk_conn.get_children(path, self._pool_watcher)
+        # register observer (the connection re-arms the watch)
+        self.zk_conn.watches.add(path, WatchKind.Children, self._pool_watcher)
 
         _stat, self.node_acl = self.zk_conn.get_acl(path)
 
@@ -56,10 +57,6 @@ class Group(object):
             self.logger.info('watcher cb called handle=%d type=%s state=%s path=%s' % (handle, EventType[event], state, path))
             return
 
-        # re add watcher
-        self.zk_conn.get_children(self.path, self._pool_watcher)
-        #self.logger.debug('watcher cb re-added: %s' % self.path)
-
         if event == EventType.NotWatchingAnymore:
             raise RuntimeError('lost watcher')
         elif event == EventType.NodeCreated:
@@ -7,22 +7,54 @@ Created on 20.08.2010
 from zkpy import zk_retry_operation
 from zkpy.connection import KeeperState, NodeCreationMode, EventType
 import logging
-import operator
+import threading
+import time
+import weakref
 import zookeeper
 from zkpy.exceptions import NoNodeException
+from zkpy.watches import WatchKind
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# data of the lock node of the owner (tells the waiting neighbor, that it is next)
+OWNER_MARK = 'owner'
+
 
 class Lock(object):
     '''Distributed lock.
-    Implements a distributed lock per connection (i.e. creating a lock object
-    on the same connection object creates/retrieves the same Zookeeper lock
-    node.
+    Every lock object requests the lock with a node of its own (named
+    lock-<guid>-<sequence number>), thus lock objects on the same connection
+    exclude each other as well.
+
+    The lock object remembers its node and its smaller neighbor. The children
+    of the lock path are listed once per request and again only, if a
+    neighbor, which was not the lock owner, is deleted (e.g. a waiter gave
+    up). An owner, which had to wait, marks its node (OWNER_MARK), which
+    wakes its neighbor; when the marked node is deleted, the neighbor takes
+    over the lock without listing the children. An owner, which did not
+    wait, does not mark its node: every later node listed the children
+    with us as the smallest node, thus it knows the owner already.
+
+    Blocking use:
+
+        if lock.acquire(blocking=True, timeout=10):
+            ...
+
+        with lock:
+            ...
 
     '''
 
+    # name prefix of the lock nodes
+    _node_prefix = 'lock'
+    # whether the owner marks its node. The mark must mean, that there is
+    # no smaller node anymore.
+    _marks_owner = True
+    # our node; set on the class, as __del__ runs for objects, whose
+    # construction failed (e.g. a subclass validating its arguments) as well
+    _id = None
+
     def __init__(self, connection, path, watcher=None, name=None):
         '''Lock construction.
         :param connection:  The zkpy connection
@@ -37,11 +69,26 @@ class Lock(object):
         self._connection = connection
         self._path = path
         self.watcher = watcher
+        # passes the global connection events to the locks of the connection
+        self._events = _LockEvents.of(connection)
 
         self._id = None
         self._last_owner = None
         self._watched_neighbor = None
         self.name = name if name is not None else str(uuid.uuid4())
+        # identifies our node after a connection loss during its creation
+        self._guid = uuid.uuid4().hex
+        self._create_pending = False
+        # whether our node had a smaller neighbor (see OWNER_MARK)
+        self._waited = False
+        # smaller neighbor of the last children listing (None: no smaller
+        # neighbor) and whether it is still valid
+        self._smaller_neighbor = None
+        self._listed = False
+        # serializes _lock() calls of the watchers and the caller. Notified,
+        # when the lock is acquired or lost (blocking acquire)
+        self._condition = threading.Condition(threading.RLock())
+        self._lost = False
 
         try:
             _stat, self._acls = self._connection.get_acl(path)
@@ -62,7 +109,11 @@ class Lock(object):
         return self._id
 
     def _id_to_node_prefix(self, id):
-        return 'lock-%s-' % str(id)
+        return '%s-%s-' % (self._node_prefix, str(id))
+
+    def _blocked_by(self, node):
+        '''Returns True, if a smaller node prevents us from holding the lock.'''
+        return True
 
     def _connection_watcher(self, type, state, path):
         '''Receives global connection events.'''
@@ -74,7 +125,14 @@ class Lock(object):
                 logger.warning(self.name + ': Connection expired on NONE lock! (path=%s, last_owner=%s)' % (self._path, self._last_owner))
 
             self._id = None
-            self._connection.remove_global_watcher(self._connection_watcher)
+            self._last_owner = None
+            self._listed = False
+            self._unwatch_neighbor()
+            if not self._connection.recovers_session:
+                self._events.remove(self)
+                self._notify_waiters(lost=True)
+            # otherwise the lock is requested again, as soon as the
+            # connection recovered the session (Connected event)
             if self.watcher:
                 self.watcher.lock_released()
         elif state == KeeperState.Connecting:
@@ -84,125 +142,293 @@ class Lock(object):
                 logger.warning(self.name + ': Connection expired on NONE lock! (path=%s, last_owner=%s)' % (self._path, self._last_owner))
         elif state == KeeperState.Connected:
             logger.debug(self.name + ': Watcher: Lock \'%s\' connected. locking...' % self._id)
-            self._lock()
+            self._revalidate()
         else:
             logger.debug(self.name + ': Watcher: Lock \'%s\' caught connection event \'%s\'' % (self._id, KeeperState[state]))
 
-    def _get_or_create_lock_node(self, prefix):
-        '''Gets or creates the node with the given node name prefix.
-        Returns the full node name (without the path)
+    def _create_lock_node(self):
+        '''Creates our lock node. Returns the node name (without the path).
+        If a former create was interrupted (connection loss), the node might
+        exist already: it is searched by our guid.
         '''
-        # get all children
-        children = self._connection.get_children(self._path)
-
-        # search it, in the children list
-        for child in children:
-            if child.startswith(prefix):
-                logger.debug(self.name + ': Found already existing node %s' % child)
-                return child
-
-        # if not found: create the node
+        prefix = self._id_to_node_prefix(self._guid)
+        if self._create_pending:
+            for child in self._connection.get_children(self._path):
+                if child.startswith(prefix):
+                    logger.debug(self.name + ': Found already existing node %s' % child)
+                    self._create_pending = False
+                    return child
+
+        self._create_pending = True
         node = self._connection.create('%s/%s' % (self._path, prefix),
                                 '',
                                 self._acls,
                                 NodeCreationMode.EphemeralSequential)
+        self._create_pending = False
         # strip the path
         node_id = node[len(self._path) + 1:]
         logger.debug(self.name + ': Created node %s' % node)
         return node_id
 
+    def _list_neighbors(self):
+        '''Lists the children and evaluates them. Returns False, if our node
+        does not exist.
+        '''
+        return self._evaluate(self._connection.get_children(self._path))
+
+    def _evaluate(self, children):
+        '''Stores the lock owner and our smaller neighbor of a children
+        listing. Returns False, if our node does not exist.
+        '''
+        # nodeformat: <path>/<node prefix>-<guid>-<sequence number>
+        sequences = []
+        own_sequence = None
+        for child in children:
+            sequence = int(child[child.rfind('-') + 1:])
+            sequences.append((sequence, child))
+            if child == self._id:
+                own_sequence = sequence
+        if own_sequence is None:
+            return False
+
+        # single pass for the smallest node and the next smaller neighbor,
+        # which blocks us (no sort)
+        owner = smaller_neighbor = None
+        for sequence, child in sequences:
+            if owner is None or sequence < owner[0]:
+                owner = (sequence, child)
+            if (sequence < own_sequence and (smaller_neighbor is None or sequence > smaller_neighbor[0])
+                    and self._blocked_by(child)):
+                smaller_neighbor = (sequence, child)
+
+        self._last_owner = owner[1]
+        self._smaller_neighbor = smaller_neighbor[1] if smaller_neighbor else None
+        self._listed = True
+        return True
+
+    def _unwatch_neighbor(self):
+        '''Removes the watch callback of the watched neighbor (if any).'''
+        if self._watched_neighbor is not None:
+            self._connection.watches.remove(
+                            '%s/%s' % (self._path, self._watched_neighbor),
+                            WatchKind.Exists,
+                            self.__smaller_neighbor_watcher)
+            self._watched_neighbor = None
+
+    def _revalidate(self, children=None):
+        '''Re-evaluates the lock after a reconnect (neighbors may have left,
+        while we were disconnected).
+
+        :param children: Current children of the lock path (listed, if None)
+        '''
+        self._condition.acquire()
+        try:
+            self._listed = False
+            former_lock_owner = self._last_owner
+            if self._id and children is not None:
+                if not self._evaluate(children):
+                    logger.warn(self.name + ': Lock node \'%s\' is gone. Recreating...' % self._id)
+                    self._id = None
+                elif former_lock_owner == self._id and self._smaller_neighbor is None:
+                    # still held: the owner of the listing is the smallest
+                    # node, which is another holder of a shared (read) lock
+                    self._last_owner = former_lock_owner
+            self._lock()
+        finally:
+            self._condition.release()
+
+    def _neighbor_left(self):
+        '''Updates the neighbor bookkeeping after our smaller neighbor was
+        deleted.
+        '''
+        if self._smaller_neighbor == self._last_owner:
+            # the owner left and no node can be created before ours (the
+            # sequence numbers increase): we own the lock
+            self._smaller_neighbor = None
+        else:
+            # a waiter left: search the next smaller neighbor
+            self._listed = False
+
     def __smaller_neighbor_watcher(self, handle, type, state, path):
-        if self._id:
-            if path[len(self._path) + 1:] == self._watched_neighbor:
-                logger.debug(self.name + ': Watcher fired on path: %s state: %s type: %s. Trying to acquire the lock' % (
-                        path,
-                        EventType[type],
-                        KeeperState[state]))
-                self._lock()
+        if type == EventType.NoneType:
+            # session events are handled by the connection watcher
+            return
+        # the caller might release the lock meanwhile
+        self._condition.acquire()
+        try:
+            if self._id:
+                if path[len(self._path) + 1:] == self._watched_neighbor:
+                    logger.debug(self.name + ': Watcher fired on path: %s state: %s type: %s. Trying to acquire the lock' % (
+                            path,
+                            EventType[type],
+                            KeeperState[state]))
+                    # the watch fired once, thus it is not armed anymore
+                    self._watched_neighbor = None
+                    if type == EventType.NodeDataChanged:
+                        # marked by the owner (see OWNER_MARK)
+                        self._last_owner = self._smaller_neighbor
+                    elif type == EventType.NodeDeleted:
+                        self._neighbor_left()
+                    self._lock()
+                else:
+                    logger.warning(self.name + ': Watcher fired on path: %s state: %s type: %s. Did not match watched path %s' % (
+                            path,
+                            EventType[type],
+                            KeeperState[state],
+                            self._watched_neighbor))
             else:
-                logger.warning(self.name + ': Watcher fired on path: %s state: %s type: %s. Did not match watched path %s' % (
+                logger.warning(self.name + ': Watcher fired on path: %s state: %s type: %s. But _id is already None (released already?).' % (
                         path,
                         EventType[type],
-                        KeeperState[state],
-                        self._watched_neighbor))
-        else:
-            logger.warning(self.name + ': Watcher fired on path: %s state: %s type: %s. But _id is already None (released already?).' % (
-                    path,
-                    EventType[type],
-                    KeeperState[state]))
-
-    def acquire(self):
+                        KeeperState[state]))
+        finally:
+            self._condition.release()
+
+    def acquire(self, blocking=False, timeout=None):
+        '''Requests the lock. Returns True, if the lock is held.
+
+        :param blocking: If set to 'True' the call waits until the lock is
+                         acquired. The waiting thread is woken by the watch on
+                         the preceding lock node. Otherwise the call returns
+                         False and the lock is acquired in the background
+                         (see the lock_acquired() method of the watcher).
+        :param timeout: Maximal seconds to wait (blocking only). If the lock
+                        could not be acquired in time, the request is
+                        withdrawn and False is returned.
+        '''
         # check, if we need to lock ourself?
         if self.is_owner():
             return True
+        self._lost = False
         # register observer
-        self._connection.add_global_watcher(self._connection_watcher)
+        self._events.add(self)
         try:
-            return self._lock()
+            acquired = self._lock()
         except:
             # something went wrong, thus we remove the observer
-            self._connection.remove_global_watcher(self._connection_watcher)
+            self._events.remove(self)
             raise
+        if acquired or not blocking:
+            return acquired
+        return self._wait(timeout)
+
+    def _wait(self, timeout):
+        '''Waits until the lock is acquired. Withdraws the lock request after
+        timeout seconds.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        self._condition.acquire()
+        try:
+            while not self.is_owner():
+                if self._lost:
+                    raise zookeeper.SessionExpiredException(
+                        'Session expired while waiting for lock %s' % self._path)
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            else:
+                return True
+
+            # timed out: leave the queue of the lock
+            logger.debug(self.name + ': Could not acquire lock %s within %ss' % (self._path, timeout))
+            self._withdraw()
+            return False
+        finally:
+            self._condition.release()
+
+    def _notify_waiters(self, lost=False):
+        self._condition.acquire()
+        try:
+            if lost:
+                self._lost = True
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def _withdraw(self):
+        '''Removes the lock node of a request, which was not granted (the
+        watcher is not notified).
+        '''
+        self._events.remove(self)
+        node_id, self._id = self._id, None
+        self._listed = False
+        self._unwatch_neighbor()
+        if node_id is None:
+            return
+        try:
+            zk_retry_operation(self._connection.delete)('%s/%s' % (self._path, node_id))
+        except zookeeper.NoNodeException:
+            pass
+
+    def __enter__(self):
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
 
     @zk_retry_operation
     def _lock(self):
         '''Implementation of the node locking.'''
+        self._condition.acquire()
+        try:
+            return self._lock_unsafe()
+        finally:
+            self._condition.release()
+
+    def _lock_unsafe(self):
         max_retry_count = 10
 
         former_lock_owner = self._last_owner
 
         # while the lock was not acquired or we could not set a watcher
         for _retry_count in range(max_retry_count):
-            # create our node if needed or recover from old session
+            # create our node if needed
             if not self._id:
-                session_id, _data = self._connection.client_id()
-                node_name_prefix = self._id_to_node_prefix(session_id)
                 try:
-                    self._id = self._get_or_create_lock_node(node_name_prefix)
+                    self._id = self._create_lock_node()
                 except zookeeper.NoNodeException:
                     #TODO: move to connection wrapper
                     raise NoNodeException()
+                self._listed = False
+                self._waited = False
 
-            # get children and store them as a list of (seq_id, name)
-            children = [(int(child[child.rfind('-') + 1:]), child)
-                          for child in self._connection.get_children(self._path)]
-            if not children:
-                # this case should not happen, as we just added ourself
-                logger.warn(self.name + ': No children in %s but there should be!' % self._path)
-                self._id = None
-                continue
-
-            # sort them by the sequence id. nodeformat: <path>/lock-<session-id>-<sequence number>
-            children.sort(key=operator.itemgetter(0), reverse=False)
-            self._last_owner = children[0][1]
-
-            # search next smaller neighbor
-            me_not_found = True
-            smaller_neighbor = None
-            for _seq_id, name in children:
-                # found our position -> stop
-                if name == self._id:
-                    me_not_found = False
-                    break
-                smaller_neighbor = name
-            if me_not_found:
+            if not self._listed and not self._list_neighbors():
                 logger.warn(self.name + ': Could not find own lock node \'%s\'. Recreating...' % self._id)
                 self._id = None
                 continue
 
+            smaller_neighbor = self._smaller_neighbor
             # if there is a smaller neighbor: we watch him
             if smaller_neighbor:
+                self._waited = True
                 # only set a watch, if the smaller id has changed
                 if smaller_neighbor != self._watched_neighbor:
                     logger.debug(self.name + ': watching less than me node: %s' % smaller_neighbor)
-                    stat = self._connection.exists(
+                    self._unwatch_neighbor()
+                    # the watch is shared with other watchers of the node
+                    stat = self._connection.watches.add(
                                         '%s/%s' % (self._path, smaller_neighbor),
-                                         self.__smaller_neighbor_watcher)
+                                        WatchKind.Exists,
+                                        self.__smaller_neighbor_watcher,
+                                        once=True)
 
                     # we could not get the stat: smaller neighbor does not exist
                     # anymore
+                    if stat and stat['version'] > 0:
+                        # marked by the owner: we are next
+                        self._last_owner = smaller_neighbor
                     if not stat:
                         logger.debug(self.name + ': can not watch lesser node %s. Retrying...' % smaller_neighbor)
+                        self._connection.watches.remove(
+                                        '%s/%s' % (self._path, smaller_neighbor),
+                                        WatchKind.Exists,
+                                        self.__smaller_neighbor_watcher)
+                        self._neighbor_left()
                         continue
 
                     self._watched_neighbor = smaller_neighbor
@@ -211,16 +437,29 @@ class Lock(object):
                 return False
 
             # there is no smaller neighbor
-            else:
-                if self.is_owner():
-                    if self.watcher and former_lock_owner != self._id:
-                        self.watcher.lock_acquired()
-                    return True
-                logger.debug(self.name + ': we should be owner, but we arent!')
-                continue
+            if self._take_ownership(former_lock_owner):
+                return True
+            logger.debug(self.name + ': we should be owner, but we arent!')
+            self._listed = False
 
         raise RuntimeError('Could neither acquire the lock, nor set a watch')
 
+    def _take_ownership(self, former_lock_owner):
+        '''Records us as the owner and notifies the waiting threads and the
+        watcher. Returns False, if the connection was lost meanwhile.
+        '''
+        self._last_owner = self._id
+        if not self.is_owner():
+            return False
+        self._notify_waiters()
+        if former_lock_owner != self._id:
+            if self._marks_owner and self._waited:
+                # wakes our neighbor (asynchronously, failures do not matter)
+                self._connection.set_async('%s/%s' % (self._path, self._id), OWNER_MARK)
+            if self.watcher:
+                self.watcher.lock_acquired()
+        return True
+
     def is_owner(self):
         '''Returns true, if this instance holds the lock'''
         return (self._connection.is_somehow_connected()
@@ -244,11 +483,17 @@ class Lock(object):
             return
 
         # remove watcher
-        self._connection.remove_global_watcher(self._connection_watcher)
+        self._events.remove(self)
 
         # set us to released
-        node_id = self._id
-        self._id = None
+        self._condition.acquire()
+        try:
+            node_id = self._id
+            self._id = None
+            self._listed = False
+            self._unwatch_neighbor()
+        finally:
+            self._condition.release()
 
         # we don't need to retry this operation in the case of failure
         # as ZK will remove ephemeral files and we don't want to hang
@@ -264,6 +509,237 @@ class Lock(object):
                 self.watcher.lock_released()
 
 
+class WriteLock(Lock):
+    '''Exclusive part of a ReadWriteLock. Waits for all smaller nodes.'''
+
+    _node_prefix = 'write'
+
+
+class ReadLock(Lock):
+    '''Shared part of a ReadWriteLock. Waits only for the nearest smaller
+    write node (readers hold the lock together). A reader does not mark its
+    node, as holding a read lock does not mean, that it is the smallest node.
+    '''
+
+    _node_prefix = 'read'
+    _marks_owner = False
+
+    def _blocked_by(self, node):
+        return not node.startswith(self._node_prefix + '-')
+
+
+class ReadWriteLock(object):
+    '''Distributed shared/exclusive lock. Readers hold the lock together,
+    a writer exclusively. Requests are served in order, thus a waiting writer
+    is not starved by new readers.
+
+        rw_lock = ReadWriteLock(connection, '/locks/resource')
+        with rw_lock.read_lock:
+            ...
+        with rw_lock.write_lock:
+            ...
+
+    Both locks behave like Lock (acquire(), blocking acquire with timeout,
+    release() and the lock watcher).
+    '''
+
+    def __init__(self, connection, path, read_watcher=None, write_watcher=None, name=None):
+        '''
+        :param connection:  The zkpy connection
+        :param path: Parent node under which the lock nodes are created.
+                     Needs to exist.
+        :param read_watcher: Lock watcher object of the read lock
+        :param write_watcher: Lock watcher object of the write lock
+        '''
+        name = name if name is not None else str(uuid.uuid4())
+        self.read_lock = ReadLock(connection, path, read_watcher, name + '-read')
+        self.write_lock = WriteLock(connection, path, write_watcher, name + '-write')
+
+    @property
+    def path(self):
+        return self.read_lock.path
+
+
+class _LockEvents(object):
+    '''Passes the global connection events to the requested locks of a
+    connection with a single global watcher. After a reconnect the locks are
+    re-validated grouped by their path: the children of each path are listed
+    once for all its locks.
+    '''
+
+    # connection -> _LockEvents (does not keep the connection alive)
+    _instances = weakref.WeakKeyDictionary()
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def of(cls, connection):
+        '''Returns the lock events of a connection.'''
+        cls._instances_lock.acquire()
+        try:
+            events = cls._instances.get(connection)
+            if events is None:
+                events = cls._instances[connection] = cls()
+            return events
+        finally:
+            cls._instances_lock.release()
+
+    def __init__(self):
+        self._locks = set()
+        self._mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self._locks)
+
+    def add(self, lock):
+        '''Registers a lock for the connection events.'''
+        self._mutex.acquire()
+        try:
+            if not self._locks:
+                lock._connection.add_global_watcher(self._connection_watcher)
+            self._locks.add(lock)
+        finally:
+            self._mutex.release()
+
+    def remove(self, lock):
+        '''Unregisters a lock. Does nothing, if it is not registered.'''
+        self._mutex.acquire()
+        try:
+            if lock not in self._locks:
+                return
+            self._locks.remove(lock)
+            if not self._locks:
+                lock._connection.remove_global_watcher(self._connection_watcher)
+        finally:
+            self._mutex.release()
+
+    def _connection_watcher(self, type, state, path):
+        self._mutex.acquire()
+        locks = list(self._locks)
+        self._mutex.release()
+
+        if state == KeeperState.Connected:
+            self._revalidate(locks)
+            return
+        for lock in locks:
+            try:
+                lock._connection_watcher(type, state, path)
+            except Exception:
+                logger.exception('%s: Handling connection event failed' % lock.name)
+
+    def _revalidate(self, locks):
+        '''Re-validates the locks with one children listing per lock path.'''
+        by_path = {}
+        for lock in locks:
+            by_path.setdefault(lock.path, []).append(lock)
+        logger.debug('Re-validating %d locks of %d paths' % (len(locks), len(by_path)))
+
+        for path, path_locks in by_path.items():
+            try:
+                children = path_locks[0]._connection.get_children(path)
+            except zookeeper.ZooKeeperException as e:
+                # the locks list on their own
+                logger.warn('Could not list the locks of %s: %s' % (path, e))
+                children = None
+            for lock in path_locks:
+                try:
+                    lock._revalidate(children)
+                except Exception:
+                    logger.exception('%s: Re-validation of lock %s failed' % (lock.name, path))
+
+
+class LockManager(object):
+    '''Holds many independent locks (on distinct paths) over one
+    connection.
+
+        manager = LockManager(connection)
+        if manager.acquire('/locks/resource-17', blocking=True, timeout=5):
+            try:
+                ...
+            finally:
+                manager.release('/locks/resource-17')
+
+    The locks of a connection share a single global watcher (see
+    _LockEvents) and the neighbor watches of the connection's watch registry
+    (one zookeeper watch per watched node). Locks are dropped from the
+    manager, when they are released, thus the manager only keeps the held
+    and requested locks.
+    '''
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __contains__(self, path):
+        return path in self._locks
+
+    def lock(self, path, watcher=None, name=None):
+        '''Returns the lock of a path (created on first use).
+
+        :param watcher: Lock watcher object of a new lock
+        '''
+        self._mutex.acquire()
+        try:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = Lock(self._connection, path, watcher, name)
+                self._locks[path] = lock
+            return lock
+        finally:
+            self._mutex.release()
+
+    def acquire(self, path, blocking=False, timeout=None, watcher=None):
+        '''Requests the lock of a path. See Lock.acquire().'''
+        lock = self.lock(path, watcher)
+        try:
+            acquired = lock.acquire(blocking, timeout)
+        except:
+            self._discard(path, lock)
+            raise
+        if not acquired and not lock.waiting_to_be_owner():
+            # timed out (request withdrawn)
+            self._discard(path, lock)
+        return acquired
+
+    def is_owner(self, path):
+        '''Returns True, if the lock of path is held.'''
+        lock = self._locks.get(path)
+        return bool(lock is not None and lock.is_owner())
+
+    def owned(self):
+        '''Returns the paths of the held locks.'''
+        return [path for path, lock in self._locks.items() if lock.is_owner()]
+
+    def release(self, path):
+        '''Releases (or withdraws the request of) the lock of a path.'''
+        lock = self._locks.get(path)
+        if lock is None:
+            logger.warn('Can not release the not requested lock %s' % path)
+            return
+        try:
+            lock.release()
+        finally:
+            self._discard(path, lock)
+
+    def release_all(self):
+        '''Releases all locks.'''
+        for path in list(self._locks):
+            self.release(path)
+
+    def _discard(self, path, lock):
+        self._mutex.acquire()
+        try:
+            if self._locks.get(path) is lock:
+                del self._locks[path]
+        finally:
+            self._mutex.release()
+        # a lock stays registered, if it was released without connection
+        lock._events.remove(lock)
+
+
 def main():
     pass
 
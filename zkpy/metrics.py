@@ -0,0 +1,180 @@
+'''
+Per operation statistics of a connection.
+
+Metrics are opt-in:
+
+    conn.enable_metrics()
+    ...
+    print conn.stats()['operations']['get_children']['latency']['p99']
+
+Optionally a sink object receives every single measurement. It needs to
+implement operation_completed(name, latency, exception); latency is given in
+seconds, exception is None for successful operations.
+
+Retries of zk_retry_operation are counted per retried operation (see
+zkpy.retry): 'retries' is the number of retries, 'exhausted' the number of
+operations, which failed after the policy gave up.
+'''
+
+import bisect
+import threading
+import time
+
+
+class Histogram(object):
+    '''Latency histogram with fixed, roughly exponential buckets.'''
+
+    # upper bounds of the buckets in seconds (the last bucket is unbounded)
+    bounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+              0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        '''Returns the upper bound of the bucket, which contains the given
+        percentile (the maximum for the unbounded bucket).
+        '''
+        if not self.count:
+            return 0.
+        rank = self.count * percent / 100.
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        if index < len(self.bounds):
+            return min(self.bounds[index], self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': zip(self.bounds + (None,), self.buckets),
+        }
+
+
+class OperationStats(object):
+    '''Counts, errors and latencies of one operation type.'''
+
+    __slots__ = ['count', 'errors', 'latency']
+
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.latency = Histogram()
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': dict(self.errors),
+            'latency': self.latency.to_dict(),
+        }
+
+
+class Metrics(object):
+    '''Collects the statistics of a connection.'''
+
+    def __init__(self, sink=None):
+        ''':param sink: Optional object receiving every measurement'''
+        self.sink = sink
+        self.operations = {}
+        self.outstanding = 0
+        self.active_watches = 0
+        self.retries = {}
+        self._lock = threading.Lock()
+
+    def started(self, name):
+        '''Marks the start of an operation. Returns the start time.'''
+        self._lock.acquire()
+        self.outstanding += 1
+        self._lock.release()
+        return time.time()
+
+    def finished(self, name, started, exception=None):
+        '''Records a finished operation.'''
+        latency = time.time() - started
+        self._lock.acquire()
+        try:
+            self.outstanding -= 1
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.count += 1
+            stats.latency.record(latency)
+            if exception is not None:
+                error = type(exception).__name__
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+        finally:
+            self._lock.release()
+        if self.sink is not None:
+            self.sink.operation_completed(name, latency, exception)
+
+    def _count_retry(self, name, key):
+        self._lock.acquire()
+        try:
+            counts = self.retries.get(name)
+            if counts is None:
+                counts = self.retries[name] = {'retries': 0, 'exhausted': 0}
+            counts[key] += 1
+        finally:
+            self._lock.release()
+
+    def retried(self, name):
+        '''Counts a retry of an operation.'''
+        self._count_retry(name, 'retries')
+
+    def retries_exhausted(self, name):
+        '''Counts an operation, which failed after all retries.'''
+        self._count_retry(name, 'exhausted')
+
+    def _add_watches(self, count):
+        self._lock.acquire()
+        self.active_watches += count
+        self._lock.release()
+
+    def watching(self, watcher):
+        '''Counts a registered watch. Returns a watcher, which needs to be
+        registered instead of the given one.
+        '''
+        self._add_watches(1)
+        fired = []
+        def counted_watcher(handle, type, state, path):
+            # the binding keeps node watchers for session events of
+            # a living session
+            if not fired and (type != -1 or state < 0): # zookeeper.SESSION_EVENT
+                fired.append(True)
+                self._add_watches(-1)
+            return watcher(handle, type, state, path)
+        counted_watcher.cancel = lambda: self._add_watches(-1)
+        return counted_watcher
+
+    def to_dict(self):
+        '''Returns a snapshot of all statistics.'''
+        self._lock.acquire()
+        try:
+            return {
+                'operations': dict((name, stats.to_dict())
+                                   for name, stats in self.operations.items()),
+                'outstanding': self.outstanding,
+                'active_watches': self.active_watches,
+                'retries': dict((name, dict(counts))
+                                for name, counts in self.retries.items()),
+            }
+        finally:
+            self._lock.release()
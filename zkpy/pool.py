@@ -0,0 +1,205 @@
+'''
+Pool of zookeeper sessions.
+
+A single Connection handles all requests with one client i/o thread over one
+server socket. The ConnectionPool spreads read requests over several
+sessions:
+
+    pool = ConnectionPool('zk1:2181,zk2:2181,zk3:2181', 5, size=3)
+    data, stat = pool.get('/config/foo')
+    with pool.reader() as conn:
+        children = conn.get_children('/config')
+
+    # session bound work (locks, ephemeral nodes, writes)
+    lock = Lock(pool.session, '/locks/foo')
+
+Further keyword arguments of the pool are passed to every Connection, e.g.
+ConnectionPool(servers, 5, size=3, retry_policy=policy, recover_session=True).
+
+Note: reads on another session may lag behind writes of the designated
+session (zookeeper only guarantees in order reads within a session).
+'''
+
+from zkpy.connection import Connection
+import logging
+import threading
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    '''Manages several connections and hands them out for reads using
+    least-outstanding-requests balancing.
+    '''
+
+    def __init__(self, servers, timeout, size=2, pin_servers=False, **connection_args):
+        '''Creates and connects the pool.
+
+        :param servers: either a python list or a comma (',')
+                        sepparated list of  zookeper servers
+        :param timeout: timeout in seconds after connection initialisation fails
+        :param size: number of sessions
+        :param pin_servers: If True, the server list is rotated for every
+                            session, so that the sessions connect to different
+                            ensemble members. Note: zookeeper shuffles the
+                            servers of a new session unless deterministic
+                            connection order is switched on. This is a process
+                            wide setting of the binding: it stays on after the
+                            pool is created and applies to all connections
+                            created later on (of any pool or recipe).
+        Further keyword arguments (backend, retry_policy, dispatcher,
+        recover_session, ...) are passed to every Connection.
+        '''
+        if isinstance(servers, basestring):
+            servers = [server.strip() for server in servers.split(',')]
+        if size < 1:
+            raise ValueError('size needs to be at least 1')
+        if pin_servers:
+            backend = connection_args.get('backend')
+            (backend if backend is not None else zookeeper).deterministic_conn_order(True)
+
+        self._lock = threading.Lock()
+        self._connections = []
+        self._outstanding = []
+        self._next = 0
+        try:
+            for index in range(size):
+                if pin_servers:
+                    offset = index % len(servers)
+                    session_servers = servers[offset:] + servers[:offset]
+                else:
+                    session_servers = servers
+                self._connections.append(Connection(session_servers, timeout, **connection_args))
+                self._outstanding.append(0)
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self._connections)
+
+    @property
+    def connections(self):
+        '''All connections of the pool.'''
+        return list(self._connections)
+
+    @property
+    def session(self):
+        '''The designated connection for session bound work (locks, ephemeral
+        nodes, watches which need to survive with them, writes).
+        '''
+        return self._connections[0]
+
+    def outstanding(self):
+        '''Returns the number of outstanding reads per connection.'''
+        self._lock.acquire()
+        try:
+            return list(self._outstanding)
+        finally:
+            self._lock.release()
+
+    def _checkout(self):
+        '''Returns the index of the connected connection with the least
+        outstanding reads and counts a read on it.
+        '''
+        self._lock.acquire()
+        try:
+            count = len(self._connections)
+            best = None
+            # start at a rotating offset to spread reads on ties
+            for step in range(count):
+                index = (self._next + step) % count
+                if best is not None and self._outstanding[index] >= self._outstanding[best]:
+                    continue
+                if not self._connections[index].is_connected():
+                    continue
+                best = index
+            if best is None:
+                # nothing connected: let the session report the error
+                best = 0
+            self._next = (best + 1) % count
+            self._outstanding[best] += 1
+            return best
+        finally:
+            self._lock.release()
+
+    def _checkin(self, index):
+        self._lock.acquire()
+        self._outstanding[index] -= 1
+        self._lock.release()
+
+    def reader(self):
+        '''Returns a context manager, which provides a connection for reads:
+
+            with pool.reader() as conn:
+                conn.get(...)
+        '''
+        return _Reader(self)
+
+    def _read(self, name, *args):
+        index = self._checkout()
+        try:
+            return getattr(self._connections[index], name)(*args)
+        finally:
+            self._checkin(index)
+
+    def _read_async(self, name, *args):
+        index = self._checkout()
+        try:
+            future = getattr(self._connections[index], name)(*args)
+        except:
+            self._checkin(index)
+            raise
+        future.add_done_callback(lambda _future: self._checkin(index))
+        return future
+
+    def get(self, path, watcher=None):
+        return self._read('get', path, watcher)
+
+    def get_children(self, path, watcher=None):
+        return self._read('get_children', path, watcher)
+
+    def exists(self, path, watcher=None):
+        return self._read('exists', path, watcher)
+
+    def get_acl(self, path):
+        return self._read('get_acl', path)
+
+    def get_async(self, path, watcher=None):
+        return self._read_async('get_async', path, watcher)
+
+    def get_children_async(self, path, watcher=None):
+        return self._read_async('get_children_async', path, watcher)
+
+    def exists_async(self, path, watcher=None):
+        return self._read_async('exists_async', path, watcher)
+
+    def close(self):
+        '''Closes all connections.'''
+        for connection in self._connections:
+            try:
+                connection.close()
+            except Exception:
+                logger.exception('Could not close %s' % connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class _Reader(object):
+    '''Context manager of ConnectionPool.reader()'''
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._index = None
+
+    def __enter__(self):
+        self._index = self._pool._checkout()
+        return self._pool._connections[self._index]
+
+    def __exit__(self, type, value, traceback):
+        self._pool._checkin(self._index)
@@ -41,11 +41,28 @@ class Queue(object):
 
         '''
         self.zk_conn.create('%s/item-' % self.path,
-                            data,
+                            self.zk_conn.codecs.encode(self.path, data),
                             self.node_acl,
                             NodeCreationMode.PersistentSequential)
         return True
 
+    def push_all(self, items):
+        '''Pushes several items (in the given order) with a single round trip.
+        The items are not pushed atomically: if the creation of an item fails,
+        a TransactionError with the results of all items is raised, the
+        other items are pushed nevertheless.
+
+        :return: The paths of the new queue nodes.
+
+        '''
+        pipeline = self.zk_conn.pipeline()
+        for data in items:
+            pipeline.create('%s/item-' % self.path,
+                            self.zk_conn.codecs.encode(self.path, data),
+                            self.node_acl,
+                            NodeCreationMode.PersistentSequential)
+        return pipeline.commit()
+
     @zk_retry_operation
     def pop(self):
         '''Pops one item from the head of the queue.
@@ -72,13 +89,16 @@ class Queue(object):
     def _remove(self, item_path):
         '''Removes an item and returns its data.
 
-        May throw a NoNodeException.
+        May throw a NoNodeException. The data is decoded before the item is
+        deleted, thus an item, which can not be decoded (e.g. CodecError),
+        stays in the queue.
         '''
         while True:
             try:
                 data, stat = self.zk_conn.get(item_path)
+                value = self.zk_conn.codecs.decode(data)
                 self.zk_conn.delete(item_path, stat['version'])
-                return data
+                return value
             except zookeeper.BadVersionException:
                 self.logger.warn('Queue item "%s" was modified. This should not be done.' % item_path)
                 continue
@@ -0,0 +1,188 @@
+'''
+Recovery from session expiration.
+
+After a session expired, its zookeeper handle can not be used anymore: all
+watches and ephemeral nodes are gone. A connection created with
+recover_session=True tracks its watches (and the ephemeral nodes registered
+with Connection.register_ephemeral()) and, after an expiration,
+ - connects with a new session,
+ - re-creates the registered ephemeral nodes,
+ - re-arms the watches, which did not fire yet,
+ - notifies the global watchers with a Connected event.
+Recipes use the Connected event to resume (e.g. a Lock re-enters the lock
+queue). Apart from deletions of watched nodes, changes which happened while
+there was no session are not reported by the re-armed watches.
+'''
+
+import logging
+import threading
+import time
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRecovery(object):
+    '''Keeps track of the session bound state of a connection and restores it
+    on a new session.
+    '''
+
+    # asynchronous calls re-arming the watches of the synchronous ones
+    _rearm_calls = {
+        'exists': 'aexists',
+        'get': 'aget',
+        'get_children': 'aget_children',
+    }
+
+    def __init__(self, connection, retry_delay=1., max_attempts=None):
+        '''
+        :param connection: The zkpy connection
+        :param retry_delay: Seconds between reconnection attempts
+        :param max_attempts: Maximal number of reconnection attempts (None
+                             for no limit)
+        '''
+        self._connection = connection
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._watches = {}
+        self._ephemerals = {}
+        self._lock = threading.Lock()
+        self._recovering = False
+        self.recoveries = 0
+
+    def track(self, kind, path, watcher):
+        '''Returns a watcher, which is tracked until it fires.'''
+        def tracked_watcher(handle, type, state, event_path):
+            # session events do not consume the watch
+            if type != zookeeper.SESSION_EVENT:
+                self.untrack(tracked_watcher)
+            return watcher(handle, type, state, event_path)
+        self._lock.acquire()
+        self._watches[tracked_watcher] = (kind, path)
+        self._lock.release()
+        return tracked_watcher
+
+    def untrack(self, tracked_watcher):
+        self._lock.acquire()
+        self._watches.pop(tracked_watcher, None)
+        self._lock.release()
+
+    def call(self, kind, path, watcher):
+        '''Calls a synchronous watching zookeeper call with a tracked watcher.'''
+        tracked_watcher = self.track(kind, path, watcher)
+        try:
+            return getattr(self._connection._zk, kind)(self._connection._handle, path, tracked_watcher)
+        except:
+            # the watch was not set
+            self.untrack(tracked_watcher)
+            raise
+
+    def call_async(self, kind, path, watcher):
+        '''Calls an asynchronous watching zookeeper call with a tracked
+        watcher. Returns the future.
+        '''
+        tracked_watcher = self.track(kind, path, watcher)
+        future = self._connection._submit(
+            getattr(self._connection._zk, self._rearm_calls[kind]), path, tracked_watcher,
+            none_if_missing=(kind == 'exists'))
+        def failed(future):
+            if future.exception() is not None:
+                self.untrack(tracked_watcher)
+        future.add_done_callback(failed)
+        return future
+
+    def watch_count(self):
+        '''Returns the number of tracked watches.'''
+        return len(self._watches)
+
+    def register_ephemeral(self, path, data, acl):
+        self._lock.acquire()
+        self._ephemerals[path] = (data, acl)
+        self._lock.release()
+
+    def unregister_ephemeral(self, path):
+        self._lock.acquire()
+        self._ephemerals.pop(path, None)
+        self._lock.release()
+
+    def start(self):
+        '''Starts the recovery in a background thread (the global watcher,
+        which reports the expiration, runs on the completion thread of the
+        expired handle).
+        '''
+        self._lock.acquire()
+        try:
+            if self._recovering:
+                return
+            self._recovering = True
+        finally:
+            self._lock.release()
+        thread = threading.Thread(target=self._recover, name='zkpy-session-recovery')
+        thread.setDaemon(True)
+        thread.start()
+
+    def _recover(self):
+        try:
+            if not self._reconnect():
+                return
+            self.recoveries += 1
+            self._restore_ephemerals()
+            self._rearm_watches()
+        finally:
+            self._lock.acquire()
+            self._recovering = False
+            self._lock.release()
+
+        logger.info('Session recovered. Notifying watchers.')
+        # behind the expiration event, if it is still queued on a dispatcher
+        self._connection._deliver_global_event(
+            zookeeper.SESSION_EVENT, zookeeper.CONNECTED_STATE, '')
+
+    def _reconnect(self):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._connection._reconnect()
+                logger.info('Connected with a new session after %d attempt(s)' % attempt)
+                return True
+            except Exception as e:
+                if self.max_attempts is not None and attempt >= self.max_attempts:
+                    logger.error('Could not recover the session after %d attempts: %s' % (attempt, e))
+                    return False
+                logger.warn('Could not recover the session (attempt %d): %s' % (attempt, e))
+                time.sleep(self.retry_delay)
+
+    def _restore_ephemerals(self):
+        self._lock.acquire()
+        ephemerals = self._ephemerals.items()
+        self._lock.release()
+
+        futures = [(path, self._connection.create_async(path, data, acl, zookeeper.EPHEMERAL))
+                   for path, (data, acl) in ephemerals]
+        for path, future in futures:
+            exception = future.exception()
+            if exception is not None and not isinstance(exception, zookeeper.NodeExistsException):
+                logger.error('Could not re-create ephemeral node %s: %s' % (path, exception))
+
+    def _rearm_watches(self):
+        self._lock.acquire()
+        watches = self._watches.items()
+        self._lock.release()
+
+        for tracked_watcher, (kind, path) in watches:
+            future = self._connection._submit(
+                getattr(self._connection._zk, self._rearm_calls[kind]), path, tracked_watcher,
+                none_if_missing=(kind == 'exists'))
+            def failed(future, tracked_watcher=tracked_watcher, path=path):
+                exception = future.exception()
+                if isinstance(exception, zookeeper.NoNodeException):
+                    # the node was deleted without a session: report the
+                    # deletion the watch missed
+                    tracked_watcher(self._connection._handle, zookeeper.DELETED_EVENT,
+                                    zookeeper.CONNECTED_STATE, path)
+                elif exception is not None:
+                    logger.error('Could not re-arm watch on %s: %s' % (path, exception))
+                    self.untrack(tracked_watcher)
+            future.add_done_callback(failed)
+        logger.debug('Re-armed %d watches' % len(watches))
@@ -0,0 +1,185 @@
+'''
+Retry policies for zk_retry_operation.
+
+A policy decides, whether and after which delay a failed operation (connection
+loss or operation timeout) is retried:
+
+    conn = Connection('localhost:2181', 5,
+                      retry_policy=ExponentialBackoff(max_attempts=8, deadline=30,
+                                                      budget=RetryBudget()))
+
+Operations decorated with zk_retry_operation use the policy of their
+connection (the first argument or its _connection/zk_conn attribute), unless
+one is passed with the retry_policy keyword:
+
+    lock.acquire()
+    conn.ensure_path_exists('/foo', '', acl, retry_policy=FixedDelay(3, 0.1))
+
+Policies hold no per call state and may be shared by threads and connections.
+A RetryBudget is meant to be shared by all operations of one connection: when
+the ensemble is unavailable, the budget runs dry and operations fail fast
+instead of piling up retries (circuit breaker).
+'''
+
+import logging
+import random
+import threading
+import time
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+
+class RetryOperationError(Exception):
+    '''Raised, if a policy gives up. The last error is available as
+    exception.
+    '''
+
+    def __init__(self, message, exception=None):
+        Exception.__init__(self, message)
+        self.exception = exception
+
+
+class RetryBudget(object):
+    '''Token bucket limiting the retries of a connection.
+
+    Every retry costs one token, every successful operation earns
+    success_credit tokens (up to max_tokens). With the defaults, at most one
+    retry per ten successful operations is allowed in the long run.
+    '''
+
+    def __init__(self, max_tokens=10., success_credit=0.1):
+        self.max_tokens = max_tokens
+        self.success_credit = success_credit
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def withdraw(self):
+        '''Takes a token for a retry. Returns False, if the budget is
+        exhausted.
+        '''
+        self._lock.acquire()
+        try:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+        finally:
+            self._lock.release()
+
+    def deposit(self):
+        '''Credits a successful operation.'''
+        self._lock.acquire()
+        self.tokens = min(self.max_tokens, self.tokens + self.success_credit)
+        self._lock.release()
+
+
+class RetryPolicy(object):
+    '''Base class of the retry policies. Subclasses implement delay().'''
+
+    # errors, after which an operation is retried
+    retryable = (zookeeper.ConnectionLossException,
+                 zookeeper.OperationTimeoutException)
+
+    def __init__(self, max_attempts=10, deadline=None, budget=None):
+        '''
+        :param max_attempts: Maximal number of attempts (including the first)
+        :param deadline: Maximal number of seconds from the first attempt,
+                         after which no retry is started (None for no limit)
+        :param budget: Optional RetryBudget
+        '''
+        if max_attempts < 1:
+            raise ValueError('At least one attempt is needed')
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.budget = budget
+
+    def delay(self, attempt):
+        '''Returns the seconds to wait after the given (failed) attempt.'''
+        raise NotImplementedError()
+
+    def call(self, operation, *args, **kwargs):
+        '''Calls operation(*args, **kwargs) and retries it according to the
+        policy.
+
+        :param metrics: Optional zkpy.metrics.Metrics object counting the
+                        retries (keyword only)
+        '''
+        metrics = kwargs.pop('metrics', None)
+        name = getattr(operation, '__name__', str(operation))
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = operation(*args, **kwargs)
+            except zookeeper.SessionExpiredException:
+                logger.error('''Zookeeper session expired. Please clean up your state and start a new session and retry.''')
+                raise
+            except self.retryable as e:
+                delay = self._next_delay(attempt, started)
+                if delay is None:
+                    if metrics is not None:
+                        metrics.retries_exhausted(name)
+                    raise RetryOperationError(
+                        'Could not execute %s. Gave up after %d attempt(s): %s' % (operation, attempt, e), e)
+                if metrics is not None:
+                    metrics.retried(name)
+                logger.debug('%s failed (attempt %d): %s. Retrying in %.3fs' % (name, attempt, e, delay))
+                time.sleep(delay)
+            else:
+                if self.budget is not None:
+                    self.budget.deposit()
+                return result
+
+    def _next_delay(self, attempt, started):
+        '''Returns the delay before the next attempt or None to give up.'''
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.delay(attempt)
+        if self.deadline is not None:
+            remaining = started + self.deadline - time.time()
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        if self.budget is not None and not self.budget.withdraw():
+            logger.warning('Retry budget exhausted. Not retrying.')
+            return None
+        return delay
+
+
+class FixedDelay(RetryPolicy):
+    '''Retries after a constant delay.'''
+
+    def __init__(self, max_attempts=10, delay=0.5, deadline=None, budget=None):
+        RetryPolicy.__init__(self, max_attempts, deadline, budget)
+        self.fixed_delay = delay
+
+    def delay(self, attempt):
+        return self.fixed_delay
+
+
+class ExponentialBackoff(RetryPolicy):
+    '''Doubles the delay after every attempt (up to max_delay).
+
+    With jitter (the default), the delay is drawn uniformly between zero and
+    the exponential delay ("full jitter"), thus clients, which lost their
+    connection at the same time, do not retry in lock-step.
+    '''
+
+    def __init__(self, max_attempts=10, base_delay=0.1, max_delay=2.,
+                 jitter=True, deadline=None, budget=None):
+        RetryPolicy.__init__(self, max_attempts, deadline, budget)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+
+# policy of connections and operations without an explicit one
+default_policy = ExponentialBackoff()
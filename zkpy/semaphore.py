@@ -0,0 +1,169 @@
+'''
+Distributed semaphore: at most N lease holders at the same time.
+'''
+
+from zkpy.connection import EventType
+from zkpy.exceptions import NoNodeException
+from zkpy.lock import Lock
+from zkpy.watches import WatchKind
+import logging
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+
+class Semaphore(Lock):
+    '''Distributed semaphore with a number of permits (leases).
+
+    Like Lock, every semaphore object requests a lease with an ephemeral
+    sequential node (lease-<guid>-<sequence number>). The nodes, which have
+    less than permits smaller nodes, hold a lease. Every waiter sets a
+    single watch: the first waiter watches the children of the path (any
+    holder might release its lease), all others watch their smaller
+    neighbor, which marks its node (see OWNER_MARK) when it gets a lease.
+
+        semaphore = Semaphore(connection, '/semaphores/backend', 4)
+        with semaphore:
+            ...
+
+    acquire(), release(), the blocking acquire with timeout and the watcher
+    (lock_acquired() and lock_released()) behave like in Lock.
+    '''
+
+    _node_prefix = 'lease'
+
+    def __init__(self, connection, path, permits, watcher=None, name=None):
+        '''
+        :param connection:  The zkpy connection
+        :param path: Parent node under which the lease nodes are created.
+                     Needs to exist. All semaphore objects of a path need to
+                     use the same number of permits.
+        :param permits: Maximal number of lease holders
+        :param watcher: Lock watcher object. Needs to implement a
+                        lock_acquired() and lock_released() method.
+        '''
+        if permits < 1:
+            raise ValueError('A semaphore needs at least one permit')
+        Lock.__init__(self, connection, path, watcher, name)
+        self._permits = permits
+        # number of smaller nodes of the last listing
+        self._rank = None
+        # (path, watch kind) of the watch set by us
+        self._watch = None
+
+    @property
+    def permits(self):
+        return self._permits
+
+    def _evaluate(self, children):
+        '''Stores our rank and our smaller neighbor of a children listing.
+        Returns False, if our node does not exist.
+        '''
+        own_sequence = None
+        sequences = []
+        for child in children:
+            sequence = int(child[child.rfind('-') + 1:])
+            sequences.append((sequence, child))
+            if child == self._id:
+                own_sequence = sequence
+        if own_sequence is None:
+            return False
+
+        rank = 0
+        smaller_neighbor = None
+        for sequence, child in sequences:
+            if sequence < own_sequence:
+                rank += 1
+                if smaller_neighbor is None or sequence > smaller_neighbor[0]:
+                    smaller_neighbor = (sequence, child)
+
+        self._rank = rank
+        self._smaller_neighbor = smaller_neighbor[1] if smaller_neighbor else None
+        self._listed = True
+        return True
+
+    def _unwatch_neighbor(self):
+        '''Removes our watch callback (if any).'''
+        if self._watch is not None:
+            path, kind = self._watch
+            self._connection.watches.remove(path, kind, self._lease_watcher)
+            self._watch = None
+
+    def _lease_watcher(self, handle, type, state, path):
+        if type == EventType.NoneType:
+            # session events are handled by the connection watcher
+            return
+        # the caller might release the semaphore meanwhile
+        self._condition.acquire()
+        try:
+            if not self._id or self._watch is None or self._watch[0] != path:
+                logger.debug(self.name + ': Ignoring watch event for %s' % path)
+                return
+            # the watch fired once, thus it is not armed anymore
+            self._watch = None
+            self._listed = False
+            self._lock()
+        finally:
+            self._condition.release()
+
+    def _lock_unsafe(self):
+        max_retry_count = 10
+
+        former_lock_owner = self._last_owner
+
+        for _retry_count in range(max_retry_count):
+            # create our node if needed
+            if not self._id:
+                try:
+                    self._id = self._create_lock_node()
+                except zookeeper.NoNodeException:
+                    raise NoNodeException()
+                self._listed = False
+                self._waited = False
+
+            if not self._listed and not self._list_neighbors():
+                logger.warn(self.name + ': Could not find own lease node \'%s\'. Recreating...' % self._id)
+                self._id = None
+                continue
+
+            if self._rank < self._permits:
+                self._unwatch_neighbor()
+                if self._take_ownership(former_lock_owner):
+                    return True
+                self._listed = False
+                continue
+
+            # we wait: our node is marked, when we get a lease (see OWNER_MARK)
+            self._waited = True
+            if self._rank == self._permits:
+                # the first waiter: any holder might release its lease
+                watch = (self._path, WatchKind.Children)
+            else:
+                watch = ('%s/%s' % (self._path, self._smaller_neighbor), WatchKind.Exists)
+            if watch == self._watch:
+                return False
+
+            self._unwatch_neighbor()
+            try:
+                result = self._connection.watches.add(watch[0], watch[1],
+                                                      self._lease_watcher, once=True)
+            except zookeeper.NoNodeException:
+                self._connection.watches.remove(watch[0], watch[1], self._lease_watcher)
+                raise NoNodeException('Node %s needs to exist.' % self._path)
+            if watch[1] == WatchKind.Exists and not result:
+                # the smaller neighbor is gone already
+                self._connection.watches.remove(watch[0], watch[1], self._lease_watcher)
+                self._listed = False
+                continue
+            self._watch = watch
+
+            if watch[1] == WatchKind.Children:
+                # a lease might have been released after our listing
+                if not self._evaluate(result):
+                    self._listed = False
+                    continue
+                if self._rank < self._permits:
+                    continue
+            return False
+
+        raise RuntimeError('Could neither acquire a lease, nor set a watch')
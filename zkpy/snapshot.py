@@ -0,0 +1,201 @@
+'''
+Streaming export and import of zookeeper subtrees.
+
+    with open('config.zks', 'wb') as stream:
+        export_tree(conn, '/config', stream)
+
+    with open('config.zks', 'rb') as stream:
+        import_tree(conn, stream, '/config-copy')
+
+Records are written while the tree is walked and replayed while the file is
+read, thus neither side holds the whole tree in memory. For a compressed
+snapshot pass a gzip.GzipFile as stream.
+
+File format (all integers big endian):
+    magic 'ZKPYSNAP', version (uint8), exported root path (string)
+    per node: relative path (string), data (bytes), ACL count (uint16),
+              per ACL item: perms (uint32), scheme (string), id (string)
+strings and bytes are prefixed with their length (uint32); data of
+0xffffffff length is None.
+'''
+
+from zkpy.acl import Acl
+import collections
+import logging
+import struct
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'ZKPYSNAP'
+VERSION = 1
+
+_NONE = 0xffffffff
+_uint32 = struct.Struct('>I')
+_uint16 = struct.Struct('>H')
+
+
+class SnapshotFormatError(Exception):
+    pass
+
+
+class SnapshotWriter(object):
+    '''Writes snapshot records to a stream.'''
+
+    def __init__(self, stream, root):
+        self._stream = stream
+        self._root = root.rstrip('/')
+        stream.write(MAGIC + chr(VERSION))
+        self._write_bytes(root)
+
+    def _write_bytes(self, value):
+        if value is None:
+            self._stream.write(_uint32.pack(_NONE))
+        else:
+            self._stream.write(_uint32.pack(len(value)))
+            self._stream.write(value)
+
+    def write(self, path, data, acl):
+        '''Writes a node record.
+
+        :param path: Absolute path of the node (below the root)
+        :param acl: ACL as returned by get_acl() (list of dicts or Acl objects)
+        '''
+        relative_path = path[len(self._root):]
+        if relative_path == '/':
+            # the root node of a snapshot of '/'
+            relative_path = ''
+        self._write_bytes(relative_path)
+        self._write_bytes(data)
+        self._stream.write(_uint16.pack(len(acl)))
+        for item in acl:
+            self._stream.write(_uint32.pack(item['perms']))
+            self._write_bytes(item['scheme'])
+            self._write_bytes(item['id'])
+
+
+class SnapshotReader(object):
+    '''Iterates over the (relative path, data, acl) records of a snapshot.
+    The ACLs are returned as lists of zkpy.acl.Acl objects.
+    '''
+
+    def __init__(self, stream):
+        self._stream = stream
+        header = self._read(len(MAGIC) + 1)
+        if header[:-1] != MAGIC:
+            raise SnapshotFormatError('Not a zkpy snapshot')
+        if ord(header[-1]) != VERSION:
+            raise SnapshotFormatError('Unsupported snapshot version %d' % ord(header[-1]))
+        self.root = self._read_bytes()
+
+    def _read(self, length, allow_eof=False):
+        value = self._stream.read(length)
+        if len(value) != length:
+            if allow_eof and not value:
+                return None
+            raise SnapshotFormatError('Truncated snapshot')
+        return value
+
+    def _read_bytes(self, allow_eof=False):
+        length = self._read(_uint32.size, allow_eof)
+        if length is None:
+            return None
+        length, = _uint32.unpack(length)
+        if length == _NONE:
+            return None
+        return self._read(length)
+
+    def __iter__(self):
+        while True:
+            length = self._read(_uint32.size, True)
+            if length is None:
+                return
+            length, = _uint32.unpack(length)
+            path = self._read(length)
+            data = self._read_bytes()
+            acl = []
+            count, = _uint16.unpack(self._read(_uint16.size))
+            for _i in range(count):
+                perms, = _uint32.unpack(self._read(_uint32.size))
+                acl.append(Acl.from_dict({'perms': perms,
+                                          'scheme': self._read_bytes(),
+                                          'id': self._read_bytes()}))
+            yield path, data, acl
+
+
+def export_tree(connection, path, stream, max_outstanding=100, include_ephemeral=False):
+    '''Writes the node at path and all its descendants to stream.
+    Returns the number of exported nodes.
+
+    :param include_ephemeral: If set to 'True', ephemeral nodes are exported
+                              as well (they are imported as persistent nodes).
+    '''
+    writer = SnapshotWriter(stream, path)
+    count = 0
+    in_flight = collections.deque()
+
+    def write_oldest():
+        node, data, acl = in_flight.popleft()
+        try:
+            _stat, acl = acl.result()
+        except zookeeper.NoNodeException:
+            # deleted during the export
+            return 0
+        writer.write(node, data, acl)
+        return 1
+
+    for node, data, stat in connection.walk(path, max_outstanding):
+        if stat['ephemeralOwner'] and not include_ephemeral:
+            continue
+        if len(in_flight) >= max_outstanding:
+            count += write_oldest()
+        in_flight.append((node, data, connection.get_acl_async(node)))
+    while in_flight:
+        count += write_oldest()
+
+    logger.debug('Exported %d nodes of %s' % (count, path))
+    return count
+
+
+def import_tree(connection, stream, path=None, max_outstanding=100, overwrite=False):
+    '''Creates the nodes of a snapshot. Returns the number of created
+    (or, with overwrite, updated) nodes.
+
+    The creates are pipelined (up to max_outstanding). Parents precede their
+    children in the snapshot and zookeeper processes the requests of a
+    session in order, thus the parents are created first.
+
+    :param path: Root of the imported tree. Defaults to the exported root.
+    :param overwrite: If set to 'True' the data of existing nodes is
+                      replaced, otherwise existing nodes are left untouched.
+                      ACLs of existing nodes are not changed.
+    '''
+    reader = SnapshotReader(stream)
+    root = (path if path is not None else reader.root).rstrip('/')
+    count = 0
+    in_flight = collections.deque()
+
+    def check_oldest():
+        node, data, future = in_flight.popleft()
+        exception = future.exception()
+        if exception is None:
+            return 1
+        if isinstance(exception, zookeeper.NodeExistsException):
+            if overwrite:
+                connection.set(node, data)
+                return 1
+            return 0
+        raise exception
+
+    for relative_path, data, acl in reader:
+        node = (root + relative_path) or '/'
+        if len(in_flight) >= max_outstanding:
+            count += check_oldest()
+        if data is None:
+            data = ''
+        in_flight.append((node, data, connection.create_async(node, data, acl)))
+    while in_flight:
+        count += check_oldest()
+
+    logger.debug('Imported %d nodes to %s' % (count, root or '/'))
+    return count
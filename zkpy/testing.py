@@ -0,0 +1,735 @@
+'''
+In-process stand-in for a zookeeper ensemble.
+
+FakeZooKeeper implements the functions of the zookeeper binding on an in
+memory tree, thus connections and recipes can be tested and benchmarked
+without a server:
+
+    zk = FakeZooKeeper(latency=0.001)
+    conn = Connection('fake:2181', 5, backend=zk)
+    lock = Lock(conn, '/locks/foo')
+
+Supported: persistent, ephemeral and sequential nodes, versions and stats,
+one-time data and child watches, sessions (several connections share the
+tree) and atomic multi requests. ACLs are stored but not enforced,
+authentication always succeeds.
+
+Requests of a session are applied in the order they are issued. Synchronous
+calls return after the configured latency, asynchronous ones complete after
+it on the session's completion thread, which also delivers the watch events
+(in order with the completions, as the real client does).
+
+Failures are injected with fail() (errors of single requests),
+failure_rate (random connection losses), disconnect()/reconnect() and
+expire(). Requests and transferred bytes are counted (see
+stats()). With a seed, jitter and random failures are reproducible.
+'''
+
+from zkpy.exceptions import error_to_exception, _error_names
+import collections
+import copy
+import random
+import threading
+import time
+import traceback
+import zookeeper
+
+# binding function names of the operations
+_operations = ('create', 'delete', 'set', 'get', 'exists', 'get_children',
+               'get_acl', 'set_acl', 'multi')
+
+
+def _stat_copy(stat):
+    return dict(stat)
+
+
+class _Node(object):
+    __slots__ = ['data', 'acl', 'stat', 'children', 'sequence']
+
+    def __init__(self, data, acl, zxid, now, ephemeral_owner):
+        self.data = data
+        self.acl = acl
+        self.children = set()
+        self.sequence = 0
+        self.stat = {
+            'czxid': zxid, 'mzxid': zxid, 'pzxid': zxid,
+            'ctime': now, 'mtime': now,
+            'version': 0, 'cversion': 0, 'aversion': 0,
+            'ephemeralOwner': ephemeral_owner,
+            'dataLength': len(data), 'numChildren': 0,
+        }
+
+    def copy(self):
+        node = copy.copy(self)
+        node.stat = dict(self.stat)
+        node.children = set(self.children)
+        return node
+
+
+class _Session(object):
+    '''State and completion thread of one handle.'''
+
+    def __init__(self, handle, session_id, timeout, watcher):
+        self.handle = handle
+        self.id = session_id
+        self.password = '%016x' % session_id
+        self.timeout = timeout
+        self.watcher = watcher
+        self.state = zookeeper.CONNECTED_STATE
+        self.closed = False
+        # path -> list of watchers
+        self.data_watches = {}
+        self.child_watches = {}
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name='zkpy-fake-session-%d' % handle)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def post(self, due, callback, *args):
+        '''Queues callback(*args) for the completion thread. It is called not
+        before due (and in order with the other callbacks).
+        '''
+        self._condition.acquire()
+        try:
+            self._events.append((due, callback, args))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def stop(self):
+        '''Stops the completion thread after the queued callbacks.'''
+        self._condition.acquire()
+        self.closed = True
+        self._condition.notify()
+        self._condition.release()
+        if threading.currentThread() is not self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._events and not self.closed:
+                    self._condition.wait()
+                if not self._events:
+                    return
+                due, callback, args = self._events.popleft()
+            finally:
+                self._condition.release()
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                callback(*args)
+            except Exception:
+                # the real client ignores exceptions of callbacks as well
+                traceback.print_exc()
+
+    def pop_watchers(self):
+        '''Removes and returns all node watchers.'''
+        watchers = []
+        for watches in (self.data_watches, self.child_watches):
+            for path_watchers in watches.values():
+                watchers.extend(path_watchers)
+            watches.clear()
+        return watchers
+
+    def all_watchers(self):
+        watchers = []
+        for watches in (self.data_watches, self.child_watches):
+            for path_watchers in watches.values():
+                watchers.extend(path_watchers)
+        return watchers
+
+
+class _Failure(object):
+    __slots__ = ['operation', 'error', 'count', 'applied']
+
+    def __init__(self, operation, error, count, applied):
+        self.operation = operation
+        self.error = error
+        self.count = count
+        self.applied = applied
+
+
+class FakeZooKeeper(object):
+    '''In memory implementation of the zookeeper binding api (see module
+    documentation). Pass it as backend to Connection.
+    '''
+
+    def __init__(self, latency=0., jitter=0., failure_rate=0., seed=None):
+        '''
+        :param latency: Seconds every request takes. Either a number or a
+                        dict of operation name (e.g. 'get') to seconds
+                        (missing operations take no time).
+        :param jitter: Maximal random seconds added to the latency
+        :param failure_rate: Probability of a connection loss per request
+        :param seed: Seed of the random generator (jitter and failures)
+        '''
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._zxid = 0
+        self._nodes = {'/': _Node('', [], 0, 0, 0)}
+        self._sessions = {}
+        self._next_handle = 0
+        self._next_session_id = 0x1000
+        self._failures = []
+        # watch events of a multi request, fired when it succeeded
+        self._deferred = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        '''Resets the request counters.'''
+        self.requests = dict((name, 0) for name in _operations)
+        self.total_requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.failures = 0
+
+    def stats(self):
+        '''Returns the request counters: requests per operation, all requests
+        (multi requests count once), bytes sent to and received from the
+        "server" (node data and child names) and injected failures.
+        '''
+        self._lock.acquire()
+        try:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': self.total_requests,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'failures': self.failures,
+                'nodes': len(self._nodes),
+                'sessions': len(self._sessions),
+            }
+        finally:
+            self._lock.release()
+
+    def fail(self, operation=None, error=zookeeper.CONNECTIONLOSS, count=1, applied=False):
+        '''Lets the next count requests of an operation (any operation, if
+        None) fail with error (a zookeeper return code).
+
+        :param applied: If set to 'True' the request is applied before the
+                        error is reported (e.g. a connection loss after the
+                        server processed the request).
+        '''
+        self._lock.acquire()
+        self._failures.append(_Failure(operation, error, count, applied))
+        self._lock.release()
+
+    def _sessions_of(self, handle):
+        if handle is None:
+            return list(self._sessions.values())
+        return [self._session(handle)]
+
+    def disconnect(self, handle=None):
+        '''Disconnects a session (all sessions, if handle is None): requests
+        fail with connection losses until reconnect() is called.
+        '''
+        self._lock.acquire()
+        try:
+            for session in self._sessions_of(handle):
+                self._set_state(session, zookeeper.CONNECTING_STATE)
+        finally:
+            self._lock.release()
+
+    def reconnect(self, handle=None):
+        '''Reconnects disconnected sessions (all, if handle is None).'''
+        self._lock.acquire()
+        try:
+            for session in self._sessions_of(handle):
+                if session.state == zookeeper.CONNECTING_STATE:
+                    self._set_state(session, zookeeper.CONNECTED_STATE)
+        finally:
+            self._lock.release()
+
+    def expire(self, handle=None):
+        '''Expires a session (all sessions, if handle is None): its ephemeral
+        nodes are deleted, its watchers get an expiration event and the
+        handle becomes unusable.
+        '''
+        self._lock.acquire()
+        try:
+            for session in self._sessions_of(handle):
+                # the session is gone before its ephemeral nodes are deleted
+                self._set_state(session, zookeeper.EXPIRED_SESSION_STATE)
+                self._end_session(session)
+        finally:
+            self._lock.release()
+
+    def _set_state(self, session, state):
+        '''Changes the state of a session and notifies all its watchers.'''
+        session.state = state
+        if state == zookeeper.EXPIRED_SESSION_STATE:
+            watchers = session.pop_watchers()
+        else:
+            watchers = session.all_watchers()
+        now = time.time()
+        if session.watcher is not None:
+            session.post(now, session.watcher, session.handle, zookeeper.SESSION_EVENT, state, '')
+        for watcher in watchers:
+            session.post(now, watcher, session.handle, zookeeper.SESSION_EVENT, state, '')
+
+    def _end_session(self, session):
+        '''Deletes the ephemeral nodes of a session.'''
+        owned = [path for path, node in self._nodes.items()
+                 if node.stat['ephemeralOwner'] == session.id]
+        # children first
+        owned.sort(reverse=True)
+        for path in owned:
+            if path in self._nodes:
+                self._delete_node(path)
+
+    def _session(self, handle):
+        session = self._sessions.get(handle)
+        if session is None:
+            raise zookeeper.ZooKeeperException('zhandle already freed')
+        return session
+
+    def _delay(self, operation):
+        if isinstance(self.latency, dict):
+            latency = self.latency.get(operation, 0.)
+        else:
+            latency = self.latency
+        if self.jitter:
+            latency += self._random.uniform(0, self.jitter)
+        return latency
+
+    def _check(self, session, operation):
+        '''Returns the error code a request fails with (zookeeper.OK, if it
+        is executed) and whether it is applied anyway.
+        '''
+        self.requests[operation] += 1
+        self.total_requests += 1
+        if session.state == zookeeper.EXPIRED_SESSION_STATE:
+            return zookeeper.SESSIONEXPIRED, False
+        if session.state != zookeeper.CONNECTED_STATE:
+            return zookeeper.CONNECTIONLOSS, False
+        for failure in self._failures:
+            if failure.operation in (None, operation):
+                failure.count -= 1
+                if failure.count <= 0:
+                    self._failures.remove(failure)
+                self.failures += 1
+                return failure.error, failure.applied
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.failures += 1
+            return zookeeper.CONNECTIONLOSS, False
+        return zookeeper.OK, True
+
+    def _request(self, handle, operation, apply, *args):
+        '''Executes a request. Returns (return code, values).'''
+        self._lock.acquire()
+        try:
+            session = self._session(handle)
+            error, applied = self._check(session, operation)
+            values = ()
+            if applied:
+                try:
+                    values = apply(session, *args)
+                except zookeeper.ZooKeeperException as e:
+                    if error == zookeeper.OK:
+                        error = _error_code(e)
+            return session, error, values
+        finally:
+            self._lock.release()
+
+    def _call(self, handle, operation, apply, *args):
+        '''Synchronous request: raises the exception of a failed request.'''
+        _session, error, values = self._request(handle, operation, apply, *args)
+        delay = self._delay(operation)
+        if delay > 0:
+            time.sleep(delay)
+        if error != zookeeper.OK:
+            raise error_to_exception(error)
+        return values
+
+    def _acall(self, handle, operation, apply, completion, *args):
+        '''Asynchronous request: calls completion(handle, rc, *values) on the
+        completion thread.
+        '''
+        session, error, values = self._request(handle, operation, apply, *args)
+        if error != zookeeper.OK:
+            values = _error_values(operation)
+        if completion is not None:
+            session.post(time.time() + self._delay(operation),
+                         completion, handle, error, *values)
+        return zookeeper.OK
+
+    def _next_zxid(self):
+        self._zxid += 1
+        return self._zxid
+
+    @staticmethod
+    def _parent(path):
+        return path[:path.rfind('/')] or '/'
+
+    def _node(self, path):
+        node = self._nodes.get(path)
+        if node is None:
+            raise zookeeper.NoNodeException(path)
+        return node
+
+    def _trigger(self, path, data_event=None, child_event=False):
+        '''Fires (and removes) the watches of a path.'''
+        if self._deferred is not None:
+            self._deferred.append((path, data_event, child_event))
+            return
+        now = time.time()
+        for session in self._sessions.values():
+            watchers = []
+            if data_event is not None:
+                watchers.extend((watcher, data_event) for watcher in session.data_watches.pop(path, ()))
+            if child_event or data_event == zookeeper.DELETED_EVENT:
+                event = zookeeper.CHILD_EVENT if child_event else zookeeper.DELETED_EVENT
+                watchers.extend((watcher, event) for watcher in session.child_watches.pop(path, ()))
+            for watcher, event in watchers:
+                session.post(now, watcher, session.handle, event, zookeeper.CONNECTED_STATE, path)
+
+    @staticmethod
+    def _watch(watches, path, watcher):
+        if watcher is None:
+            return
+        watchers = watches.setdefault(path, [])
+        if watcher not in watchers:
+            watchers.append(watcher)
+
+    def _validate(self, path):
+        if (not path or not path.startswith('/') or
+                (path != '/' and path.endswith('/')) or '//' in path):
+            raise zookeeper.BadArgumentsException('Invalid path %r' % path)
+
+    def _apply_create(self, session, path, data, acl, flags=0):
+        self._validate(path)
+        if data is None:
+            data = ''
+        parent_path = self._parent(path)
+        parent = self._node(parent_path)
+        if parent.stat['ephemeralOwner']:
+            raise zookeeper.NoChildrenForEphemeralsException(parent_path)
+        if flags & zookeeper.SEQUENCE:
+            path = '%s%010d' % (path, parent.sequence)
+        if path in self._nodes:
+            raise zookeeper.NodeExistsException(path)
+        zxid = self._next_zxid()
+        owner = session.id if flags & zookeeper.EPHEMERAL else 0
+        self._nodes[path] = _Node(data, acl, zxid, int(time.time() * 1000), owner)
+        parent.children.add(path[len(parent_path.rstrip('/')) + 1:])
+        parent.sequence += 1
+        parent.stat['cversion'] += 1
+        parent.stat['numChildren'] = len(parent.children)
+        parent.stat['pzxid'] = zxid
+        self.bytes_sent += len(data)
+        self._trigger(path, zookeeper.CREATED_EVENT)
+        self._trigger(parent_path, child_event=True)
+        return (path,)
+
+    def _delete_node(self, path):
+        node = self._nodes.pop(path)
+        parent_path = self._parent(path)
+        parent = self._nodes[parent_path]
+        parent.children.discard(path[len(parent_path.rstrip('/')) + 1:])
+        parent.stat['cversion'] += 1
+        parent.stat['numChildren'] = len(parent.children)
+        parent.stat['pzxid'] = self._next_zxid()
+        self._trigger(path, zookeeper.DELETED_EVENT)
+        self._trigger(parent_path, child_event=True)
+        return node
+
+    def _apply_delete(self, session, path, version=-1):
+        self._validate(path)
+        node = self._node(path)
+        if path == '/':
+            raise zookeeper.BadArgumentsException('Can not delete /')
+        if version != -1 and version != node.stat['version']:
+            raise zookeeper.BadVersionException(path)
+        if node.children:
+            raise zookeeper.NotEmptyException(path)
+        self._delete_node(path)
+        return ()
+
+    def _apply_set(self, session, path, data, version=-1):
+        node = self._node(path)
+        if version != -1 and version != node.stat['version']:
+            raise zookeeper.BadVersionException(path)
+        if data is None:
+            data = ''
+        node.data = data
+        node.stat['version'] += 1
+        node.stat['mzxid'] = self._next_zxid()
+        node.stat['mtime'] = int(time.time() * 1000)
+        node.stat['dataLength'] = len(data)
+        self.bytes_sent += len(data)
+        self._trigger(path, zookeeper.CHANGED_EVENT)
+        return (_stat_copy(node.stat),)
+
+    def _apply_check(self, session, path, version):
+        node = self._node(path)
+        if version != -1 and version != node.stat['version']:
+            raise zookeeper.BadVersionException(path)
+        return (_stat_copy(node.stat),)
+
+    def _apply_get(self, session, path, watcher=None):
+        node = self._node(path)
+        self._watch(session.data_watches, path, watcher)
+        self.bytes_received += len(node.data)
+        return node.data, _stat_copy(node.stat)
+
+    def _apply_exists(self, session, path, watcher=None):
+        # exists watches are set on missing nodes as well
+        self._watch(session.data_watches, path, watcher)
+        node = self._nodes.get(path)
+        if node is None:
+            raise zookeeper.NoNodeException(path)
+        return (_stat_copy(node.stat),)
+
+    def _apply_get_children(self, session, path, watcher=None):
+        node = self._node(path)
+        self._watch(session.child_watches, path, watcher)
+        children = sorted(node.children)
+        self.bytes_received += sum(len(child) for child in children)
+        return (children,)
+
+    def _apply_get_acl(self, session, path):
+        node = self._node(path)
+        return _stat_copy(node.stat), list(node.acl)
+
+    def _apply_aget_acl(self, session, path):
+        stat, acl = self._apply_get_acl(session, path)
+        return acl, stat
+
+    def _apply_set_acl(self, session, path, version, acl):
+        node = self._node(path)
+        if version != -1 and version != node.stat['aversion']:
+            raise zookeeper.BadVersionException(path)
+        node.acl = acl
+        node.stat['aversion'] += 1
+        return ()
+
+    def _apply_multi(self, session, operations):
+        '''Applies all operations or none. Returns the list of (return code,
+        result) tuples, raises the exception of the first failed operation
+        (with the results as attribute).
+        '''
+        backup = dict((path, node.copy()) for path, node in self._nodes.items())
+        zxid = self._zxid
+        applies = {'create': self._apply_create, 'delete': self._apply_delete,
+                   'set': self._apply_set, 'check': self._apply_check}
+        results = []
+        failed = None
+        self._deferred = []
+        try:
+            for operation in operations:
+                try:
+                    values = applies[operation[0]](session, *operation[1:])
+                    results.append((zookeeper.OK, values[0] if values else zookeeper.OK))
+                except zookeeper.ZooKeeperException as e:
+                    failed = e
+                    break
+        finally:
+            deferred, self._deferred = self._deferred, None
+
+        if failed is None:
+            for args in deferred:
+                self._trigger(*args)
+            return (results,)
+
+        # roll back: the other operations report a runtime inconsistency
+        self._nodes = backup
+        self._zxid = zxid
+        failed.results = [(zookeeper.RUNTIMEINCONSISTENCY, None)] * len(operations)
+        failed.results[len(results)] = (_error_code(failed), None)
+        raise failed
+
+    def init(self, servers, watcher=None, timeout=10000, client_id=None):
+        self._lock.acquire()
+        try:
+            handle = self._next_handle
+            self._next_handle += 1
+            self._next_session_id += 1
+            session = _Session(handle, self._next_session_id, timeout, watcher)
+            self._sessions[handle] = session
+        finally:
+            self._lock.release()
+        if watcher is not None:
+            session.post(time.time(), watcher, handle, zookeeper.SESSION_EVENT,
+                         zookeeper.CONNECTED_STATE, '')
+        return handle
+
+    def close(self, handle):
+        self._lock.acquire()
+        try:
+            session = self._session(handle)
+            if session.state != zookeeper.EXPIRED_SESSION_STATE:
+                self._end_session(session)
+            session.pop_watchers()
+            del self._sessions[handle]
+        finally:
+            self._lock.release()
+        session.stop()
+        return zookeeper.OK
+
+    def state(self, handle):
+        self._lock.acquire()
+        try:
+            return self._session(handle).state
+        finally:
+            self._lock.release()
+
+    def client_id(self, handle):
+        session = self._session(handle)
+        return session.id, session.password
+
+    def is_unrecoverable(self, handle):
+        return self._session(handle).state == zookeeper.EXPIRED_SESSION_STATE
+
+    def recv_timeout(self, handle):
+        return self._session(handle).timeout
+
+    def set_watcher(self, handle, watcher):
+        self._session(handle).watcher = watcher
+
+    def add_auth(self, handle, scheme, credentials, completion=None):
+        session = self._session(handle)
+        if completion is not None:
+            session.post(time.time() + self._delay('add_auth'), completion, handle, zookeeper.OK)
+        return zookeeper.OK
+
+    def deterministic_conn_order(self, flag):
+        pass
+
+    def set_debug_level(self, level):
+        pass
+
+    def zerror(self, return_code):
+        return zookeeper.zerror(return_code)
+
+    def create(self, handle, path, data, acl, flags=0):
+        return self._call(handle, 'create', self._apply_create, path, data, acl, flags)[0]
+
+    def delete(self, handle, path, version=-1):
+        self._call(handle, 'delete', self._apply_delete, path, version)
+        return zookeeper.OK
+
+    def set(self, handle, path, data, version=-1):
+        self._call(handle, 'set', self._apply_set, path, data, version)
+        return zookeeper.OK
+
+    def set2(self, handle, path, data, version=-1):
+        return self._call(handle, 'set', self._apply_set, path, data, version)[0]
+
+    def get(self, handle, path, watcher=None):
+        return self._call(handle, 'get', self._apply_get, path, watcher)
+
+    def exists(self, handle, path, watcher=None):
+        try:
+            return self._call(handle, 'exists', self._apply_exists, path, watcher)[0]
+        except zookeeper.NoNodeException:
+            return None
+
+    def get_children(self, handle, path, watcher=None):
+        return self._call(handle, 'get_children', self._apply_get_children, path, watcher)[0]
+
+    def get_acl(self, handle, path):
+        return self._call(handle, 'get_acl', self._apply_get_acl, path)
+
+    def set_acl(self, handle, path, version, acl):
+        self._call(handle, 'set_acl', self._apply_set_acl, path, version, acl)
+        return zookeeper.OK
+
+    def multi(self, handle, operations):
+        '''Applies a list of operations atomically. Operations are tuples:
+        ('create', path, data, acl[, flags]), ('delete', path[, version]),
+        ('set', path, data[, version]) and ('check', path, version).
+        Returns the list of (return code, result) tuples. If an operation
+        fails, its exception is raised and nothing is applied.
+        '''
+        return self._call(handle, 'multi', self._apply_multi, operations)[0]
+
+    def acreate(self, handle, path, data, acl, flags=0, completion=None):
+        return self._acall(handle, 'create', self._apply_create, completion, path, data, acl, flags)
+
+    def adelete(self, handle, path, version=-1, completion=None):
+        return self._acall(handle, 'delete', self._apply_delete, completion, path, version)
+
+    def aset(self, handle, path, data, version=-1, completion=None):
+        return self._acall(handle, 'set', self._apply_set, completion, path, data, version)
+
+    def aget(self, handle, path, watcher=None, completion=None):
+        return self._acall(handle, 'get', self._apply_get, completion, path, watcher)
+
+    def aexists(self, handle, path, watcher=None, completion=None):
+        return self._acall(handle, 'exists', self._apply_exists, completion, path, watcher)
+
+    def aget_children(self, handle, path, watcher=None, completion=None):
+        return self._acall(handle, 'get_children', self._apply_get_children, completion, path, watcher)
+
+    def aget_acl(self, handle, path, completion=None):
+        # the binding passes (acl, stat) to the completion, unlike get_acl()
+        return self._acall(handle, 'get_acl', self._apply_aget_acl, completion, path)
+
+    def aset_acl(self, handle, path, version, acl, completion=None):
+        return self._acall(handle, 'set_acl', self._apply_set_acl, completion, path, version, acl)
+
+    def amulti(self, handle, operations, completion=None):
+        '''Asynchronous version of multi(). The completion is called as
+        completion(handle, return code, results); results is the list of
+        (return code, result) tuples of the operations. If an operation
+        failed, the return code is its error (as the binding reports it).
+        '''
+        session, error, values = self._request(handle, 'multi', self._apply_multi_results, operations)
+        if error == zookeeper.OK:
+            for result_code, _result in values[0]:
+                if result_code not in (zookeeper.OK, zookeeper.RUNTIMEINCONSISTENCY):
+                    error = result_code
+                    break
+        if completion is not None:
+            session.post(time.time() + self._delay('multi'), completion, handle, error, *values)
+        return zookeeper.OK
+
+    def _apply_multi_results(self, session, operations):
+        try:
+            return self._apply_multi(session, operations)
+        except zookeeper.ZooKeeperException as e:
+            if not hasattr(e, 'results'):
+                raise
+            # the completion gets the per operation results
+            return (e.results,)
+
+    def dump(self, path='/'):
+        '''Returns a dict of path -> data of all nodes below (and including)
+        path (for assertions in tests).
+        '''
+        self._lock.acquire()
+        try:
+            prefix = path.rstrip('/') + '/'
+            return dict((node_path, node.data) for node_path, node in self._nodes.items()
+                        if node_path == path or node_path.startswith(prefix))
+        finally:
+            self._lock.release()
+
+
+def _error_code(exception):
+    '''Returns the return code of a binding exception.'''
+    for code, name in _error_names:
+        if isinstance(exception, getattr(zookeeper, name)):
+            return getattr(zookeeper, code)
+    return zookeeper.SYSTEMERROR
+
+
+def _error_values(operation):
+    '''Values passed to the completion of a failed request.'''
+    if operation == 'get':
+        return (None, None)
+    if operation == 'get_acl':
+        return (None, None)
+    if operation in ('create', 'set', 'exists', 'get_children', 'multi'):
+        return (None,)
+    return ()
+
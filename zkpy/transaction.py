@@ -0,0 +1,170 @@
+'''
+Batched write operations.
+
+A Transaction applies create/delete/set/check operations atomically with a
+single multi request:
+
+    with conn.transaction() as transaction:
+        transaction.create('/foo', '', acl)
+        transaction.create('/foo/bar', 'data', acl)
+        transaction.set('/baz', 'new data', version=3)
+
+or
+
+    results = conn.transaction().create(...).delete(...).commit()
+
+The zookeeper python binding does not support multi requests, thus
+transactions need a backend, which does (e.g. zkpy.testing). A Pipeline
+sends create/delete/set operations at once on any backend, but applies them
+one by one:
+
+    paths = conn.pipeline().create(...).create(...).commit()
+
+'''
+
+from zkpy.exceptions import TransactionError, error_to_exception
+from zkpy.future import Future
+import time
+import zookeeper
+
+
+class Pipeline(object):
+    '''Collects create/delete/set operations and sends them to zookeeper at
+    once, so that all operations cost a single round trip.
+
+    The operations are pipelined in the order they were added (and zookeeper
+    applies them in this order), but they are not applied atomically:
+    operations following a failed one are still executed. Use the results of
+    the TransactionError to clean up.
+    '''
+
+    atomic = False
+
+    def __init__(self, connection):
+        ':param connection: The zkpy connection'
+        self._connection = connection
+        self._operations = []
+        self.committed = False
+
+    def __len__(self):
+        return len(self._operations)
+
+    def _add(self, kind, call, *args):
+        if self.committed:
+            raise RuntimeError('Operations were already committed')
+        self._operations.append((kind, call, args))
+        return self
+
+    def create(self, path, data, acl, flags=0):
+        '''Adds the creation of a node. Its result is the path of the node.'''
+        return self._add('create', self._connection.create_async, path, data, acl, flags)
+
+    def delete(self, path, version=-1):
+        '''Adds the deletion of a node. Its result is zookeeper.OK.'''
+        return self._add('delete', self._connection.delete_async, path, version)
+
+    def set(self, path, data, version=-1):
+        '''Adds a data update. Its result is the stat of the updated node.'''
+        return self._add('set', self._connection.set_async, path, data, version)
+
+    def commit_async(self):
+        '''Sends all operations. Returns a list of futures (one per operation).'''
+        if self.committed:
+            raise RuntimeError('Operations were already committed')
+        self.committed = True
+        return [call(*args) for _kind, call, args in self._operations]
+
+    def commit(self, timeout=None):
+        '''Sends all operations and waits for their results.
+        Returns the list of results (in the order the operations were added).
+        Raises a TransactionError, if any of the operations failed, or a
+        TimeoutException, if not all operations completed within timeout
+        seconds.
+        '''
+        futures = self.commit_async()
+        deadline = None if timeout is None else time.time() + timeout
+        results = []
+        failed = False
+        for future in futures:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            exception = future.exception(remaining)
+            if exception is not None:
+                failed = True
+                results.append(exception)
+            else:
+                results.append(future.result())
+        if failed:
+            raise TransactionError(results)
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # only commit, if the block did not fail
+        if type is None:
+            self.commit()
+
+
+class Transaction(Pipeline):
+    '''Collects create/delete/set/check operations and applies them
+    atomically with a single multi request: if one operation fails, none is
+    applied and the others fail with a RuntimeInconsistencyException.
+
+    Needs a backend providing multi requests (amulti). The zookeeper python
+    binding does not, use a Pipeline there.
+    '''
+
+    atomic = True
+
+    def __init__(self, connection):
+        '''
+        :param connection: The zkpy connection
+        :raises NotImplementedError: if the backend does not support multi
+                                     requests
+        '''
+        if not hasattr(connection._zk, 'amulti'):
+            raise NotImplementedError('The zookeeper backend does not support multi requests '
+                                      '(use Connection.pipeline() for non-atomic batches)')
+        Pipeline.__init__(self, connection)
+
+    def check(self, path, version):
+        '''Adds a version check of a node. Its result is the stat of the node.
+        Fails with a BadVersionException, if the node has another version.
+        '''
+        return self._add('check', None, path, version)
+
+    def commit_async(self):
+        '''Sends all operations in a single multi request. Returns a list of
+        futures (one per operation).
+        '''
+        if self.committed:
+            raise RuntimeError('Operations were already committed')
+        self.committed = True
+        connection = self._connection
+        futures = [Future() for _operation in self._operations]
+        paths = [args[0] for _kind, _call, args in self._operations]
+        for kind, _call, args in self._operations:
+            if kind == 'delete':
+                # as delete_async() does
+                connection._known_paths.discard(args[0])
+                if connection._recovery is not None:
+                    connection._recovery.unregister_ephemeral(args[0])
+
+        def completion(handle, return_code, results=None):
+            if results is None:
+                # the request as a whole failed (e.g. connection loss)
+                results = [(return_code, None)] * len(futures)
+            for future, path, (result_code, result) in zip(futures, paths, results):
+                if result_code == zookeeper.OK:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error_to_exception(result_code, path))
+
+        operations = [(kind,) + args for kind, _call, args in self._operations]
+        try:
+            connection._zk.amulti(connection._handle, operations, completion)
+        except zookeeper.ZooKeeperException as e:
+            for future in futures:
+                future.set_exception(e)
+        return futures
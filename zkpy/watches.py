@@ -0,0 +1,221 @@
+'''
+Watch multiplexing.
+
+Every zookeeper watch is a registration on the server and has to be re-armed
+with a read after it fired. The WatchRegistry of a connection
+(conn.watches) keeps a single zookeeper watch per (path, kind), calls all
+registered callbacks, when it fires, and re-arms it once for all of them:
+
+    conn.watches.add('/config', WatchKind.Children, on_config_change)
+    ...
+    conn.watches.remove('/config', WatchKind.Children, on_config_change)
+
+Callbacks are called as callback(handle, type, state, path), like zookeeper
+watchers. They stay registered until they are removed, unless they were
+added with once=True.
+
+Adding a callback to an armed watch costs no request: the result of the
+read, which armed the watch, is still valid until the watch fires.
+'''
+
+from zkpy.utils import enum
+import copy
+import logging
+import threading
+import zookeeper
+
+logger = logging.getLogger(__name__)
+
+# Watch kinds (named after the connection method setting the watch)
+WatchKind = enum(
+    Exists   = 'exists',          # creation, deletion and data changes
+    Data     = 'get',             # deletion and data changes
+    Children = 'get_children'     # deletion and children changes
+)
+
+# markers of the remembered read results
+_UNKNOWN = object()
+_MISSING = object()
+
+
+class WatchRegistry(object):
+    '''Multiplexes callbacks onto one zookeeper watch per (path, kind).'''
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+        # (path, kind) -> list of [callback, once]
+        self._callbacks = {}
+        # (path, kind) -> kind of the armed zookeeper watch
+        self._armed = {}
+        # (path, kind) -> result of the read, which armed the watch
+        self._results = {}
+        # number of fired watches (invalidates the reads in flight)
+        self._fires = 0
+
+    def add(self, path, kind, callback, once=False):
+        '''Registers a callback. Returns the result of the corresponding read
+        (e.g. the stat of exists()), which tells the current state.
+        Only the first callback for (path, kind) sets a zookeeper watch. The
+        others get the result of the read, which armed the watch (the child
+        counts of a stat might be outdated, as they do not fire exists and
+        data watches).
+        If a data or children watch is requested for a missing node, the
+        NoNodeException is raised, but the callback stays registered and gets
+        the NodeCreated event.
+
+        :param once: If set to 'True' the callback is removed after it got
+                     the first node event.
+        '''
+        key = (path, kind)
+        self._lock.acquire()
+        try:
+            self._callbacks.setdefault(key, []).append([callback, once])
+            needs_watch = key not in self._armed
+            if needs_watch:
+                self._armed[key] = kind
+            result = self._results.get(key, _UNKNOWN)
+            fires = self._fires
+        finally:
+            self._lock.release()
+
+        if result is _MISSING:
+            raise zookeeper.NoNodeException(path)
+        if result is not _UNKNOWN:
+            # callers may modify their copy (e.g. sort the children)
+            return copy.copy(result)
+
+        read = getattr(self._connection, kind)
+        try:
+            if needs_watch:
+                result = read(path, self._watcher(key))
+                self._remember(key, fires, result)
+                return result
+            return read(path)
+        except zookeeper.NoNodeException:
+            if needs_watch:
+                # data and children watches need an existing node: wait
+                # for its creation
+                self._arm_exists(key)
+            raise
+        except:
+            if needs_watch:
+                self._lock.acquire()
+                self._armed.pop(key, None)
+                self._lock.release()
+            self.remove(path, kind, callback)
+            raise
+
+    def remove(self, path, kind, callback):
+        '''Removes a callback. Note: zookeeper can not remove watches, an
+        armed watch is just not re-armed after it fired.
+        '''
+        key = (path, kind)
+        self._lock.acquire()
+        try:
+            callbacks = self._callbacks.get(key, [])
+            for index, (registered, _once) in enumerate(callbacks):
+                if registered == callback:
+                    del callbacks[index]
+                    break
+            if not callbacks:
+                self._callbacks.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def watch_count(self):
+        '''Returns the number of armed zookeeper watches.'''
+        return len(self._armed)
+
+    def callback_count(self):
+        '''Returns the number of registered callbacks.'''
+        self._lock.acquire()
+        try:
+            return sum(len(callbacks) for callbacks in self._callbacks.values())
+        finally:
+            self._lock.release()
+
+    def _remember(self, key, fires, result):
+        '''Stores the result of the read, which armed the watch, unless the
+        watch (or any other) fired meanwhile.
+        '''
+        self._lock.acquire()
+        try:
+            if self._fires == fires and key in self._armed:
+                self._results[key] = result
+        finally:
+            self._lock.release()
+
+    def _watcher(self, key):
+        def watcher(handle, type, state, path):
+            self._fired(key, handle, type, state, path)
+        return watcher
+
+    def _arm_exists(self, key):
+        self._lock.acquire()
+        self._armed[key] = WatchKind.Exists
+        fires = self._fires
+        self._lock.release()
+        def armed(future):
+            if future.exception() is None and future.result() is None:
+                self._remember(key, fires, _MISSING)
+        self._connection.exists_async(key[0], self._watcher(key)).add_done_callback(armed)
+
+    def _fired(self, key, handle, type, state, path):
+        self._lock.acquire()
+        try:
+            callbacks = list(self._callbacks.get(key, []))
+            if type != zookeeper.SESSION_EVENT or state == zookeeper.EXPIRED_SESSION_STATE:
+                # the remembered read is outdated
+                self._results.pop(key, None)
+                self._fires += 1
+            if type != zookeeper.SESSION_EVENT:
+                # the zookeeper watch is consumed: remove one time callbacks
+                # and re-arm for the remaining ones
+                remaining = [item for item in callbacks if not item[1]]
+                if remaining:
+                    self._callbacks[key] = remaining
+                else:
+                    self._callbacks.pop(key, None)
+                    self._armed.pop(key, None)
+            else:
+                remaining = None
+                if (state == zookeeper.EXPIRED_SESSION_STATE
+                        and not self._connection.recovers_session):
+                    # the watch is gone with the session
+                    self._armed.pop(key, None)
+        finally:
+            self._lock.release()
+
+        if remaining:
+            self._rearm(key, type)
+
+        for callback, _once in callbacks:
+            try:
+                callback(handle, type, state, path)
+            except Exception:
+                logger.exception('Watch callback %s failed for %s' % (callback, path))
+
+    def _rearm(self, key, type):
+        path, kind = key
+        if kind != WatchKind.Exists and type == zookeeper.DELETED_EVENT:
+            # wait for the node to come back
+            self._arm_exists(key)
+            return
+
+        self._lock.acquire()
+        self._armed[key] = kind
+        fires = self._fires
+        self._lock.release()
+
+        def armed(future):
+            if future.exception() is None:
+                self._remember(key, fires, future.result())
+            elif isinstance(future.exception(), zookeeper.NoNodeException):
+                self._arm_exists(key)
+            elif future.exception() is not None:
+                logger.error('Could not re-arm %s watch on %s: %s' % (kind, path, future.exception()))
+                self._lock.acquire()
+                self._armed.pop(key, None)
+                self._lock.release()
+        getattr(self._connection, kind + '_async')(path, self._watcher(key)).add_done_callback(armed)